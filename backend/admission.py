@@ -0,0 +1,288 @@
+"""
+Contrôle d'admission des générations : limite le nombre de processus claude (ou de
+requêtes à l'API) simultanés, pour qu'une rafale de demandes ne sature pas la mémoire.
+
+- au plus GENERATION_CONCURRENCE_MAX générations en cours ; au-delà, les demandes
+  attendent leur tour (premier arrivé, premier servi), dans une file de
+  GENERATION_FILE_MAX places et pas plus de GENERATION_ATTENTE_MAX secondes
+- au plus GENERATION_CONCURRENCE_PAR_CLIENT générations en cours ou en attente par client
+- file pleine, attente trop longue ou client au-delà de sa limite : 429 immédiat avec Retry-After
+- disjoncteur : après DISJONCTEUR_SEUIL échecs consécutifs du backend, les générations sont
+  refusées (503) pendant DISJONCTEUR_DELAI secondes ; une seule génération d'essai est
+  ensuite admise (semi-ouvert), les autres restant refusées jusqu'à son issue : un échec
+  le rouvre, un succès le referme
+
+Les routes de génération étant synchrones (pool de threads), l'attente bloque le thread
+de la requête : la file bornée borne aussi le nombre de threads occupés à attendre.
+"""
+import os
+import math
+import time
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from metriques import (
+    admission_actives, admission_file, admission_attente, admission_admises, admission_rejets, disjoncteur_etat
+)
+
+# Générations simultanées maximum (tous clients confondus, jobs compris)
+GENERATION_CONCURRENCE_MAX = int(os.environ.get("GENERATION_CONCURRENCE_MAX", "4"))
+# Générations en cours ou en attente maximum pour un même client
+GENERATION_CONCURRENCE_PAR_CLIENT = int(os.environ.get("GENERATION_CONCURRENCE_PAR_CLIENT", "2"))
+# Places dans la file d'attente
+GENERATION_FILE_MAX = int(os.environ.get("GENERATION_FILE_MAX", "8"))
+# Attente maximum dans la file (secondes)
+GENERATION_ATTENTE_MAX = float(os.environ.get("GENERATION_ATTENTE_MAX", "30"))
+# Échecs consécutifs du backend qui ouvrent le disjoncteur
+DISJONCTEUR_SEUIL = int(os.environ.get("DISJONCTEUR_SEUIL", "5"))
+# Durée d'ouverture du disjoncteur (secondes)
+DISJONCTEUR_DELAI = float(os.environ.get("DISJONCTEUR_DELAI", "30"))
+# Proxys de confiance devant le serveur (reverse proxy de Coolify : 1), qui ajoutent chacun
+# l'adresse de leur client à X-Forwarded-For ; 0 : l'en-tête, réglable par le client, est ignoré
+PROXYS_DE_CONFIANCE = int(os.environ.get("PROXYS_DE_CONFIANCE", "0"))
+
+FERME, OUVERT, SEMI_OUVERT = "ferme", "ouvert", "semi_ouvert"
+_VALEURS_ETAT = {FERME: 0, OUVERT: 1, SEMI_OUVERT: 2}
+# Retry-After (secondes) des demandes refusées pendant la génération d'essai
+ATTENTE_ESSAI = 1.0
+
+
+class Disjoncteur:
+    def __init__(self, seuil: int = DISJONCTEUR_SEUIL, delai: float = DISJONCTEUR_DELAI):
+        self.seuil = seuil
+        self.delai = delai
+        self.echecs_consecutifs = 0
+        self.ouvertures = 0
+        self._ouvert_jusqua = 0.0
+        self._etat = FERME
+        # Numéro de la génération d'essai en cours (semi-ouvert), None s'il n'y en a pas
+        self._essai: Optional[int] = None
+        self._essais = 0
+        self._verrou = threading.Lock()
+
+    def _changer(self, etat: str):
+        self._etat = etat
+        disjoncteur_etat.definir(_VALEURS_ETAT[etat])
+
+    def _attente(self) -> float:
+        if self._etat == OUVERT:
+            restant = self._ouvert_jusqua - time.monotonic()
+            if restant > 0:
+                return restant
+            self._changer(SEMI_OUVERT)
+        if self._etat == SEMI_OUVERT and self._essai is not None:
+            return ATTENTE_ESSAI
+        return 0.0
+
+    def attente_restante(self) -> float:
+        """0 si une génération peut être admise, sinon le temps avant de réessayer (sans réserver l'essai)"""
+        with self._verrou:
+            return self._attente()
+
+    def demander(self) -> Tuple[float, Optional[int]]:
+        """
+        Autorise une génération qui a obtenu sa place : (attente, essai).
+
+        Semi-ouvert, la première demande devient la génération d'essai (numéro retourné,
+        à rendre par abandonner_essai si elle n'atteint pas le backend) ; les suivantes
+        reçoivent une attente tant que l'essai n'a pas d'issue.
+        """
+        with self._verrou:
+            attente = self._attente()
+            if attente or self._etat != SEMI_OUVERT:
+                return attente, None
+            self._essais += 1
+            self._essai = self._essais
+            return 0.0, self._essai
+
+    def abandonner_essai(self, essai: int):
+        """Génération d'essai terminée sans issue enregistrée (annulée, erreur avant le backend...)"""
+        with self._verrou:
+            if self._essai == essai:
+                self._essai = None
+
+    def enregistrer(self, succes: bool):
+        with self._verrou:
+            # Semi-ouvert, toute issue est celle de l'essai : il est soit refermé, soit rouvert
+            self._essai = None
+            if succes:
+                self.echecs_consecutifs = 0
+                if self._etat != FERME:
+                    self._changer(FERME)
+                return
+            self.echecs_consecutifs += 1
+            if self._etat == OUVERT:
+                return
+            if self._etat == SEMI_OUVERT or self.echecs_consecutifs >= self.seuil:
+                self._ouvert_jusqua = time.monotonic() + self.delai
+                self.ouvertures += 1
+                self._changer(OUVERT)
+
+    def statut(self) -> Dict:
+        with self._verrou:
+            return {"etat": self._etat, "essai_en_cours": self._essai is not None,
+                    "echecs_consecutifs": self.echecs_consecutifs,
+                    "ouvertures": self.ouvertures, "seuil": self.seuil, "delai": self.delai}
+
+
+class Place:
+    """Place obtenue auprès du contrôleur ; libérée une seule fois, même si liberer() est rappelé"""
+
+    def __init__(self, controleur: "ControleurAdmission", client: Optional[str]):
+        self._controleur = controleur
+        self._client = client
+        self._debut = time.monotonic()
+        self._liberee = False
+        # Numéro de la génération d'essai du disjoncteur, si c'en est une
+        self.essai: Optional[int] = None
+
+    def liberer(self):
+        if not self._liberee:
+            self._liberee = True
+            if self.essai is not None:
+                self._controleur.disjoncteur.abandonner_essai(self.essai)
+            self._controleur._liberer(self._client, time.monotonic() - self._debut)
+
+    def __enter__(self) -> "Place":
+        return self
+
+    def __exit__(self, *exc):
+        self.liberer()
+
+
+class ControleurAdmission:
+    def __init__(self, concurrence_max: int = GENERATION_CONCURRENCE_MAX,
+                 par_client: int = GENERATION_CONCURRENCE_PAR_CLIENT,
+                 file_max: int = GENERATION_FILE_MAX, attente_max: float = GENERATION_ATTENTE_MAX):
+        self.concurrence_max = concurrence_max
+        self.par_client = par_client
+        self.file_max = file_max
+        self.attente_max = attente_max
+        self.disjoncteur = Disjoncteur()
+        self._actives = 0
+        self._attentes: Deque[threading.Event] = deque()
+        self._par_client: Dict[str, int] = {}
+        # Réentrant : _rejeter compte le rejet, y compris depuis une section déjà verrouillée
+        self._verrou = threading.RLock()
+        # Durée moyenne d'occupation d'une place (moyenne mobile), pour estimer Retry-After
+        self._duree_moyenne = 10.0
+        self.stats = {"admises": 0, "rejets": 0}
+
+    def _retry_after(self) -> int:
+        """Secondes estimées avant qu'une place se libère pour une nouvelle demande"""
+        tours = 1 + len(self._attentes) / max(self.concurrence_max, 1)
+        return max(1, math.ceil(self._duree_moyenne * tours))
+
+    def _rejeter(self, motif: str, statut: int, detail: str, retry_after: int):
+        admission_rejets.inc(motif=motif)
+        with self._verrou:
+            self.stats["rejets"] += 1
+        raise HTTPException(status_code=statut, detail=detail, headers={"Retry-After": str(retry_after)})
+
+    def admettre(self, client: Optional[str] = None, borne: bool = True) -> Place:
+        """
+        Attend une place et la retourne (à libérer, ou à utiliser comme gestionnaire de contexte).
+
+        Lève HTTPException 429 (file pleine, client à sa limite, attente dépassée) ou
+        503 (disjoncteur ouvert), avec Retry-After. Avec borne=False (jobs, déjà en file
+        dans la base), ni la limite par client ni celles de la file ne s'appliquent.
+        """
+        attente_disjoncteur = self.disjoncteur.attente_restante()
+        if attente_disjoncteur:
+            self._rejeter("disjoncteur", 503, "Génération momentanément indisponible (échecs répétés)",
+                          math.ceil(attente_disjoncteur))
+
+        debut = time.monotonic()
+        with self._verrou:
+            if borne and client is not None and self._par_client.get(client, 0) >= self.par_client:
+                self._rejeter("client", 429, "Trop de générations en cours pour ce client", self._retry_after())
+            if self._actives < self.concurrence_max and not self._attentes:
+                evenement = None
+                self._actives += 1
+            elif borne and len(self._attentes) >= self.file_max:
+                self._rejeter("file_pleine", 429, "Trop de générations en attente", self._retry_after())
+            else:
+                evenement = threading.Event()
+                self._attentes.append(evenement)
+            if client is not None:
+                self._par_client[client] = self._par_client.get(client, 0) + 1
+            self._publier()
+
+        if evenement is not None and not evenement.wait(self.attente_max if borne else None):
+            with self._verrou:
+                # La place a pu être cédée entre l'expiration et la prise du verrou
+                if not evenement.is_set():
+                    self._attentes.remove(evenement)
+                    self._decompter_client(client)
+                    self._publier()
+                    self._rejeter("attente", 429, "Attente d'une place de génération trop longue", self._retry_after())
+
+        place = Place(self, client)
+        # Le disjoncteur a pu s'ouvrir pendant l'attente ; semi-ouvert, une seule génération d'essai passe
+        attente_disjoncteur, place.essai = self.disjoncteur.demander()
+        if attente_disjoncteur:
+            place.liberer()
+            self._rejeter("disjoncteur", 503, "Génération momentanément indisponible (échecs répétés)",
+                          math.ceil(attente_disjoncteur))
+
+        admission_attente.observer(time.monotonic() - debut)
+        admission_admises.inc()
+        with self._verrou:
+            self.stats["admises"] += 1
+        return place
+
+    def _decompter_client(self, client: Optional[str]):
+        if client is None:
+            return
+        restant = self._par_client[client] - 1
+        if restant:
+            self._par_client[client] = restant
+        else:
+            del self._par_client[client]
+
+    def _liberer(self, client: Optional[str], duree: float):
+        with self._verrou:
+            self._duree_moyenne = 0.8 * self._duree_moyenne + 0.2 * duree
+            self._decompter_client(client)
+            if self._attentes:
+                # La place passe directement au premier en attente : _actives ne change pas
+                self._attentes.popleft().set()
+            else:
+                self._actives -= 1
+            self._publier()
+
+    def _publier(self):
+        admission_actives.definir(self._actives)
+        admission_file.definir(len(self._attentes))
+
+    def statut(self) -> Dict:
+        with self._verrou:
+            statut = {"actives": self._actives, "en_attente": len(self._attentes),
+                      "concurrence_max": self.concurrence_max, "par_client": self.par_client,
+                      "file_max": self.file_max, "duree_moyenne": self._duree_moyenne, **self.stats}
+        return {**statut, "disjoncteur": self.disjoncteur.statut()}
+
+
+def identifier_client(request: Request, proxys: Optional[int] = None) -> str:
+    """
+    Client à l'origine de la requête, pour la limite par client.
+
+    Sans proxy de confiance, l'adresse de la connexion. Derrière `proxys` proxys de
+    confiance, l'adresse ajoutée à X-Forwarded-For par le premier d'entre eux (la plus
+    à droite qui ne vient pas d'un proxy de confiance) : celles écrites plus à gauche
+    viennent du client et ne prouvent rien.
+    """
+    proxys = PROXYS_DE_CONFIANCE if proxys is None else proxys
+    adresse = request.client.host if request.client else "inconnu"
+    if proxys <= 0:
+        return adresse
+    # Le dernier proxy est la connexion elle-même ; chacun des autres a ajouté une adresse à droite
+    chaine = [partie.strip() for partie in request.headers.get("x-forwarded-for", "").split(",") if partie.strip()]
+    chaine.append(adresse)
+    return chaine[max(0, len(chaine) - 1 - proxys)]
+
+
+admission = ControleurAdmission()
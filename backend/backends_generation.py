@@ -0,0 +1,305 @@
+"""
+Backends de génération : ce qui transforme le prompt complet en flux de texte.
+
+- cli : un processus `claude -p` par génération, pris dans le pool de processus
+  pré-démarrés (voir pool_claude.py)
+- http : appel direct de l'API Messages en streaming, par un client httpx asynchrone
+  persistant (connexions réutilisées), avec délais d'attente et nouvelles tentatives
+
+Le backend est choisi par GENERATION_BACKEND. Le découpage chapitre / résumé, le cache
+et les métriques communes restent dans claude_service.py.
+"""
+import os
+import json
+import time
+import queue
+import random
+import asyncio
+import logging
+import threading
+from typing import Dict, Iterator, Optional
+
+from pool_claude import pool
+from metriques import generation_lancement, generation_premier_octet
+
+logger = logging.getLogger(__name__)
+
+GENERATION_BACKEND = os.environ.get("GENERATION_BACKEND", "cli")
+
+# Durée maximale d'une génération (secondes)
+TIMEOUT_GENERATION = 120
+
+# API Messages (backend http)
+GENERATION_HTTP_URL = os.environ.get("GENERATION_HTTP_URL", "https://api.anthropic.com")
+ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY", "")
+GENERATION_HTTP_MODELE = os.environ.get("GENERATION_HTTP_MODELE", "claude-sonnet-4-5")
+# Limite de tokens de la réponse : un chapitre de 1600 mots et son résumé en font environ 3000
+GENERATION_HTTP_MAX_TOKENS = int(os.environ.get("GENERATION_HTTP_MAX_TOKENS", "8192"))
+# Connexions simultanées maximum vers l'API (au-delà, les générations attendent une connexion)
+GENERATION_HTTP_CONNEXIONS = int(os.environ.get("GENERATION_HTTP_CONNEXIONS", "20"))
+# Nombre de tentatives d'une requête refusée (429, 5xx) ou dont la connexion a échoué
+GENERATION_HTTP_TENTATIVES = int(os.environ.get("GENERATION_HTTP_TENTATIVES", "3"))
+# Délai avant la deuxième tentative (secondes), doublé à chaque tentative suivante
+GENERATION_HTTP_DELAI_REESSAI = float(os.environ.get("GENERATION_HTTP_DELAI_REESSAI", "0.5"))
+# Silence maximum entre deux morceaux du flux (secondes)
+GENERATION_HTTP_TIMEOUT_LECTURE = float(os.environ.get("GENERATION_HTTP_TIMEOUT_LECTURE", "60"))
+
+VERSION_API = "2023-06-01"
+# 529 : API surchargée
+STATUTS_REESSAYABLES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class BackendCLI:
+    """Génération par le CLI claude, un processus du pool par génération"""
+
+    nom = "cli"
+
+    def generer(self, prompt_complet: str) -> Iterator[str]:
+        """
+        Envoie le prompt à un processus Claude et produit le texte au fil de l'eau.
+
+        Le processus est tué si le générateur est fermé avant la fin
+        ou si TIMEOUT_GENERATION est dépassé.
+        """
+        debut = time.perf_counter()
+        try:
+            process = pool.acquerir()
+        except FileNotFoundError:
+            logger.error("Claude CLI introuvable")
+            raise Exception("Claude CLI n'est pas installé ou accessible")
+        generation_lancement.observer(time.perf_counter() - debut)
+
+        expire = threading.Event()
+
+        def _tuer():
+            expire.set()
+            process.kill()
+
+        minuteur = threading.Timer(TIMEOUT_GENERATION, _tuer)
+        minuteur.start()
+        try:
+            envoi = time.perf_counter()
+            try:
+                process.stdin.write(prompt_complet)
+                process.stdin.close()
+            except BrokenPipeError:
+                # Le processus est mort avant de lire le prompt : l'erreur est rapportée ci-dessous
+                pass
+
+            premier_octet = True
+            for ligne in process.stdout:
+                if premier_octet:
+                    attente = time.perf_counter() - envoi
+                    generation_premier_octet.observer(attente)
+                    pool.noter_premier_octet(process, attente)
+                    premier_octet = False
+                texte = _extraire_texte_flux(ligne)
+                if texte:
+                    yield texte
+
+            process.wait()
+            if expire.is_set():
+                raise Exception("La génération a pris trop de temps")
+            if process.returncode != 0:
+                erreur = pool.lire_erreurs(process)
+                logger.error("Erreur du CLI claude", extra={"champs": {"code_retour": process.returncode},
+                                                             "charge": erreur})
+                raise Exception(f"Erreur Claude CLI: {erreur}")
+        finally:
+            minuteur.cancel()
+            pool.liberer(process)
+
+    def demarrer(self):
+        pool.demarrer()
+
+    def arreter(self):
+        pool.arreter()
+
+    def statut(self) -> Dict:
+        return {"backend": self.nom, **pool.statut()}
+
+
+def _extraire_texte_flux(ligne: str) -> Optional[str]:
+    """
+    Extrait le texte d'une ligne émise par `claude --output-format stream-json`.
+
+    Une ligne qui n'est pas du JSON est considérée comme du texte brut.
+    """
+    try:
+        message = json.loads(ligne)
+    except ValueError:
+        return ligne
+
+    if not isinstance(message, dict):
+        return ligne
+    if message.get("type") == "stream_event":
+        evenement = message.get("event", {})
+        delta = evenement.get("delta", {})
+        if evenement.get("type") == "content_block_delta" and delta.get("type") == "text_delta":
+            return delta.get("text", "")
+    return None
+
+
+class ErreurReessayable(Exception):
+    def __init__(self, message: str, attente: Optional[float] = None):
+        super().__init__(message)
+        self.attente = attente
+
+
+_FIN = object()
+
+
+class BackendHTTP:
+    """
+    Génération par l'API Messages en streaming (SSE).
+
+    Le client httpx asynchrone vit dans une boucle d'événements dédiée, démarrée à la
+    première utilisation : ses connexions sont réutilisées par toutes les générations,
+    qu'elles viennent des routes synchrones, des jobs ou du cache de générations.
+    Une requête n'est retentée que si aucun texte n'a encore été produit.
+    """
+
+    nom = "http"
+
+    def __init__(self, url: str = GENERATION_HTTP_URL, cle_api: str = ANTHROPIC_API_KEY,
+                 modele: str = GENERATION_HTTP_MODELE, tentatives: int = GENERATION_HTTP_TENTATIVES):
+        self.url = url.rstrip("/")
+        self.cle_api = cle_api
+        self.modele = modele
+        self.tentatives = max(1, tentatives)
+        self._boucle: Optional[asyncio.AbstractEventLoop] = None
+        self._client = None
+        self._verrou = threading.Lock()
+        self.stats = {"requetes": 0, "reessais": 0, "erreurs": 0}
+
+    def _compter(self, compteur: str):
+        with self._verrou:
+            self.stats[compteur] += 1
+
+    def demarrer(self) -> asyncio.AbstractEventLoop:
+        import httpx
+
+        with self._verrou:
+            if self._boucle is None:
+                self._client = httpx.AsyncClient(
+                    base_url=self.url,
+                    headers={"x-api-key": self.cle_api, "anthropic-version": VERSION_API},
+                    timeout=httpx.Timeout(10.0, read=GENERATION_HTTP_TIMEOUT_LECTURE),
+                    limits=httpx.Limits(max_connections=GENERATION_HTTP_CONNEXIONS,
+                                        max_keepalive_connections=GENERATION_HTTP_CONNEXIONS),
+                )
+                self._boucle = asyncio.new_event_loop()
+                threading.Thread(target=self._boucle.run_forever, name="generation-http", daemon=True).start()
+            return self._boucle
+
+    def arreter(self):
+        with self._verrou:
+            boucle, client = self._boucle, self._client
+            self._boucle = self._client = None
+        if boucle is not None:
+            asyncio.run_coroutine_threadsafe(client.aclose(), boucle).result(timeout=5)
+            boucle.call_soon_threadsafe(boucle.stop)
+
+    def _attente(self, tentative: int, retry_after: Optional[float]) -> float:
+        attente = GENERATION_HTTP_DELAI_REESSAI * 2 ** tentative * random.uniform(0.5, 1.0)
+        return max(attente, retry_after or 0)
+
+    async def _requete(self, prompt_complet: str, file: queue.Queue, etat: Dict):
+        """Une tentative ; etat["produit"] passe à True dès que du texte a été transmis"""
+        corps = {
+            "model": self.modele,
+            "max_tokens": GENERATION_HTTP_MAX_TOKENS,
+            "stream": True,
+            "messages": [{"role": "user", "content": prompt_complet}],
+        }
+        debut = time.perf_counter()
+        async with self._client.stream("POST", "/v1/messages", json=corps) as reponse:
+            generation_lancement.observer(time.perf_counter() - debut)
+            if reponse.status_code >= 400:
+                detail = (await reponse.aread()).decode("utf-8", "replace")
+                message = f"Erreur API {reponse.status_code}: {detail[:500]}"
+                if reponse.status_code in STATUTS_REESSAYABLES:
+                    retry_after = reponse.headers.get("retry-after")
+                    raise ErreurReessayable(message, float(retry_after) if retry_after and retry_after.isdigit() else None)
+                raise Exception(message)
+
+            async for ligne in reponse.aiter_lines():
+                if not ligne.startswith("data:"):
+                    continue
+                evenement = json.loads(ligne[5:])
+                if evenement.get("type") == "content_block_delta":
+                    delta = evenement.get("delta", {})
+                    if delta.get("type") == "text_delta" and delta.get("text"):
+                        if not etat["produit"]:
+                            generation_premier_octet.observer(time.perf_counter() - debut)
+                            etat["produit"] = True
+                        file.put(delta["text"])
+                elif evenement.get("type") == "error":
+                    erreur = evenement.get("error", {})
+                    message = f"Erreur API: {erreur.get('type')}: {erreur.get('message')}"
+                    if etat["produit"]:
+                        raise Exception(message)
+                    raise ErreurReessayable(message)
+
+    async def _produire(self, prompt_complet: str, file: queue.Queue):
+        import httpx
+
+        etat = {"produit": False}
+        try:
+            for tentative in range(self.tentatives):
+                self._compter("requetes")
+                try:
+                    await self._requete(prompt_complet, file, etat)
+                    return
+                except (ErreurReessayable, httpx.TransportError) as e:
+                    # Un flux interrompu après du texte n'est pas retenté : le client l'a déjà reçu
+                    if tentative == self.tentatives - 1 or etat["produit"]:
+                        raise Exception(str(e) or type(e).__name__) from e
+                    attente = self._attente(tentative, getattr(e, "attente", None))
+                    logger.warning("Génération http retentée", extra={"champs": {
+                        "tentative": tentative + 1, "attente_s": round(attente, 2), "erreur": str(e) or type(e).__name__
+                    }})
+                    self._compter("reessais")
+                    await asyncio.sleep(attente)
+        finally:
+            file.put(_FIN)
+
+    def generer(self, prompt_complet: str) -> Iterator[str]:
+        boucle = self.demarrer()
+        file: queue.Queue = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(
+            asyncio.wait_for(self._produire(prompt_complet, file), TIMEOUT_GENERATION), boucle
+        )
+        try:
+            while True:
+                morceau = file.get()
+                if morceau is _FIN:
+                    break
+                yield morceau
+            try:
+                future.result()
+            except asyncio.TimeoutError:
+                raise Exception("La génération a pris trop de temps")
+        except Exception:
+            self._compter("erreurs")
+            raise
+        finally:
+            # Générateur fermé avant la fin (client parti) : la requête en cours est annulée
+            future.cancel()
+
+    def statut(self) -> Dict:
+        with self._verrou:
+            stats = dict(self.stats)
+        return {"backend": self.nom, "http": {"url": self.url, "modele": self.modele,
+                                              "connexions_max": GENERATION_HTTP_CONNEXIONS, **stats}}
+
+
+def creer_backend(nom: str = GENERATION_BACKEND):
+    if nom == "http":
+        return BackendHTTP()
+    if nom != "cli":
+        logger.warning(f"GENERATION_BACKEND inconnu: {nom}, backend cli utilisé")
+    return BackendCLI()
+
+
+backend_generation = creer_backend()
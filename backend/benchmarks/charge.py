@@ -0,0 +1,297 @@
+"""
+Test de charge : lectures et générations mêlées, avec un faux CLI claude.
+
+Le faux CLI (benchmarks/faux_claude/claude) est placé en tête du PATH : le pool de
+processus le démarre comme le vrai, et sa latence, la taille de sa sortie et son
+taux d'échec sont réglables. Avec --backend http, les générations passent par le
+backend http, servi par le substitut de l'API Messages (benchmarks/faux_api_messages.py)
+avec les mêmes réglages. La base temporaire est peuplée de livres de taille
+réaliste, puis des clients simultanés tirent chacun leur prochaine requête au hasard
+(graine fixe) selon la pondération de LECTURES et GENERATIONS.
+
+Par route : nombre de requêtes, erreurs, débit et latences p50/p95/p99. Pour
+generer-stream, le délai du premier événement est aussi mesuré. Les résultats sont
+écrits en JSON (--sortie), et comparés à ceux d'un commit précédent avec --reference.
+
+Usage (depuis backend/) :
+    python benchmarks/charge.py [--duree 30] [--clients 16] [--part-generation 0.1] [--backend cli|http]
+        [--latence-claude 0.5] [--duree-claude 1.0] [--mots 1200] [--taux-echec 0]
+        [--sortie charge.json] [--reference charge-precedent.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAUX_CLAUDE = os.path.join(BACKEND, "benchmarks", "faux_claude")
+
+# (route, poids) : lectures d'une part, générations de l'autre (--part-generation répartit entre les deux)
+LECTURES = [
+    ("GET /livres", 10),
+    ("GET /livres/{id}", 10),
+    ("GET /livres/{id}/complet", 5),
+    ("GET /livres/{id}/chapitres", 15),
+    ("GET /chapitres/{id}/contenus", 15),
+    ("GET /recherche", 5),
+]
+GENERATIONS = [
+    ("POST /chapitres/{id}/generer", 1),
+    ("POST /chapitres/{id}/generer-stream", 1),
+]
+PREMIER_EVENEMENT = "POST /chapitres/{id}/generer-stream (premier événement)"
+
+VOCABULAIRE = (
+    "la forêt lune Rebecca chemin lanterne rivière silence vent porte ancienne murmure étoile "
+    "renard jardin secret pluie château lumière ombre voyage grand-mère village horloge"
+).split()
+RECHERCHES = ["renard", "château lumière", "lant*", "rivière secret", "horloge"]
+
+
+def texte(rng: random.Random, mots: int) -> str:
+    return " ".join(rng.choice(VOCABULAIRE) for _ in range(mots))
+
+
+def peupler(nb_livres: int, nb_chapitres: int, mots: int, rng: random.Random) -> List[Dict]:
+    """Crée les livres (un contenu généré par chapitre) ; retourne [{"livre": id, "chapitres": [ids]}]"""
+    from sqlalchemy import insert
+    from database import SessionLocal
+    from models import Livre, Chapitre, Contenu
+
+    db = SessionLocal()
+    try:
+        livres = []
+        for n in range(nb_livres):
+            livre_id = db.execute(insert(Livre).returning(Livre.id), {
+                "titre": f"Livre {n} : {texte(rng, 3)}", "description": texte(rng, 40)
+            }).scalar_one()
+            chapitre_ids = list(db.execute(insert(Chapitre).returning(Chapitre.id), [
+                {"livre_id": livre_id, "titre": f"Chapitre {ordre} : {texte(rng, 3)}", "ordre": ordre}
+                for ordre in range(1, nb_chapitres + 1)
+            ]).scalars())
+            db.execute(insert(Contenu), [
+                {"chapitre_id": chapitre_id, "texte_utilisateur": texte(rng, 30),
+                 "texte_genere": texte(rng, mots), "resume": texte(rng, 60)}
+                for chapitre_id in chapitre_ids
+            ])
+            livres.append({"livre": livre_id, "chapitres": chapitre_ids})
+        db.commit()
+        return livres
+    finally:
+        db.close()
+
+
+def demarrer_serveur(app) -> str:
+    import uvicorn
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    serveur = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=serveur.run, daemon=True).start()
+    while not serveur.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def percentile(valeurs: List[float], p: float) -> float:
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(len(valeurs) * p))]
+
+
+class Mesures:
+    def __init__(self):
+        self.latences: Dict[str, List[float]] = defaultdict(list)
+        self.erreurs: Dict[str, int] = defaultdict(int)
+
+    def ajouter(self, route: str, duree: float, erreur: bool):
+        self.latences[route].append(duree)
+        if erreur:
+            self.erreurs[route] += 1
+
+    def resume(self, duree: float) -> Dict:
+        routes = {}
+        for route, latences in sorted(self.latences.items()):
+            routes[route] = {
+                "requetes": len(latences),
+                "erreurs": self.erreurs[route],
+                "debit_rps": len(latences) / duree,
+                "moyenne_ms": sum(latences) / len(latences) * 1000,
+                "p50_ms": percentile(latences, 0.50) * 1000,
+                "p95_ms": percentile(latences, 0.95) * 1000,
+                "p99_ms": percentile(latences, 0.99) * 1000,
+            }
+        requetes = sum(len(latences) for route, latences in self.latences.items() if route != PREMIER_EVENEMENT)
+        erreurs = sum(n for route, n in self.erreurs.items() if route != PREMIER_EVENEMENT)
+        return {"total": {"requetes": requetes, "erreurs": erreurs, "debit_rps": requetes / duree}, "routes": routes}
+
+
+async def executer(client, route: str, livre: Dict, chapitre_id: int, rng: random.Random, mesures: Mesures):
+    livre_id = livre["livre"]
+    debut = time.perf_counter()
+    if route == "GET /livres":
+        reponse = await client.get("/livres", params={"vue": "resume"})
+    elif route == "GET /livres/{id}":
+        reponse = await client.get(f"/livres/{livre_id}")
+    elif route == "GET /livres/{id}/complet":
+        reponse = await client.get(f"/livres/{livre_id}/complet")
+    elif route == "GET /livres/{id}/chapitres":
+        reponse = await client.get(f"/livres/{livre_id}/chapitres")
+    elif route == "GET /chapitres/{id}/contenus":
+        reponse = await client.get(f"/chapitres/{chapitre_id}/contenus")
+    elif route == "GET /recherche":
+        reponse = await client.get("/recherche", params={"q": rng.choice(RECHERCHES)})
+    else:
+        # Prompt unique et nouvelle_variante : chaque génération passe par le CLI, pas par le cache
+        corps = {"prompt": f"{texte(rng, 12)} ({rng.random()})", "nouvelle_variante": True}
+        if route.endswith("generer-stream"):
+            erreur = False
+            async with client.stream("POST", f"/chapitres/{chapitre_id}/generer-stream", json=corps) as reponse:
+                premier = None
+                async for ligne in reponse.aiter_lines():
+                    if premier is None and ligne.startswith("event:"):
+                        premier = time.perf_counter() - debut
+                    erreur = erreur or ligne == "event: erreur"
+            if premier is not None:
+                mesures.ajouter(PREMIER_EVENEMENT, premier, False)
+            mesures.ajouter(route, time.perf_counter() - debut, erreur or reponse.status_code >= 400)
+            return
+        reponse = await client.post(f"/chapitres/{chapitre_id}/generer", json=corps)
+    mesures.ajouter(route, time.perf_counter() - debut, reponse.status_code >= 400)
+
+
+async def charger(url: str, livres: List[Dict], args) -> Mesures:
+    import httpx
+
+    mesures = Mesures()
+    lectures, poids_lectures = zip(*LECTURES)
+    generations, poids_generations = zip(*GENERATIONS)
+    fin = time.monotonic() + args.duree
+    limites = httpx.Limits(max_connections=args.clients + 10)
+
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limites) as client:
+        async def utilisateur(numero: int):
+            rng = random.Random(args.graine * 1000 + numero)
+            while time.monotonic() < fin:
+                if rng.random() < args.part_generation:
+                    route = rng.choices(generations, poids_generations)[0]
+                else:
+                    route = rng.choices(lectures, poids_lectures)[0]
+                livre = rng.choice(livres)
+                debut = time.perf_counter()
+                try:
+                    await executer(client, route, livre, rng.choice(livre["chapitres"]), rng, mesures)
+                except httpx.HTTPError as e:
+                    logging.warning(f"{route}: {e!r}")
+                    mesures.ajouter(route, time.perf_counter() - debut, True)
+
+        await asyncio.gather(*(utilisateur(n) for n in range(args.clients)))
+    return mesures
+
+
+def commit_courant() -> Optional[str]:
+    try:
+        resultat = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND,
+                                  capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return resultat.stdout.strip()
+
+
+def afficher(resultats: Dict, reference: Optional[Dict]):
+    print(f"{'route':<56} {'req':>6} {'err':>5} {'req/s':>7} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9}"
+          + (f" {'Δp95':>8}" if reference else ""))
+    for route, stats in resultats["routes"].items():
+        ligne = (f"{route:<56} {stats['requetes']:>6} {stats['erreurs']:>5} {stats['debit_rps']:>7.1f} "
+                 f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+        if reference:
+            avant = reference["routes"].get(route)
+            ligne += f" {(stats['p95_ms'] / avant['p95_ms'] - 1) * 100:>+7.0f}%" if avant else f" {'-':>8}"
+        print(ligne)
+    total = resultats["total"]
+    print(f"\nTotal : {total['requetes']} requêtes, {total['erreurs']} erreurs, {total['debit_rps']:.1f} req/s")
+    if reference:
+        print(f"Référence ({reference.get('commit') or '?'}) : {reference['total']['debit_rps']:.1f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duree", type=float, default=30.0, help="durée de la mesure (s)")
+    parser.add_argument("--clients", type=int, default=16, help="clients simultanés")
+    parser.add_argument("--part-generation", type=float, default=0.1, help="proportion de requêtes de génération")
+    parser.add_argument("--livres", type=int, default=20)
+    parser.add_argument("--chapitres", type=int, default=12, help="chapitres par livre")
+    parser.add_argument("--mots", type=int, default=1200, help="mots par chapitre (base et faux claude)")
+    parser.add_argument("--latence-claude", type=float, default=0.5, help="délai avant le premier morceau (s)")
+    parser.add_argument("--duree-claude", type=float, default=1.0, help="durée d'émission du chapitre (s)")
+    parser.add_argument("--taux-echec", type=float, default=0.0, help="probabilité d'échec d'une génération")
+    parser.add_argument("--backend", choices=("cli", "http"), default="cli", help="backend de génération")
+    parser.add_argument("--pool", type=int, default=2, help="processus claude pré-démarrés (CLAUDE_POOL_TAILLE)")
+    parser.add_argument("--graine", type=int, default=42)
+    parser.add_argument("--sortie", default="charge.json", help="fichier de résultats JSON")
+    parser.add_argument("--reference", help="résultats JSON d'un commit précédent, à comparer")
+    args = parser.parse_args()
+
+    # Lu par database.py, pool_claude.py et, via l'environnement des processus lancés, par le faux claude
+    os.environ.update({
+        "DATABASE_PATH": os.path.join(tempfile.mkdtemp(), "bench_charge.db"),
+        "PATH": FAUX_CLAUDE + os.pathsep + os.environ.get("PATH", ""),
+        "CLAUDE_POOL_TAILLE": str(args.pool),
+        "LOG_LEVEL": "WARNING",
+        "FAUX_CLAUDE_LATENCE": str(args.latence_claude),
+        "FAUX_CLAUDE_DUREE": str(args.duree_claude),
+        "FAUX_CLAUDE_MOTS": str(args.mots),
+        "FAUX_CLAUDE_TAUX_ECHEC": str(args.taux_echec),
+    })
+    os.environ.pop("DEMARRAGE_RAPIDE", None)
+    sys.path.insert(0, BACKEND)
+
+    if args.backend == "http":
+        from faux_api_messages import creer_app
+        os.environ["GENERATION_BACKEND"] = "http"
+        os.environ["GENERATION_HTTP_URL"] = demarrer_serveur(
+            creer_app(args.latence_claude, args.duree_claude, args.mots, args.taux_echec)
+        )
+
+    from main import app
+    url = demarrer_serveur(app)
+    logging.getLogger().setLevel(logging.WARNING)
+    livres = peupler(args.livres, args.chapitres, args.mots, random.Random(args.graine))
+    print(f"{args.livres} livres de {args.chapitres} chapitres, {args.clients} clients pendant {args.duree}s, "
+          f"{args.part_generation:.0%} de générations\n")
+
+    debut = time.monotonic()
+    mesures = asyncio.run(charger(url, livres, args))
+    duree = time.monotonic() - debut
+
+    resultats = {
+        "commit": commit_courant(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "parametres": vars(args),
+        "duree_s": duree,
+        **mesures.resume(duree),
+    }
+    reference = None
+    if args.reference:
+        with open(args.reference, encoding="utf-8") as f:
+            reference = json.load(f)
+    afficher(resultats, reference)
+
+    with open(args.sortie, "w", encoding="utf-8") as f:
+        json.dump(resultats, f, ensure_ascii=False, indent=2)
+    print(f"Résultats écrits dans {args.sortie}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Benchmark taille du prompt / pertinence du contexte de génération.
+
+Compare, sur un livre synthétique, trois façons de construire le contexte :
+- integral : tous les chapitres précédents en entier (comportement historique)
+- resume : derniers chapitres en entier + résumé des plus anciens
+- resume+passages : idem + passages retrouvés par l'index BM25 à partir du prompt
+
+La pertinence est mesurée sur les paragraphes des chapitres anciens qui citent
+un personnage ou un lieu du prompt : rappel (combien figurent dans le prompt)
+et précision (parmi les passages ajoutés, combien en citent un).
+
+Usage (depuis backend/) :
+    python benchmarks/contexte_pertinence.py [--chapitres 30] [--paragraphes 14]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench_contexte.db")
+
+from database import engine, SessionLocal  # noqa: E402
+from migrations import migrer  # noqa: E402
+from models import Livre, Chapitre, Contenu  # noqa: E402
+from claude_service import construire_prompt  # noqa: E402
+from contexte import construire_contexte  # noqa: E402
+
+PERSONNAGES = ["Rebecca", "Pim", "Zéphyr", "Lila", "Orso", "Maëlle", "Basile", "Ondine"]
+LIEUX = ["Brumeval", "Clairbois", "Pierrelune", "Vaumarais"]
+VOCABULAIRE = (
+    "le vent soufflait sur la colline tandis que les étoiles brillaient au loin une lanterne "
+    "dansait dans la nuit la rivière chantait doucement entre les pierres moussues un oiseau "
+    "curieux observait la scène depuis une branche tordue les feuilles murmuraient des secrets "
+    "anciens et la lune veillait sur le sommeil du village endormi"
+).split()
+
+PROMPTS = [
+    "Rebecca retourne à Brumeval pour retrouver Orso",
+    "Lila et Basile explorent Pierrelune",
+    "Ondine découvre un secret à Vaumarais",
+    "Pim prépare une surprise pour Maëlle à Clairbois",
+]
+
+
+def paragraphe(rng: random.Random, entite: str = None) -> str:
+    mots = rng.choices(VOCABULAIRE, k=rng.randint(40, 70))
+    if entite:
+        mots.insert(rng.randint(0, len(mots)), entite)
+    texte = " ".join(mots)
+    return texte[0].upper() + texte[1:] + "."
+
+
+def creer_livre(db, nb_chapitres: int, nb_paragraphes: int, rng: random.Random):
+    """Crée le livre ; retourne (chapitre cible, {chapitre_id: [(paragraphe, entité)]})"""
+    livre = Livre(titre="Livre de benchmark")
+    db.add(livre)
+    db.flush()
+    verite = {}
+    for ordre in range(1, nb_chapitres + 1):
+        chapitre = Chapitre(livre_id=livre.id, titre=f"Chapitre {ordre}", ordre=ordre)
+        db.add(chapitre)
+        db.flush()
+        paragraphes = []
+        for _ in range(nb_paragraphes):
+            entite = rng.choice(PERSONNAGES + LIEUX) if rng.random() < 0.3 else None
+            paragraphes.append((paragraphe(rng, entite), entite))
+        verite[chapitre.id] = paragraphes
+        cites = sorted({e for _, e in paragraphes if e})
+        db.add(Contenu(
+            chapitre_id=chapitre.id,
+            texte_utilisateur="benchmark",
+            texte_genere="\n\n".join(p for p, _ in paragraphes),
+            resume=f"Personnages et lieux : {', '.join(cites) or 'aucun'}."
+        ))
+    cible = Chapitre(livre_id=livre.id, titre="Chapitre cible", ordre=nb_chapitres + 1)
+    db.add(cible)
+    db.commit()
+    return cible, verite
+
+
+def contexte_integral(db, chapitre):
+    precedents = db.query(Chapitre).filter(
+        Chapitre.livre_id == chapitre.livre_id, Chapitre.ordre < chapitre.ordre
+    ).order_by(Chapitre.ordre).all()
+    chapitres = []
+    for chap in precedents:
+        textes = [c.texte_genere for c in db.query(Contenu).filter(Contenu.chapitre_id == chap.id)]
+        chapitres.append({"titre": chap.titre, "contenu": "\n\n".join(textes)})
+    return {"chapitres": chapitres, "passages": [], "resume_histoire": None}
+
+
+def mesurer(nom, construire, db, cible, verite, prompts):
+    tailles, rappels, precisions, durees = [], [], [], []
+    for prompt in prompts:
+        entites = {e for e in PERSONNAGES + LIEUX if e in prompt}
+        debut = time.perf_counter()
+        contexte = construire(db, cible, prompt)
+        durees.append(time.perf_counter() - debut)
+        texte = construire_prompt(
+            prompt, None, contexte["chapitres"], "modere", contexte["resume_histoire"], contexte["passages"]
+        )
+        tailles.append(len(texte))
+
+        pertinents = [p for paragraphes in verite.values() for p, e in paragraphes if e in entites]
+        rappels.append(sum(p in texte for p in pertinents) / len(pertinents) if pertinents else 1.0)
+        if contexte["passages"]:
+            precisions.append(
+                sum(any(e in passage["texte"] for e in entites) for passage in contexte["passages"])
+                / len(contexte["passages"])
+            )
+
+    moyenne = lambda valeurs: sum(valeurs) / len(valeurs) if valeurs else float("nan")  # noqa: E731
+    print(f"{nom:<18} {moyenne(tailles):>12.0f} {moyenne(rappels) * 100:>10.1f}% "
+          f"{moyenne(precisions) * 100:>10.1f}% {moyenne(durees) * 1000:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chapitres", type=int, default=30)
+    parser.add_argument("--paragraphes", type=int, default=14)
+    parser.add_argument("--graine", type=int, default=42)
+    args = parser.parse_args()
+
+    migrer(engine)
+    db = SessionLocal()
+    try:
+        cible, verite = creer_livre(db, args.chapitres, args.paragraphes, random.Random(args.graine))
+        print(f"Livre : {args.chapitres} chapitres x {args.paragraphes} paragraphes, {len(PROMPTS)} prompts\n")
+        print(f"{'contexte':<18} {'prompt (car)':>12} {'rappel':>11} {'précision':>11} {'durée (ms)':>10}")
+        mesurer("integral", lambda db, chap, prompt: contexte_integral(db, chap), db, cible, verite, PROMPTS)
+        mesurer("resume", lambda db, chap, prompt: construire_contexte(db, chap), db, cible, verite, PROMPTS)
+        mesurer("resume+passages", construire_contexte, db, cible, verite, PROMPTS)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
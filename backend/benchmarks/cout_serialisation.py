@@ -0,0 +1,282 @@
+"""
+Micro-benchmark du coût de sérialisation, par Mo de réponse, des listes et du livre complet.
+
+Pour chaque réponse (contenus d'un chapitre, liste des livres, livre complet), compare :
+- orm : objets ORM validés par les schémas pydantic (from_attributes) puis encodés par
+  json, ce que faisaient les routes avant serialisation.py (response_model de FastAPI,
+  jsonable_encoder pour le livre complet)
+- rapide : lignes Core converties en dicts et encodées par orjson (serialisation.py)
+
+Deux étapes sont mesurées séparément : la lecture (requête et construction des objets
+ou des lignes) et la sérialisation (des objets ou lignes déjà lus jusqu'aux octets).
+La requête HTTP complète sur la route actuelle est aussi mesurée. Les contenus font
+--mots mots, comme des chapitres générés.
+
+Usage (depuis backend/) :
+    python benchmarks/cout_serialisation.py [--contenus 200] [--livres 500] [--chapitres 40] [--mots 3000] [--repetitions 7]
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import statistics
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench_serialisation.db")
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+from sqlalchemy import insert, select  # noqa: E402
+from sqlalchemy.orm import joinedload, selectinload  # noqa: E402
+
+from main import app, preparer_base  # noqa: E402
+from database import engine, SessionLocal  # noqa: E402
+from models import Style, Livre, Chapitre, Contenu  # noqa: E402
+from schemas import LivreResponse, ChapitreResponse, ContenuResponse  # noqa: E402
+import serialisation  # noqa: E402
+from serialisation import (  # noqa: E402
+    COLONNES_LIVRE_AVEC_STYLE, CHAMPS_CHAPITRE, CHAMPS_CONTENU, colonnes, en_dicts, livres_en_dicts, encoder
+)
+
+logging.getLogger().setLevel(logging.WARNING)
+
+VOCABULAIRE = "la forêt lune Rebecca chemin lanterne rivière « silence » vent porte ancienne étoile".split()
+
+
+def texte(mots: int, rng: random.Random) -> str:
+    return " ".join(rng.choice(VOCABULAIRE) for _ in range(mots))
+
+
+def peupler(args, rng: random.Random) -> Dict[str, int]:
+    """Un chapitre de --contenus contenus, --livres livres, et un livre de --chapitres chapitres"""
+    preparer_base()
+    with engine.begin() as connexion:
+        style_id = connexion.execute(select(Style.id).limit(1)).scalar()
+        livre_ids = connexion.execute(insert(Livre).returning(Livre.id), [
+            {"titre": f"Livre {i}", "description": texte(30, rng), "style_id": style_id if i % 2 else None}
+            for i in range(args.livres)
+        ]).scalars().all()
+        chapitre_ids = connexion.execute(insert(Chapitre).returning(Chapitre.id), [
+            {"livre_id": livre_ids[0], "titre": f"Chapitre {i}", "ordre": i} for i in range(args.chapitres)
+        ]).scalars().all()
+        connexion.execute(insert(Contenu), [
+            {"chapitre_id": chapitre_ids[0], "texte_utilisateur": texte(40, rng),
+             "texte_genere": texte(args.mots, rng), "resume": texte(60, rng), "niveau_strictesse": "modere"}
+            for _ in range(args.contenus)
+        ] + [
+            {"chapitre_id": chapitre_id, "texte_utilisateur": texte(40, rng),
+             "texte_genere": texte(args.mots, rng), "resume": texte(60, rng), "niveau_strictesse": "modere"}
+            for chapitre_id in chapitre_ids[1:]
+        ])
+    return {"livre_id": livre_ids[0], "chapitre_id": chapitre_ids[0]}
+
+
+def _json(contenu) -> bytes:
+    # Comme JSONResponse.render
+    return json.dumps(contenu, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+# ==================== Chemin ORM + pydantic ====================
+
+def lire_orm_contenus(db, ids):
+    return db.scalars(select(Contenu).where(Contenu.chapitre_id == ids["chapitre_id"])
+                      .order_by(Contenu.date_creation, Contenu.id)).all()
+
+
+def lire_orm_livres(db, ids):
+    return db.scalars(select(Livre).options(joinedload(Livre.style_rel))
+                      .order_by(Livre.date_creation, Livre.id)).unique().all()
+
+
+def lire_orm_complet(db, ids):
+    return db.scalar(select(Livre).options(
+        joinedload(Livre.style_rel), selectinload(Livre.chapitres).selectinload(Chapitre.contenus)
+    ).where(Livre.id == ids["livre_id"]))
+
+
+ADAPTATEUR_CONTENUS = TypeAdapter(List[ContenuResponse])
+ADAPTATEUR_LIVRES = TypeAdapter(List[LivreResponse])
+
+
+def serialiser_orm_liste(adaptateur: TypeAdapter) -> Callable:
+    def serialiser(objets) -> bytes:
+        # Comme serialize_response de FastAPI : validation du response_model puis dump JSON
+        valeur = adaptateur.validate_python(objets, from_attributes=True)
+        return _json(adaptateur.dump_python(valeur, mode="json"))
+    return serialiser
+
+
+def serialiser_orm_livres(livres) -> bytes:
+    for livre in livres:
+        livre.style = livre.style_rel
+    return serialiser_orm_liste(ADAPTATEUR_LIVRES)(livres)
+
+
+def serialiser_orm_complet(livre) -> bytes:
+    livre.style = livre.style_rel
+    reponse = {
+        **LivreResponse.model_validate(livre).model_dump(),
+        "chapitres": [
+            {
+                **ChapitreResponse.model_validate(chap).model_dump(),
+                "contenus": [
+                    {champ: getattr(contenu, champ) for champ in ContenuResponse.model_fields}
+                    for contenu in sorted(chap.contenus, key=lambda c: c.id)
+                ]
+            }
+            for chap in sorted(livre.chapitres, key=lambda c: (c.ordre, c.id))
+        ]
+    }
+    return _json(jsonable_encoder(reponse))
+
+
+# ==================== Chemin Core + orjson ====================
+
+def lire_core_contenus(db, ids):
+    return db.execute(select(*colonnes(Contenu, CHAMPS_CONTENU)).where(Contenu.chapitre_id == ids["chapitre_id"])
+                      .order_by(Contenu.date_creation, Contenu.id)).all()
+
+
+def lire_core_livres(db, ids):
+    return db.execute(select(*COLONNES_LIVRE_AVEC_STYLE).outerjoin(Style, Style.id == Livre.style_id)
+                      .order_by(Livre.date_creation, Livre.id)).all()
+
+
+def lire_core_complet(db, ids):
+    livre_id = ids["livre_id"]
+    return (
+        db.execute(select(*COLONNES_LIVRE_AVEC_STYLE).outerjoin(Style, Style.id == Livre.style_id)
+                   .where(Livre.id == livre_id)).all(),
+        db.execute(select(*colonnes(Chapitre, CHAMPS_CHAPITRE)).where(Chapitre.livre_id == livre_id)
+                   .order_by(Chapitre.ordre, Chapitre.id)).all(),
+        db.execute(select(*colonnes(Contenu, CHAMPS_CONTENU))
+                   .where(Contenu.chapitre_id.in_(select(Chapitre.id).where(Chapitre.livre_id == livre_id)))
+                   .order_by(Contenu.id)).all(),
+    )
+
+
+def serialiser_core_contenus(lignes) -> bytes:
+    return encoder(en_dicts(lignes, CHAMPS_CONTENU))
+
+
+def serialiser_core_livres(lignes) -> bytes:
+    return encoder(livres_en_dicts(lignes))
+
+
+def serialiser_core_complet(lignes) -> bytes:
+    # Même construction que obtenir_livre_complet dans main.py
+    livres, lignes_chapitres, lignes_contenus = lignes
+    chapitres = en_dicts(lignes_chapitres, CHAMPS_CHAPITRE)
+    par_chapitre = {chapitre["id"]: [] for chapitre in chapitres}
+    for chapitre in chapitres:
+        chapitre["contenus"] = par_chapitre[chapitre["id"]]
+    position = CHAMPS_CONTENU.index("chapitre_id")
+    for ligne in lignes_contenus:
+        par_chapitre[ligne[position]].append(dict(zip(CHAMPS_CONTENU, ligne)))
+    return encoder({**livres_en_dicts(livres)[0], "chapitres": chapitres})
+
+
+CAS = {
+    "contenus": {
+        "route": "/chapitres/{chapitre_id}/contenus",
+        "orm": (lire_orm_contenus, serialiser_orm_liste(ADAPTATEUR_CONTENUS)),
+        "rapide": (lire_core_contenus, serialiser_core_contenus),
+    },
+    "livres": {
+        "route": "/livres",
+        "orm": (lire_orm_livres, serialiser_orm_livres),
+        "rapide": (lire_core_livres, serialiser_core_livres),
+    },
+    "livre_complet": {
+        "route": "/livres/{livre_id}/complet",
+        "orm": (lire_orm_complet, serialiser_orm_complet),
+        "rapide": (lire_core_complet, serialiser_core_complet),
+    },
+}
+
+
+def mesurer(lire: Callable, serialiser: Callable, ids: Dict[str, int], repetitions: int) -> Dict:
+    lectures, serialisations = [], []
+    taille = 0
+    for _ in range(repetitions):
+        db = SessionLocal()
+        try:
+            debut = time.perf_counter()
+            donnees = lire(db, ids)
+            lectures.append(time.perf_counter() - debut)
+            debut = time.perf_counter()
+            taille = len(serialiser(donnees))
+            serialisations.append(time.perf_counter() - debut)
+        finally:
+            db.close()
+    return {"octets": taille, "lecture_s": statistics.median(lectures),
+            "serialisation_s": statistics.median(serialisations)}
+
+
+def mesurer_route(client: TestClient, chemin: str, repetitions: int) -> Dict:
+    durees, taille = [], 0
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        reponse = client.get(chemin)
+        durees.append(time.perf_counter() - debut)
+        reponse.raise_for_status()
+        taille = len(reponse.content)
+    return {"octets": taille, "requete_s": statistics.median(durees)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contenus", type=int, default=200, help="contenus du chapitre listé")
+    parser.add_argument("--livres", type=int, default=500, help="livres de la liste")
+    parser.add_argument("--chapitres", type=int, default=40, help="chapitres du livre complet (un contenu chacun)")
+    parser.add_argument("--mots", type=int, default=3000, help="mots par texte généré")
+    parser.add_argument("--repetitions", type=int, default=7)
+    parser.add_argument("--graine", type=int, default=1)
+    parser.add_argument("--sortie", help="fichier JSON des résultats")
+    args = parser.parse_args()
+
+    ids = peupler(args, random.Random(args.graine))
+    encodeur = "orjson" if serialisation.orjson is not None else "json (orjson absent)"
+    print(f"Encodeur rapide : {encodeur}, textes de {args.mots} mots, médiane de {args.repetitions} mesures\n")
+    print(f"{'réponse':<14} {'chemin':<7} {'Mo':>6} {'lecture ms/Mo':>14} {'sérial. ms/Mo':>14} {'total ms/Mo':>12}")
+
+    resultats = {}
+    for nom, cas in CAS.items():
+        resultats[nom] = {}
+        for chemin in ("orm", "rapide"):
+            mesure = mesurer(*cas[chemin], ids, args.repetitions)
+            mo = mesure["octets"] / 1e6
+            mesure.update({
+                "lecture_ms_par_mo": mesure["lecture_s"] * 1000 / mo,
+                "serialisation_ms_par_mo": mesure["serialisation_s"] * 1000 / mo,
+            })
+            resultats[nom][chemin] = mesure
+            print(f"{nom:<14} {chemin:<7} {mo:>6.2f} {mesure['lecture_ms_par_mo']:>14.1f} "
+                  f"{mesure['serialisation_ms_par_mo']:>14.1f} "
+                  f"{mesure['lecture_ms_par_mo'] + mesure['serialisation_ms_par_mo']:>12.1f}")
+        orm, rapide = resultats[nom]["orm"], resultats[nom]["rapide"]
+        print(f"{'':<14} sérialisation x{orm['serialisation_s'] / rapide['serialisation_s']:.1f}, "
+              f"lecture + sérialisation x{(orm['lecture_s'] + orm['serialisation_s']) / (rapide['lecture_s'] + rapide['serialisation_s']):.1f}")
+
+    print(f"\n{'route (HTTP)':<34} {'Mo':>6} {'ms':>8} {'ms/Mo':>8}")
+    with TestClient(app) as client:
+        for nom, cas in CAS.items():
+            chemin = cas["route"].format(**ids)
+            mesure = mesurer_route(client, chemin, args.repetitions)
+            mo = mesure["octets"] / 1e6
+            resultats[nom]["route"] = {**mesure, "ms_par_mo": mesure["requete_s"] * 1000 / mo}
+            print(f"{chemin:<34} {mo:>6.2f} {mesure['requete_s'] * 1000:>8.1f} {mesure['requete_s'] * 1000 / mo:>8.1f}")
+
+    if args.sortie:
+        with open(args.sortie, "w") as f:
+            json.dump({"parametres": vars(args), "encodeur": encodeur, "resultats": resultats}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark du démarrage à froid (point d'entrée serverless).
+
+Chaque mesure lance un interpréteur neuf, sur une base neuve (comme /tmp/histoires.db
+sur Vercel à chaque démarrage à froid), en mode DEMARRAGE_RAPIDE, et mesure :
+- import : durée de `import main`
+- premiere_requete : durée de la première requête (création du schéma et des styles comprise)
+
+Le script échoue (code de sortie 1) si la médiane dépasse le budget : à lancer en CI
+pour détecter une régression du démarrage.
+
+Usage (depuis backend/) :
+    python benchmarks/demarrage.py [--repetitions 5] [--budget-import-ms 2000] [--budget-premiere-requete-ms 250]
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Exécuté dans l'interpréteur neuf
+MESURE = """
+import json, time
+debut = time.perf_counter()
+import main
+import_s = time.perf_counter() - debut
+
+from fastapi.testclient import TestClient
+client = TestClient(main.app)
+debut = time.perf_counter()
+reponse = client.get("/styles")
+requete_s = time.perf_counter() - debut
+assert reponse.status_code == 200, reponse.text
+print(json.dumps({"import": import_s, "premiere_requete": requete_s}))
+"""
+
+
+def mesurer() -> dict:
+    with tempfile.TemporaryDirectory() as dossier:
+        env = {
+            **os.environ,
+            "DATABASE_PATH": os.path.join(dossier, "histoires.db"),
+            "DEMARRAGE_RAPIDE": "1",
+            "LOG_LEVEL": "WARNING",
+        }
+        resultat = subprocess.run(
+            [sys.executable, "-c", MESURE], cwd=BACKEND, env=env, capture_output=True, text=True, check=True
+        )
+    return json.loads(resultat.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument("--budget-import-ms", type=float, default=2000)
+    parser.add_argument("--budget-premiere-requete-ms", type=float, default=250)
+    args = parser.parse_args()
+
+    mesures = [mesurer() for _ in range(args.repetitions)]
+    budgets = {"import": args.budget_import_ms, "premiere_requete": args.budget_premiere_requete_ms}
+
+    depassements = []
+    print(f"{'étape':<18} {'médiane (ms)':>13} {'max (ms)':>10} {'budget (ms)':>12}")
+    for etape, budget in budgets.items():
+        durees = [m[etape] * 1000 for m in mesures]
+        mediane = statistics.median(durees)
+        print(f"{etape:<18} {mediane:>13.1f} {max(durees):>10.1f} {budget:>12.0f}")
+        if mediane > budget:
+            depassements.append(etape)
+
+    if depassements:
+        print(f"\nBudget dépassé : {', '.join(depassements)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
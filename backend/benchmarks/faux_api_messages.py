@@ -0,0 +1,129 @@
+"""
+Substitut local de l'API Messages, pour essayer et mesurer le backend de génération http.
+
+POST /v1/messages répond comme l'API : en SSE avec "stream": true (message_start,
+content_block_delta..., message_stop), en JSON sinon. Le texte est un chapitre
+factice suivi de ---RESUME--- et d'un résumé, émis avec la latence et la taille
+demandées ; une fraction des requêtes échoue en 529 (overloaded_error), pour
+exercer les nouvelles tentatives.
+
+creer_app() sert aussi aux tests du backend http (tests/test_backends_generation.py) :
+échecs en tête (echecs, retry_after), erreur au milieu du flux (erreur_apres), et
+app.state garde les dates des requêtes, les textes émis et les flux interrompus.
+
+Usage (depuis backend/) :
+    python benchmarks/faux_api_messages.py [--port 8765] [--latence 0.5] [--duree 1.0] [--mots 1200] [--taux-echec 0]
+puis :
+    GENERATION_BACKEND=http GENERATION_HTTP_URL=http://127.0.0.1:8765 uvicorn main:app
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import Optional
+from uuid import uuid4
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+VOCABULAIRE = (
+    "la forêt lune Rebecca chemin lanterne rivière silence vent porte ancienne "
+    "murmure étoile renard jardin secret pluie château lumière ombre voyage"
+).split()
+# Mots par événement content_block_delta
+MOTS_PAR_MORCEAU = 8
+
+
+def _sse(evenement: dict) -> str:
+    return f"event: {evenement['type']}\ndata: {json.dumps(evenement, ensure_ascii=False)}\n\n"
+
+
+def creer_app(latence: float = 0.5, duree: float = 1.0, mots: int = 1200, taux_echec: float = 0.0,
+              echecs: int = 0, retry_after: Optional[str] = None, erreur_apres: Optional[int] = None) -> FastAPI:
+    """
+    Args:
+        echecs: les premières requêtes répondent 529, en plus de taux_echec
+        retry_after: en-tête Retry-After des réponses 529
+        erreur_apres: nombre de morceaux émis avant un événement `error` qui termine le flux
+    """
+    app = FastAPI()
+    app.state.requetes = 0
+    app.state.dates = []  # time.monotonic() de chaque requête
+    app.state.textes = []  # texte complet émis par chaque flux
+    app.state.flux_interrompus = 0  # flux quittés par le client avant la fin
+
+    def morceaux(prompt: str):
+        texte = [random.choice(VOCABULAIRE) for _ in range(mots)]
+        for i in range(0, len(texte), MOTS_PAR_MORCEAU):
+            yield " ".join(texte[i:i + MOTS_PAR_MORCEAU]) + " "
+        yield f"\n\n---RESUME---\n\nRésumé simulé d'un prompt de {len(prompt)} caractères."
+
+    @app.post("/v1/messages")
+    async def messages(request: Request):
+        app.state.requetes += 1
+        app.state.dates.append(time.monotonic())
+        corps = await request.json()
+        prompt = "".join(
+            message["content"] if isinstance(message["content"], str) else json.dumps(message["content"])
+            for message in corps.get("messages", [])
+        )
+        await asyncio.sleep(latence)
+
+        if app.state.requetes <= echecs or random.random() < taux_echec:
+            return JSONResponse(status_code=529, headers={"retry-after": retry_after} if retry_after else None, content={
+                "type": "error", "error": {"type": "overloaded_error", "message": "Overloaded (simulé)"}
+            })
+
+        message = {"id": f"msg_{uuid4().hex[:24]}", "type": "message", "role": "assistant",
+                   "model": corps.get("model"), "stop_reason": None, "usage": {"input_tokens": len(prompt) // 4}}
+        liste = list(morceaux(prompt))
+        if erreur_apres is not None:
+            liste = liste[:erreur_apres]
+        app.state.textes.append("".join(liste))
+
+        if not corps.get("stream"):
+            return {**message, "content": [{"type": "text", "text": "".join(liste)}], "stop_reason": "end_turn"}
+
+        async def evenements():
+            termine = False
+            try:
+                yield _sse({"type": "message_start", "message": {**message, "content": []}})
+                yield _sse({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+                pause = duree / len(liste) if liste else 0
+                for morceau in liste:
+                    yield _sse({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": morceau}})
+                    await asyncio.sleep(pause)
+                if erreur_apres is not None:
+                    yield _sse({"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded (simulé)"}})
+                else:
+                    yield _sse({"type": "content_block_stop", "index": 0})
+                    yield _sse({"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": mots}})
+                    yield _sse({"type": "message_stop"})
+                termine = True
+            finally:
+                if not termine:
+                    app.state.flux_interrompus += 1
+
+        return StreamingResponse(evenements(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latence", type=float, default=0.5, help="délai avant la réponse (s)")
+    parser.add_argument("--duree", type=float, default=1.0, help="durée d'émission du texte (s)")
+    parser.add_argument("--mots", type=int, default=1200, help="mots du chapitre")
+    parser.add_argument("--taux-echec", type=float, default=0.0, help="proportion de réponses 529")
+    args = parser.parse_args()
+
+    app = creer_app(args.latence, args.duree, args.mots, args.taux_echec)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
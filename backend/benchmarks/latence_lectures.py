@@ -0,0 +1,135 @@
+"""
+Benchmark latence des lectures sous charge de génération : routes synchrones / asynchrones.
+
+Pendant qu'un nombre fixe de générations occupent chacune un thread du pool
+(simulées par une route synchrone qui dort, comme un appel à Claude en attente),
+des lecteurs interrogent la liste des chapitres d'un livre :
+- sync : implémentation synchrone historique (def + SessionLocal), servie par le pool de threads
+- async : la route actuelle (async def + aiosqlite), servie par la boucle d'événements
+
+Le serveur uvicorn tourne dans ce processus, sur une base temporaire.
+
+Usage (depuis backend/) :
+    python benchmarks/latence_lectures.py [--generations 40] [--lecteurs 4] [--duree 10]
+"""
+import os
+import sys
+import time
+import logging
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench_latence.db")
+os.environ["CLAUDE_POOL_TAILLE"] = "0"
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+from fastapi import Depends  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+from typing import List  # noqa: E402
+
+from main import app  # noqa: E402
+from database import get_db, SessionLocal  # noqa: E402
+from models import Livre, Chapitre, Contenu  # noqa: E402
+from schemas import ChapitreResponse  # noqa: E402
+
+# Les journaux DEBUG (requêtes httpx, appels aiosqlite) fausseraient les mesures
+logging.getLogger().setLevel(logging.WARNING)
+
+
+@app.post("/_bench/generation")
+def generation_simulee(duree: float):
+    """Occupe un thread du pool comme une génération en attente de Claude"""
+    time.sleep(duree)
+    return {}
+
+
+@app.get("/_bench/sync/livres/{livre_id}/chapitres", response_model=List[ChapitreResponse])
+def lister_chapitres_sync(livre_id: int, db: Session = Depends(get_db)):
+    return db.query(Chapitre).filter(Chapitre.livre_id == livre_id).order_by(Chapitre.ordre, Chapitre.id).all()
+
+
+def creer_livre(nb_chapitres: int) -> int:
+    db = SessionLocal()
+    try:
+        livre = Livre(titre="Livre de benchmark")
+        db.add(livre)
+        db.flush()
+        for ordre in range(1, nb_chapitres + 1):
+            chapitre = Chapitre(livre_id=livre.id, titre=f"Chapitre {ordre}", ordre=ordre)
+            db.add(chapitre)
+            db.flush()
+            db.add(Contenu(chapitre_id=chapitre.id, texte_utilisateur="benchmark", texte_genere="texte " * 200))
+        db.commit()
+        return livre.id
+    finally:
+        db.close()
+
+
+def demarrer_serveur() -> str:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    serveur = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=serveur.run, daemon=True).start()
+    while not serveur.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def percentile(valeurs: List[float], p: float) -> float:
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(len(valeurs) * p))]
+
+
+async def mesurer(url: str, chemin: str, args) -> List[float]:
+    fin = time.monotonic() + args.duree
+    latences: List[float] = []
+    limites = httpx.Limits(max_connections=args.generations + args.lecteurs + 10)
+
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limites) as client:
+        async def generer():
+            while time.monotonic() < fin:
+                await client.post("/_bench/generation", params={"duree": args.duree_generation})
+
+        async def lire():
+            while time.monotonic() < fin:
+                debut = time.perf_counter()
+                reponse = await client.get(chemin)
+                latences.append(time.perf_counter() - debut)
+                reponse.raise_for_status()
+
+        generateurs = [asyncio.create_task(generer()) for _ in range(args.generations)]
+        await asyncio.sleep(0.2)  # laisser les générations occuper le pool
+        await asyncio.gather(*(lire() for _ in range(args.lecteurs)))
+        await asyncio.gather(*generateurs)
+    return latences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--generations", type=int, default=40, help="générations simultanées (40 = taille du pool de threads)")
+    parser.add_argument("--duree-generation", type=float, default=2.0, help="durée d'une génération simulée (s)")
+    parser.add_argument("--lecteurs", type=int, default=4, help="lecteurs simultanés (peu, pour ne pas saturer le CPU)")
+    parser.add_argument("--duree", type=float, default=10.0, help="durée de chaque mesure (s)")
+    parser.add_argument("--chapitres", type=int, default=30)
+    args = parser.parse_args()
+
+    url = demarrer_serveur()
+    livre_id = creer_livre(args.chapitres)
+    print(f"{args.generations} générations de {args.duree_generation}s, {args.lecteurs} lecteurs, "
+          f"{args.duree}s par mode, livre de {args.chapitres} chapitres\n")
+    print(f"{'mode':<6} {'lectures':>9} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10}")
+    for mode, chemin in (("sync", f"/_bench/sync/livres/{livre_id}/chapitres"),
+                         ("async", f"/livres/{livre_id}/chapitres")):
+        latences = asyncio.run(mesurer(url, chemin, args))
+        print(f"{mode:<6} {len(latences):>9} {percentile(latences, 0.50) * 1000:>10.1f} "
+              f"{percentile(latences, 0.95) * 1000:>10.1f} {percentile(latences, 0.99) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
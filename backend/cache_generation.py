@@ -0,0 +1,185 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Durée de vie d'un résultat de génération en cache (secondes)
+GENERATION_CACHE_TTL = float(os.environ.get("GENERATION_CACHE_TTL", "600"))
+# Nombre maximum de résultats gardés
+GENERATION_CACHE_TAILLE = int(os.environ.get("GENERATION_CACHE_TAILLE", "64"))
+
+Morceau = Tuple[str, str]
+
+
+def cle_prompt(prompt_complet: str) -> str:
+    return hashlib.sha256(prompt_complet.encode("utf-8")).hexdigest()
+
+
+class Vol:
+    """
+    Une génération en cours, partagée par toutes les requêtes identiques.
+
+    Un thread producteur lit le flux de Claude et accumule les morceaux ; chaque
+    abonné les relit depuis le début. Si tous les abonnés partent avant la fin,
+    la génération est abandonnée (et le processus Claude tué).
+    """
+
+    def __init__(self):
+        self.morceaux: List[Morceau] = []
+        self.termine = False
+        self.erreur: Optional[Exception] = None
+        self.annule = False
+        self.abonnes = 0
+        self._condition = threading.Condition()
+
+    def produire(self, flux: Iterator[Morceau], a_la_fin: Callable[["Vol"], None]):
+        try:
+            for morceau in flux:
+                with self._condition:
+                    if self.annule:
+                        break
+                    self.morceaux.append(morceau)
+                    self._condition.notify_all()
+        except Exception as e:
+            self.erreur = e
+        finally:
+            flux.close()
+            with self._condition:
+                self.termine = True
+                self._condition.notify_all()
+            a_la_fin(self)
+
+    def lire(self, au_depart: Callable[["Vol"], None]) -> Iterator[Morceau]:
+        with self._condition:
+            self.abonnes += 1
+        position = 0
+        try:
+            while True:
+                with self._condition:
+                    while position >= len(self.morceaux) and not self.termine:
+                        self._condition.wait()
+                    nouveaux = self.morceaux[position:]
+                    fini = self.termine
+                position += len(nouveaux)
+                yield from nouveaux
+                if fini and position >= len(self.morceaux):
+                    break
+            if self.erreur:
+                raise self.erreur
+        finally:
+            with self._condition:
+                self.abonnes -= 1
+                if self.abonnes == 0 and not self.termine:
+                    self.annule = True
+                    au_depart(self)
+
+
+class CacheGeneration:
+    """
+    Cache des générations, adressé par le hash du prompt complet.
+
+    - une requête identique à une génération en cours s'y abonne au lieu de lancer
+      un nouveau processus Claude (single-flight) ;
+    - pour les appelants qui le demandent (reutiliser_resultat), un résultat terminé
+      est resservi pendant GENERATION_CACHE_TTL secondes, dans la limite de
+      GENERATION_CACHE_TAILLE entrées (LRU). Les routes qui enregistrent la génération
+      ne le demandent pas : générer à nouveau doit produire un nouveau texte.
+
+    Les erreurs ne sont pas mises en cache.
+    """
+
+    def __init__(self, ttl: float = GENERATION_CACHE_TTL, taille_max: int = GENERATION_CACHE_TAILLE):
+        self.ttl = ttl
+        self.taille_max = taille_max
+        self._resultats: "OrderedDict[str, Tuple[float, List[Morceau]]]" = OrderedDict()
+        self._vols: Dict[str, Vol] = {}
+        self._verrou = threading.Lock()
+        self.stats = {"succes": 0, "partages": 0, "generations": 0}
+
+    def _resultat(self, cle: str) -> Optional[List[Morceau]]:
+        entree = self._resultats.get(cle)
+        if entree is None:
+            return None
+        date, morceaux = entree
+        if time.monotonic() - date > self.ttl:
+            del self._resultats[cle]
+            return None
+        self._resultats.move_to_end(cle)
+        return morceaux
+
+    def _enregistrer(self, cle: str, vol: Vol):
+        with self._verrou:
+            if self._vols.get(cle) is vol:
+                del self._vols[cle]
+            if vol.erreur is None and not vol.annule:
+                self._resultats[cle] = (time.monotonic(), self._condenser(vol.morceaux))
+                while len(self._resultats) > self.taille_max:
+                    self._resultats.popitem(last=False)
+
+    def _abandonner(self, cle: str, vol: Vol):
+        with self._verrou:
+            if self._vols.get(cle) is vol:
+                del self._vols[cle]
+
+    @staticmethod
+    def _condenser(morceaux: List[Morceau]) -> List[Morceau]:
+        """Fusionne les morceaux consécutifs d'une même partie pour la relecture depuis le cache"""
+        parties: List[Morceau] = []
+        for partie, texte in morceaux:
+            if parties and parties[-1][0] == partie:
+                parties[-1] = (partie, parties[-1][1] + texte)
+            else:
+                parties.append((partie, texte))
+        return parties
+
+    def generer(self, prompt_complet: str, lancer: Callable[[], Iterator[Morceau]],
+                nouvelle_variante: bool = False, reutiliser_resultat: bool = False) -> Iterator[Morceau]:
+        """
+        Retourne le flux de morceaux pour ce prompt : depuis une génération identique
+        en cours, depuis le cache avec reutiliser_resultat, ou en appelant `lancer`.
+
+        Avec nouvelle_variante, le cache et les générations en cours sont ignorés ;
+        le nouveau résultat remplace l'ancien en cache.
+        """
+        cle = cle_prompt(prompt_complet)
+        with self._verrou:
+            if not nouvelle_variante:
+                resultat = self._resultat(cle) if reutiliser_resultat else None
+                if resultat is not None:
+                    self.stats["succes"] += 1
+                    return iter(resultat)
+                vol = self._vols.get(cle)
+                if vol is not None:
+                    self.stats["partages"] += 1
+                    return vol.lire(lambda v: self._abandonner(cle, v))
+
+            self.stats["generations"] += 1
+            vol = Vol()
+            self._vols[cle] = vol
+
+        flux = vol.lire(lambda v: self._abandonner(cle, v))
+        try:
+            source = lancer()
+        except Exception:
+            self._abandonner(cle, vol)
+            raise
+        # Le contexte est copié : les journaux de la génération gardent l'identifiant de la requête
+        threading.Thread(
+            target=contextvars.copy_context().run, args=(vol.produire, source, lambda v: self._enregistrer(cle, v)),
+            name="generation-partagee", daemon=True
+        ).start()
+        return flux
+
+    def statistiques(self) -> Dict:
+        with self._verrou:
+            return {**self.stats, "en_cours": len(self._vols), "resultats": len(self._resultats),
+                    "taille_max": self.taille_max, "ttl": self.ttl}
+
+
+cache_generation = CacheGeneration()
@@ -0,0 +1,373 @@
+"""
+Cache des données de référence : styles et métadonnées des livres.
+
+Lecture à travers le cache (read-through) : une entrée absente est chargée depuis la base
+puis gardée, jusqu'à son invalidation explicite par les routes qui modifient styles et
+livres, ou l'expiration de CACHE_REFERENCE_TTL. Les valeurs sont des dicts sérialisés
+en JSON, pour pouvoir être partagées entre workers par un stockage externe.
+
+Chaque clé a une génération, jeton aléatoire qui suffixe la clé de sa valeur ; l'invalider
+supprime la génération, et la lecture suivante en tire une nouvelle. Un chargement commencé
+avant l'invalidation (lecture de la base antérieure à la modification) écrit donc sa valeur
+sous l'ancienne génération, que plus personne ne lit : il ne peut pas recouvrir
+l'invalidation. Les valeurs orphelines disparaissent par expiration ou éviction.
+
+Stockages (CACHE_REFERENCE_BACKEND) :
+- memoire : LRU dans le processus (défaut, un seul worker)
+- redis : serveur Redis à CACHE_REFERENCE_REDIS_URL, partagé entre workers (paquet `redis`,
+  hors de requirements.txt : son absence arrête le démarrage)
+- redis-local : substitut de Redis dans le processus, pour essayer le chemin "redis" sans serveur
+
+Les routes asynchrones passent par les méthodes *_async, qui utilisent le client
+redis.asyncio : un appel à Redis (ou son délai d'expiration) ne bloque pas la boucle
+d'événements. Les méthodes synchrones restent pour le code exécuté dans des threads
+(génération, jobs).
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CACHE_REFERENCE_BACKEND = os.environ.get("CACHE_REFERENCE_BACKEND", "memoire")
+CACHE_REFERENCE_REDIS_URL = os.environ.get("CACHE_REFERENCE_REDIS_URL", "redis://localhost:6379/0")
+# Nombre maximum d'entrées gardées par le stockage en mémoire
+CACHE_REFERENCE_TAILLE = int(os.environ.get("CACHE_REFERENCE_TAILLE", "1024"))
+# Durée de vie d'une entrée (secondes) : filet de sécurité si une invalidation manque
+CACHE_REFERENCE_TTL = int(os.environ.get("CACHE_REFERENCE_TTL", "300"))
+
+# Préfixe des clés dans un stockage partagé
+PREFIXE = "histoires:ref:"
+# Préfixe des clés de génération (voir plus haut)
+PREFIXE_GENERATION = "gen:"
+
+
+class StockageMemoire:
+    """LRU borné, avec expiration"""
+
+    def __init__(self, taille_max: int = CACHE_REFERENCE_TAILLE, ttl: int = CACHE_REFERENCE_TTL):
+        self.taille_max = taille_max
+        self.ttl = ttl
+        self._entrees: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        # Réentrant : ajouter lit et écrit sous le même verrou
+        self._verrou = threading.RLock()
+        self.evictions = 0
+
+    def lire(self, cle: str) -> Optional[str]:
+        with self._verrou:
+            entree = self._entrees.get(cle)
+            if entree is None:
+                return None
+            expiration, valeur = entree
+            if time.monotonic() > expiration:
+                del self._entrees[cle]
+                return None
+            self._entrees.move_to_end(cle)
+            return valeur
+
+    def ecrire(self, cle: str, valeur: str):
+        with self._verrou:
+            self._entrees[cle] = (time.monotonic() + self.ttl, valeur)
+            self._entrees.move_to_end(cle)
+            while len(self._entrees) > self.taille_max:
+                self._entrees.popitem(last=False)
+                self.evictions += 1
+
+    def ajouter(self, cle: str, valeur: str) -> bool:
+        """Écrit la valeur si la clé est absente (ou expirée) ; False sinon"""
+        with self._verrou:
+            if self.lire(cle) is not None:
+                return False
+            self.ecrire(cle, valeur)
+            return True
+
+    def supprimer(self, cles: Iterable[str]):
+        with self._verrou:
+            for cle in cles:
+                self._entrees.pop(cle, None)
+
+    # En mémoire, sans attente : les versions asynchrones appellent directement les synchrones
+
+    async def lire_async(self, cle: str) -> Optional[str]:
+        return self.lire(cle)
+
+    async def ecrire_async(self, cle: str, valeur: str):
+        self.ecrire(cle, valeur)
+
+    async def ajouter_async(self, cle: str, valeur: str) -> bool:
+        return self.ajouter(cle, valeur)
+
+    async def supprimer_async(self, cles: Iterable[str]):
+        self.supprimer(cles)
+
+    def statistiques(self) -> Dict:
+        with self._verrou:
+            return {"stockage": "memoire", "entrees": len(self._entrees), "taille_max": self.taille_max,
+                    "evictions": self.evictions}
+
+
+class StockageRedis:
+    """
+    Stockage partagé sur un client Redis (API de redis-py : get, set(ex=, nx=), delete).
+
+    client sert aux appels synchrones, client_async (redis.asyncio, même API en
+    coroutines) aux appels depuis la boucle d'événements.
+    La borne mémoire est celle du serveur (maxmemory + politique allkeys-lru).
+    """
+
+    def __init__(self, client, client_async, ttl: int = CACHE_REFERENCE_TTL, nom: str = "redis"):
+        self.client = client
+        self.client_async = client_async
+        self.ttl = ttl
+        self.nom = nom
+
+    @staticmethod
+    def _decoder(valeur) -> Optional[str]:
+        return valeur.decode("utf-8") if isinstance(valeur, bytes) else valeur
+
+    def lire(self, cle: str) -> Optional[str]:
+        return self._decoder(self.client.get(PREFIXE + cle))
+
+    def ecrire(self, cle: str, valeur: str):
+        self.client.set(PREFIXE + cle, valeur, ex=self.ttl)
+
+    def ajouter(self, cle: str, valeur: str) -> bool:
+        return bool(self.client.set(PREFIXE + cle, valeur, ex=self.ttl, nx=True))
+
+    def supprimer(self, cles: Iterable[str]):
+        cles = [PREFIXE + cle for cle in cles]
+        if cles:
+            self.client.delete(*cles)
+
+    async def lire_async(self, cle: str) -> Optional[str]:
+        return self._decoder(await self.client_async.get(PREFIXE + cle))
+
+    async def ecrire_async(self, cle: str, valeur: str):
+        await self.client_async.set(PREFIXE + cle, valeur, ex=self.ttl)
+
+    async def ajouter_async(self, cle: str, valeur: str) -> bool:
+        return bool(await self.client_async.set(PREFIXE + cle, valeur, ex=self.ttl, nx=True))
+
+    async def supprimer_async(self, cles: Iterable[str]):
+        cles = [PREFIXE + cle for cle in cles]
+        if cles:
+            await self.client_async.delete(*cles)
+
+    def statistiques(self) -> Dict:
+        return {"stockage": self.nom}
+
+
+class RedisLocal:
+    """Substitut de client Redis dans le processus (get, set avec ex et nx, delete), pour tests et développement"""
+
+    def __init__(self):
+        self._valeurs: Dict[str, Tuple[Optional[float], bytes]] = {}
+        self._verrou = threading.RLock()
+
+    def get(self, nom: str) -> Optional[bytes]:
+        with self._verrou:
+            entree = self._valeurs.get(nom)
+            if entree is None:
+                return None
+            expiration, valeur = entree
+            if expiration is not None and time.monotonic() > expiration:
+                del self._valeurs[nom]
+                return None
+            return valeur
+
+    def set(self, nom: str, valeur, ex: Optional[int] = None, nx: bool = False) -> Optional[bool]:
+        if isinstance(valeur, str):
+            valeur = valeur.encode("utf-8")
+        with self._verrou:
+            # Comme Redis : None si nx et la clé existe déjà
+            if nx and self.get(nom) is not None:
+                return None
+            self._valeurs[nom] = (time.monotonic() + ex if ex else None, valeur)
+        return True
+
+    def delete(self, *noms: str) -> int:
+        with self._verrou:
+            return sum(self._valeurs.pop(nom, None) is not None for nom in noms)
+
+
+class RedisLocalAsync:
+    """Même substitut, avec l'API de redis.asyncio, sur les valeurs d'un RedisLocal"""
+
+    def __init__(self, local: RedisLocal):
+        self.local = local
+
+    async def get(self, nom: str) -> Optional[bytes]:
+        return self.local.get(nom)
+
+    async def set(self, nom: str, valeur, ex: Optional[int] = None, nx: bool = False) -> Optional[bool]:
+        return self.local.set(nom, valeur, ex=ex, nx=nx)
+
+    async def delete(self, *noms: str) -> int:
+        return self.local.delete(*noms)
+
+
+def creer_stockage(nom: str = CACHE_REFERENCE_BACKEND):
+    if nom == "redis":
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError:
+            raise RuntimeError(
+                "CACHE_REFERENCE_BACKEND=redis : le paquet redis n'est pas installé (pip install \"redis>=4.2\")"
+            ) from None
+        return StockageRedis(redis.Redis.from_url(CACHE_REFERENCE_REDIS_URL),
+                             redis.asyncio.Redis.from_url(CACHE_REFERENCE_REDIS_URL))
+    if nom == "redis-local":
+        local = RedisLocal()
+        return StockageRedis(local, RedisLocalAsync(local), nom="redis-local")
+    if nom != "memoire":
+        logger.warning(f"CACHE_REFERENCE_BACKEND inconnu: {nom}, stockage en mémoire utilisé")
+    return StockageMemoire()
+
+
+def _en_json(valeur: Any) -> str:
+    return json.dumps(valeur, default=lambda v: v.isoformat(), ensure_ascii=False, separators=(",", ":"))
+
+
+def _cle_generation(cle: str) -> str:
+    return PREFIXE_GENERATION + cle
+
+
+def _versionnee(cle: str, generation: str) -> str:
+    return f"{cle}@{generation}"
+
+
+def cle_style(style_id: int) -> str:
+    return f"style:{style_id}"
+
+
+def cle_livre(livre_id: int) -> str:
+    return f"livre:{livre_id}"
+
+
+CLE_STYLES = "styles"
+
+
+class CacheReference:
+    """
+    Cache read-through des styles (liste complète et par id) et des métadonnées des livres.
+
+    Une ligne absente de la base n'est pas mise en cache : avec plusieurs workers, elle
+    a pu être créée par un autre, dont l'invalidation n'atteint pas un stockage local.
+    """
+
+    def __init__(self, stockage=None):
+        self.stockage = stockage or creer_stockage()
+        self._verrou = threading.Lock()
+        self.stats: Dict[str, int] = {"succes": 0, "echecs": 0, "invalidations": 0}
+
+    def _compter(self, compteur: str, nombre: int = 1):
+        with self._verrou:
+            self.stats[compteur] += nombre
+
+    def _lu(self, brut: Optional[str]) -> Optional[Any]:
+        self._compter("echecs" if brut is None else "succes")
+        return None if brut is None else json.loads(brut)
+
+    def _generation(self, cle: str) -> str:
+        """Clé versionnée de la valeur : génération courante, ou nouvelle si la clé a été invalidée"""
+        generation = self.stockage.lire(_cle_generation(cle))
+        if generation is None:
+            generation = uuid.uuid4().hex
+            if not self.stockage.ajouter(_cle_generation(cle), generation):
+                # Tirée entre-temps par un autre lecteur (la nôtre, jamais lue, reste sans effet)
+                generation = self.stockage.lire(_cle_generation(cle)) or generation
+        return _versionnee(cle, generation)
+
+    async def _generation_async(self, cle: str) -> str:
+        generation = await self.stockage.lire_async(_cle_generation(cle))
+        if generation is None:
+            generation = uuid.uuid4().hex
+            if not await self.stockage.ajouter_async(_cle_generation(cle), generation):
+                generation = await self.stockage.lire_async(_cle_generation(cle)) or generation
+        return _versionnee(cle, generation)
+
+    def _garder(self, cle: str, valeur: Any) -> Any:
+        if valeur is None:
+            return None
+        brut = _en_json(valeur)
+        self.stockage.ecrire(cle, brut)
+        # Relu depuis le JSON : même forme qu'une valeur servie par le cache (dates en texte)
+        return json.loads(brut)
+
+    async def _garder_async(self, cle: str, valeur: Any) -> Any:
+        if valeur is None:
+            return None
+        brut = _en_json(valeur)
+        await self.stockage.ecrire_async(cle, brut)
+        return json.loads(brut)
+
+    def obtenir(self, cle: str, charger: Callable[[], Any]) -> Any:
+        # Génération lue avant le chargement : une invalidation pendant celui-ci la périme
+        cle = self._generation(cle)
+        valeur = self._lu(self.stockage.lire(cle))
+        return valeur if valeur is not None else self._garder(cle, charger())
+
+    async def obtenir_async(self, cle: str, charger: Callable[[], Awaitable[Any]]) -> Any:
+        cle = await self._generation_async(cle)
+        valeur = self._lu(await self.stockage.lire_async(cle))
+        return valeur if valeur is not None else await self._garder_async(cle, await charger())
+
+    def invalider(self, *cles: str):
+        self.stockage.supprimer([_cle_generation(cle) for cle in cles])
+        self._compter("invalidations", len(cles))
+
+    async def invalider_async(self, *cles: str):
+        await self.stockage.supprimer_async([_cle_generation(cle) for cle in cles])
+        self._compter("invalidations", len(cles))
+
+    @staticmethod
+    def _cles_style(style_id: Optional[int]) -> List[str]:
+        return [CLE_STYLES, *([cle_style(style_id)] if style_id is not None else [])]
+
+    def invalider_style(self, style_id: Optional[int] = None):
+        """Invalide la liste des styles, et le style donné"""
+        self.invalider(*self._cles_style(style_id))
+
+    async def invalider_style_async(self, style_id: Optional[int] = None):
+        await self.invalider_async(*self._cles_style(style_id))
+
+    def invalider_livres(self, livre_ids: Iterable[int]):
+        self.invalider(*(cle_livre(livre_id) for livre_id in livre_ids))
+
+    async def invalider_livres_async(self, livre_ids: Iterable[int]):
+        await self.invalider_async(*(cle_livre(livre_id) for livre_id in livre_ids))
+
+    def statistiques(self) -> Dict:
+        with self._verrou:
+            stats = dict(self.stats)
+        lectures = stats["succes"] + stats["echecs"]
+        return {**stats, "taux_succes": stats["succes"] / lectures if lectures else None,
+                **self.stockage.statistiques()}
+
+
+def style_en_dict(style) -> Optional[Dict]:
+    if style is None:
+        return None
+    return {"id": style.id, "nom": style.nom, "description": style.description,
+            "est_predefini": style.est_predefini, "date_creation": style.date_creation}
+
+
+def livre_en_dict(livre) -> Optional[Dict]:
+    """Métadonnées d'un livre, sans ses chapitres"""
+    if livre is None:
+        return None
+    return {"id": livre.id, "titre": livre.titre, "description": livre.description,
+            "style_id": livre.style_id, "date_creation": livre.date_creation}
+
+
+def styles_en_liste(styles: List) -> List[Dict]:
+    return [style_en_dict(style) for style in styles]
+
+
+cache_reference = CacheReference()
@@ -1,54 +1,22 @@
-import subprocess
-import os
+import time
 import logging
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Iterator, Tuple
+
+from backends_generation import backend_generation
+from cache_generation import cache_generation
+from admission import admission
+from metriques import (
+    generation_duree, generation_prompt_caracteres, generation_contexte_chapitres, generations_en_cours
+)
 
-# Configuration du logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
-def generer_histoire(prompt: str, style: Optional[str] = None, chapitres_precedents: Optional[List[Dict]] = None, niveau_strictesse: str = "modere") -> Dict[str, str]:
-    """
-    Appelle Claude CLI pour générer une histoire pour enfant.
+SEPARATEUR_RESUME = "---RESUME---"
 
-    Args:
-        prompt: Le thème ou l'idée de l'histoire fourni par l'utilisateur
-        style: La description du style d'écriture à utiliser (optionnel)
-        chapitres_precedents: Liste des chapitres précédents avec leur titre et contenu (optionnel)
-        niveau_strictesse: Niveau de fidélité à la description (libre, modere, strict)
-
-    Returns:
-        Dict avec 'texte' (le chapitre) et 'resume' (le résumé des éléments ajoutés)
-    """
-
-    # DEBUG: Afficher les infos d'environnement
-    logger.debug("=" * 50)
-    logger.debug("DEBUG CLAUDE SERVICE")
-    logger.debug("=" * 50)
-    logger.debug(f"HOME: {os.environ.get('HOME', 'NOT SET')}")
-    logger.debug(f"USER: {os.environ.get('USER', 'NOT SET')}")
-    logger.debug(f"ANTHROPIC_API_KEY: {'SET' if os.environ.get('ANTHROPIC_API_KEY') else 'NOT SET'}")
-
-    # Vérifier si le dossier .claude existe
-    home = os.environ.get('HOME', '/root')
-    claude_dir = os.path.join(home, '.claude')
-    logger.debug(f"Claude config dir: {claude_dir}")
-    logger.debug(f"Claude config dir exists: {os.path.exists(claude_dir)}")
-
-    if os.path.exists(claude_dir):
-        logger.debug(f"Contenu de {claude_dir}: {os.listdir(claude_dir)}")
-
-    # Vérifier où est installé claude
-    which_result = subprocess.run(["which", "claude"], capture_output=True, text=True)
-    logger.debug(f"which claude: {which_result.stdout.strip()}")
-    logger.debug(f"which claude stderr: {which_result.stderr.strip()}")
-
-    # Vérifier la version de claude
-    version_result = subprocess.run(["claude", "--version"], capture_output=True, text=True)
-    logger.debug(f"claude --version: {version_result.stdout.strip()}")
-    logger.debug(f"claude --version stderr: {version_result.stderr.strip()}")
 
+def construire_prompt(prompt: str, style: Optional[str] = None, chapitres_precedents: Optional[List[Dict]] = None, niveau_strictesse: str = "modere", resume_histoire: Optional[str] = None, passages_pertinents: Optional[List[Dict]] = None) -> str:
+    """Assemble le prompt complet envoyé à Claude (mêmes arguments que generer_histoire)"""
     # Construire l'instruction de style
     style_instruction = ""
     if style:
@@ -56,9 +24,17 @@ def generer_histoire(prompt: str, style: Optional[str] = None, chapitres_precede
 
     # Construire le contexte des chapitres précédents
     contexte_histoire = ""
+    if resume_histoire:
+        contexte_histoire += "\n\n=== L'HISTOIRE JUSQU'ICI (résumé des chapitres plus anciens) ===\n"
+        contexte_histoire += f"{resume_histoire}\n"
+        contexte_histoire += "=== FIN DU RÉSUMÉ ===\n"
+    if passages_pertinents:
+        contexte_histoire += "\n\n=== PASSAGES ANTÉRIEURS EN LIEN AVEC LA DEMANDE ===\n"
+        for passage in passages_pertinents:
+            contexte_histoire += f"\n[{passage['titre']}] {passage['texte']}\n"
+        contexte_histoire += "\n=== FIN DES PASSAGES ===\n"
     if chapitres_precedents and len(chapitres_precedents) > 0:
-        logger.debug(f"Nombre de chapitres précédents: {len(chapitres_precedents)}")
-        contexte_histoire = "\n\n=== CHAPITRES PRÉCÉDENTS (pour cohérence) ===\n"
+        contexte_histoire += "\n\n=== CHAPITRES PRÉCÉDENTS (pour cohérence) ===\n"
         for chap in chapitres_precedents:
             contexte_histoire += f"\n--- {chap['titre']} ---\n{chap['contenu']}\n"
         contexte_histoire += "\n=== FIN DES CHAPITRES PRÉCÉDENTS ===\n"
@@ -127,47 +103,125 @@ Tu dois répondre en DEUX parties séparées par la ligne "---RESUME---" :
 
 Écris maintenant le chapitre suivi du résumé."""
 
+    return prompt_complet
+
+
+def generer_histoire(prompt: str, style: Optional[str] = None, chapitres_precedents: Optional[List[Dict]] = None, niveau_strictesse: str = "modere", resume_histoire: Optional[str] = None, passages_pertinents: Optional[List[Dict]] = None, nouvelle_variante: bool = False, reutiliser_resultat: bool = False) -> Dict[str, str]:
+    """
+    Appelle Claude CLI pour générer une histoire pour enfant.
+
+    Args:
+        prompt: Le thème ou l'idée de l'histoire fourni par l'utilisateur
+        style: La description du style d'écriture à utiliser (optionnel)
+        chapitres_precedents: Liste des chapitres précédents avec leur titre et contenu (optionnel)
+        niveau_strictesse: Niveau de fidélité à la description (libre, modere, strict)
+        resume_histoire: Résumé des chapitres plus anciens que chapitres_precedents (optionnel)
+        passages_pertinents: Extraits de ces chapitres anciens en lien avec le prompt, avec 'titre' et 'texte' (optionnel)
+        nouvelle_variante: Ignorer le cache des générations identiques pour obtenir un nouveau texte
+        reutiliser_resultat: Resservir une génération identique récente déjà terminée ; réservé
+            aux appelants qui n'enregistrent pas le résultat (une génération identique en
+            cours est partagée dans tous les cas, sauf avec nouvelle_variante)
+
+    Returns:
+        Dict avec 'texte' (le chapitre) et 'resume' (le résumé des éléments ajoutés)
+    """
+
+    morceaux = {"texte": [], "resume": []}
+    for partie, morceau in generer_histoire_stream(prompt, style, chapitres_precedents, niveau_strictesse, resume_histoire, passages_pertinents, nouvelle_variante, reutiliser_resultat):
+        morceaux[partie].append(morceau)
+    return {
+        "texte": "".join(morceaux["texte"]).strip(),
+        "resume": "".join(morceaux["resume"]).strip()
+    }
+
+
+class DecoupeurResume:
+    """
+    Répartit un flux de texte entre le chapitre et le résumé au fil de l'eau.
+
+    Le séparateur pouvant arriver coupé entre deux morceaux, la fin du tampon
+    est retenue tant qu'elle pourrait être le début du séparateur.
+    """
+
+    def __init__(self):
+        self.partie = "texte"
+        self._tampon = ""
+
+    def ajouter(self, morceau: str) -> List[Tuple[str, str]]:
+        """Retourne les morceaux (partie, texte) qui peuvent être émis"""
+        self._tampon += morceau
+        sortie = []
+
+        if self.partie == "texte":
+            if SEPARATEUR_RESUME in self._tampon:
+                avant, apres = self._tampon.split(SEPARATEUR_RESUME, 1)
+                if avant:
+                    sortie.append(("texte", avant))
+                self.partie = "resume"
+                self._tampon = apres
+            else:
+                garde = len(SEPARATEUR_RESUME) - 1
+                while garde and not self._tampon.endswith(SEPARATEUR_RESUME[:garde]):
+                    garde -= 1
+                pret = self._tampon[:len(self._tampon) - garde]
+                self._tampon = self._tampon[len(pret):]
+                if pret:
+                    sortie.append(("texte", pret))
+                return sortie
+
+        if self._tampon:
+            sortie.append(("resume", self._tampon))
+            self._tampon = ""
+        return sortie
+
+    def terminer(self) -> List[Tuple[str, str]]:
+        """Vide le tampon en fin de flux"""
+        reste, self._tampon = self._tampon, ""
+        return [(self.partie, reste)] if reste else []
+
+
+def generer_histoire_stream(prompt: str, style: Optional[str] = None, chapitres_precedents: Optional[List[Dict]] = None, niveau_strictesse: str = "modere", resume_histoire: Optional[str] = None, passages_pertinents: Optional[List[Dict]] = None, nouvelle_variante: bool = False, reutiliser_resultat: bool = False) -> Iterator[Tuple[str, str]]:
+    """
+    Comme generer_histoire, mais produit le texte au fur et à mesure qu'il arrive.
+
+    Yields:
+        Des tuples (partie, morceau) où partie vaut 'texte' ou 'resume'
+
+    Un prompt identique à une génération en cours (ou récente, avec reutiliser_resultat)
+    est servi par le cache (voir cache_generation.py), sauf avec nouvelle_variante.
+    """
+    prompt_complet = construire_prompt(prompt, style, chapitres_precedents, niveau_strictesse, resume_histoire, passages_pertinents)
+    generation_prompt_caracteres.observer(len(prompt_complet))
+    generation_contexte_chapitres.observer(len(chapitres_precedents or []))
+    return cache_generation.generer(prompt_complet, lambda: _executer_generation(prompt_complet), nouvelle_variante,
+                                    reutiliser_resultat)
+
+
+def _executer_generation(prompt_complet: str) -> Iterator[Tuple[str, str]]:
+    """Fait générer le prompt par le backend configuré et découpe le texte au fil de l'eau"""
+    debut = time.perf_counter()
+    decoupeur = DecoupeurResume()
+    flux = backend_generation.generer(prompt_complet)
+    generations_en_cours.inc()
+    resultat = "erreur"
     try:
-        logger.debug("Lancement de la commande claude...")
-        logger.debug(f"Prompt length: {len(prompt_complet)} chars")
-
-        result = subprocess.run(
-            ["claude", "-p", prompt_complet],
-            capture_output=True,
-            text=True,
-            timeout=120,
-            env={**os.environ}  # Passer toutes les variables d'environnement
-        )
-
-        logger.debug(f"Return code: {result.returncode}")
-        logger.debug(f"STDOUT length: {len(result.stdout)} chars")
-        logger.debug(f"STDOUT (first 500): {result.stdout[:500]}")
-        logger.debug(f"STDERR: {result.stderr}")
-
-        if result.returncode != 0:
-            logger.error(f"Claude CLI error: {result.stderr}")
-            raise Exception(f"Erreur Claude CLI: {result.stderr}")
-
-        # Parser la réponse pour séparer le chapitre du résumé
-        output = result.stdout.strip()
-
-        if "---RESUME---" in output:
-            parts = output.split("---RESUME---", 1)
-            texte = parts[0].strip()
-            resume = parts[1].strip() if len(parts) > 1 else ""
-        else:
-            # Si le séparateur n'est pas trouvé, tout est considéré comme texte
-            texte = output
-            resume = ""
-
-        return {"texte": texte, "resume": resume}
-
-    except subprocess.TimeoutExpired:
-        logger.error("Timeout expired")
-        raise Exception("La génération a pris trop de temps")
-    except FileNotFoundError as e:
-        logger.error(f"FileNotFoundError: {e}")
-        raise Exception("Claude CLI n'est pas installé ou accessible")
-    except Exception as e:
-        logger.error(f"Exception: {e}")
+        for texte in flux:
+            yield from decoupeur.ajouter(texte)
+        yield from decoupeur.terminer()
+        resultat = "succes"
+    except GeneratorExit:
+        # Abandonnée par le client : ni succès ni échec du backend
+        resultat = "annulee"
         raise
+    finally:
+        # Fermé explicitement : un générateur abandonné par le client libère aussitôt le processus ou la connexion
+        flux.close()
+        generations_en_cours.dec()
+        duree = time.perf_counter() - debut
+        generation_duree.observer(duree, resultat=resultat)
+        if resultat != "annulee":
+            admission.disjoncteur.enregistrer(resultat == "succes")
+        logger.info("Génération claude", extra={"champs": {
+            "backend": backend_generation.nom, "resultat": resultat, "duree_s": round(duree, 3),
+            "prompt_caracteres": len(prompt_complet)
+        }})
@@ -0,0 +1,191 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import Chapitre, Contenu
+from memoire import actualiser_memoire, assembler_resume
+from index_passages import index_passages
+from versions import version_livre
+from metriques import generation_contexte_duree
+
+# Nombre de chapitres précédents repris en entier dans le prompt
+CONTEXTE_CHAPITRES_COMPLETS = int(os.environ.get("CONTEXTE_CHAPITRES_COMPLETS", "3"))
+# Taille maximale du contexte (chapitres complets + résumé), en caractères (≈ 4 caractères par token)
+CONTEXTE_BUDGET_CARACTERES = int(os.environ.get("CONTEXTE_BUDGET_CARACTERES", "40000"))
+# Nombre maximum de passages des chapitres anciens retrouvés à partir du prompt
+CONTEXTE_PASSAGES_MAX = int(os.environ.get("CONTEXTE_PASSAGES_MAX", "6"))
+# Nombre de contextes assemblés gardés en mémoire
+CONTEXTE_CACHE_TAILLE = int(os.environ.get("CONTEXTE_CACHE_TAILLE", "128"))
+
+
+class ConstructeurContexte:
+    """
+    Assemble le contexte de génération d'un chapitre et le met en cache.
+
+    La partie du contexte qui ne dépend pas du prompt (chapitres complets, résumés des
+    chapitres anciens) est gardée par (livre_id, ordre du chapitre) avec la version du
+    livre (voir versions.py) : tant qu'elle n'a pas changé, l'entrée est servie sans
+    autre requête. Sinon, l'empreinte des chapitres précédents (ids des chapitres et de
+    leurs contenus) vérifie si l'écriture les concernait ; une génération dans le
+    chapitre lui-même ne force ainsi pas la reconstruction de son contexte.
+    """
+
+    def __init__(self, taille_max: int = CONTEXTE_CACHE_TAILLE):
+        self.taille_max = taille_max
+        self._cache: "OrderedDict[Tuple[int, int], Dict]" = OrderedDict()
+        self._verrou = threading.Lock()
+        self.succes = 0
+        self.revalidations = 0
+        self.echecs = 0
+
+    @staticmethod
+    def _empreinte(db: Session, livre_id: int, ordre: int) -> str:
+        """
+        Hachage de l'état des chapitres précédents : pour chacun, dans l'ordre, son id,
+        sa position, son titre et les ids de ses contenus. Un contenu ajouté, supprimé
+        ou déplacé d'un chapitre à l'autre, un chapitre renommé ou réordonné le change.
+        """
+        lignes = db.query(Chapitre.id, Chapitre.ordre, Chapitre.titre, Contenu.id).outerjoin(
+            Contenu, Contenu.chapitre_id == Chapitre.id
+        ).filter(
+            Chapitre.livre_id == livre_id,
+            Chapitre.ordre < ordre
+        ).order_by(Chapitre.ordre, Chapitre.id, Contenu.id)
+        empreinte = hashlib.blake2b(digest_size=16)
+        for ligne in lignes:
+            empreinte.update(repr(tuple(ligne)).encode("utf-8"))
+        return empreinte.hexdigest()
+
+    def _assembler(self, db: Session, chapitre: Chapitre) -> Dict:
+        """Charge les chapitres précédents et leurs textes en une seule requête ordonnée"""
+        lignes = db.query(Chapitre, Contenu.texte_genere).outerjoin(
+            Contenu, Contenu.chapitre_id == Chapitre.id
+        ).filter(
+            Chapitre.livre_id == chapitre.livre_id,
+            Chapitre.ordre < chapitre.ordre
+        ).order_by(Chapitre.ordre, Chapitre.id, Contenu.id).all()
+
+        chapitres_precedents = []
+        textes: Dict[int, list] = {}
+        for chap, texte in lignes:
+            if chap.id not in textes:
+                chapitres_precedents.append(chap)
+                textes[chap.id] = []
+            if texte:
+                textes[chap.id].append(texte)
+
+        budget = CONTEXTE_BUDGET_CARACTERES
+        chapitres_complets = []
+        debut_complets = len(chapitres_precedents)
+        for index in range(len(chapitres_precedents) - 1, -1, -1):
+            if len(chapitres_complets) >= CONTEXTE_CHAPITRES_COMPLETS:
+                break
+            chap = chapitres_precedents[index]
+            texte = "\n\n".join(textes[chap.id])
+            if len(texte) > budget:
+                if chapitres_complets:
+                    break
+                # Le chapitre précédent seul dépasse le budget : garder sa fin, la plus utile pour enchaîner
+                texte = "…" + texte[-budget:]
+            debut_complets = index
+            if texte:
+                chapitres_complets.insert(0, {"titre": chap.titre, "contenu": texte})
+                budget -= len(texte)
+
+        chapitres_anciens = chapitres_precedents[:debut_complets]
+        # Lu avant actualiser_memoire, dont le commit expire les objets chargés
+        anciens = [(chap.id, chap.titre) for chap in chapitres_anciens]
+        return {
+            "chapitres": chapitres_complets,
+            "anciens": anciens,
+            "resumes": actualiser_memoire(db, chapitres_anciens),
+            "budget_restant": budget,
+        }
+
+    def _base(self, db: Session, chapitre: Chapitre, version: int) -> Dict:
+        livre_id, ordre = chapitre.livre_id, chapitre.ordre
+        cle = (livre_id, ordre)
+        with self._verrou:
+            entree = self._cache.get(cle)
+            if entree is not None:
+                self._cache.move_to_end(cle)
+                if entree["version"] == version:
+                    self.succes += 1
+                    return entree["base"]
+
+        empreinte = self._empreinte(db, livre_id, ordre)
+        if entree is not None and entree["empreinte"] == empreinte:
+            with self._verrou:
+                entree["version"] = version
+                self.revalidations += 1
+            return entree["base"]
+
+        base = self._assembler(db, chapitre)
+        with self._verrou:
+            self.echecs += 1
+            self._cache[cle] = {"version": version, "empreinte": empreinte, "base": base}
+            while len(self._cache) > self.taille_max:
+                self._cache.popitem(last=False)
+        return base
+
+    def construire(self, db: Session, chapitre: Chapitre, prompt: Optional[str] = None) -> Dict:
+        """
+        Construit le contexte des chapitres précédents d'un chapitre.
+
+        Les CONTEXTE_CHAPITRES_COMPLETS derniers chapitres sont repris en entier, les plus
+        anciens via leur résumé (voir memoire.py), le tout dans CONTEXTE_BUDGET_CARACTERES.
+        Si le prompt est fourni, les passages des chapitres anciens qui s'y rapportent le plus
+        (voir index_passages.py) sont ajoutés, sur au plus la moitié du budget restant.
+
+        Returns:
+            Dict avec 'chapitres' (liste de {'titre', 'contenu'}), 'passages'
+            (liste de {'titre', 'texte'}) et 'resume_histoire'
+        """
+        version = version_livre(db, chapitre.livre_id)
+        base = self._base(db, chapitre, version)
+        budget = base["budget_restant"]
+        anciens = base["anciens"]
+
+        passages = []
+        if prompt and anciens:
+            position = {chapitre_id: i for i, (chapitre_id, _) in enumerate(anciens)}
+            titres = dict(anciens)
+            budget_passages = budget // 2
+            trouves = index_passages.rechercher(
+                db, chapitre.livre_id, prompt, set(position), CONTEXTE_PASSAGES_MAX, version
+            )
+            for _, contenu_id, chapitre_id, texte in trouves:
+                if len(texte) > budget_passages:
+                    continue
+                passages.append((position[chapitre_id], contenu_id, {"titre": titres[chapitre_id], "texte": texte}))
+                budget_passages -= len(texte)
+                budget -= len(texte)
+            # Les passages sont présentés dans l'ordre de l'histoire
+            passages = [passage for _, _, passage in sorted(passages, key=lambda p: p[:2])]
+
+        return {
+            "chapitres": base["chapitres"],
+            "passages": passages,
+            "resume_histoire": assembler_resume(anciens, base["resumes"], budget)
+        }
+
+    def statistiques(self) -> Dict:
+        with self._verrou:
+            return {"entrees": len(self._cache), "taille_max": self.taille_max, "succes": self.succes,
+                    "revalidations": self.revalidations, "echecs": self.echecs}
+
+
+constructeur_contexte = ConstructeurContexte()
+
+
+def construire_contexte(db: Session, chapitre: Chapitre, prompt: Optional[str] = None) -> Dict:
+    debut = time.perf_counter()
+    try:
+        return constructeur_contexte.construire(db, chapitre, prompt)
+    finally:
+        generation_contexte_duree.observer(time.perf_counter() - debut)
@@ -1,5 +1,6 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # Déterminer le chemin de la base de données
@@ -16,10 +17,39 @@ else:
     # Développement local
     DATABASE_URL = "sqlite:///./histoires.db"
 
-print(f"Database URL: {DATABASE_URL}")
+
+# Réglages appliqués à chaque connexion SQLite :
+# - WAL : les lectures ne bloquent plus les écritures (générations en parallèle des lectures)
+# - synchronous=NORMAL : sûr en WAL, sans fsync à chaque transaction
+# - foreign_keys : active les contraintes et les ON DELETE CASCADE (désactivées par défaut)
+# - busy_timeout : attend un verrou d'écriture au lieu d'échouer immédiatement
+PRAGMAS_SQLITE = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    "busy_timeout": os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+    "cache_size": "-20000",  # en Kio
+    "temp_store": "MEMORY",
+}
 
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Moteur asynchrone (aiosqlite) sur la même base, pour les routes CRUD : une requête en
+# attente de SQLite n'occupe pas de thread du pool, déjà sollicité par les générations
+async_engine = create_async_engine(DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1))
+
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def _configurer_connexion(connexion_dbapi, _):
+    curseur = connexion_dbapi.cursor()
+    for pragma, valeur in PRAGMAS_SQLITE.items():
+        curseur.execute(f"PRAGMA {pragma}={valeur}")
+    curseur.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False : un objet relu après commit déclencherait une requête implicite, interdite en asynchrone
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 
@@ -29,3 +59,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,76 @@
+import hashlib
+from typing import Any, Optional, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Style, Livre, Chapitre, VersionLivre
+
+# Le client revalide à chaque lecture ; la réponse 304 évite de renvoyer le corps
+CACHE_CONTROL = "no-cache"
+
+
+# Validateurs : quelques agrégats SQL, sans charger d'objet ORM, qui changent dès que
+# la réponse correspondante peut changer. Un contenu ne change plus après insertion ;
+# toute écriture sur les chapitres et contenus d'un livre incrémente sa version
+# (voir versions.py).
+
+async def validateur_styles(db: AsyncSession) -> Tuple:
+    return tuple((await db.execute(select(
+        func.count(Style.id), func.total(Style.id), func.max(Style.date_creation)
+    ))).one())
+
+
+async def validateur_livres(db: AsyncSession) -> Tuple:
+    # Les livres embarquent leur style : la suppression d'un style les modifie
+    livres = tuple((await db.execute(select(
+        func.count(Livre.id), func.total(Livre.id), func.max(Livre.date_creation),
+        func.total(Livre.id * func.coalesce(Livre.style_id, 0))
+    ))).one())
+    return livres + await validateur_styles(db)
+
+
+async def validateur_livre(db: AsyncSession, livre_id: int) -> Optional[Tuple]:
+    """None si le livre n'existe pas"""
+    ligne = (await db.execute(select(
+        Livre.id, Livre.date_creation, Livre.style_id, Style.id, Style.date_creation, VersionLivre.version
+    ).outerjoin(Style, Style.id == Livre.style_id).outerjoin(
+        VersionLivre, VersionLivre.livre_id == Livre.id
+    ).where(Livre.id == livre_id))).first()
+    return tuple(ligne) if ligne else None
+
+
+async def validateur_chapitres(db: AsyncSession, livre_id: int) -> Tuple:
+    version = await db.scalar(select(VersionLivre.version).where(VersionLivre.livre_id == livre_id))
+    return (livre_id, version or 0)
+
+
+async def validateur_contenus(db: AsyncSession, chapitre_id: int) -> Tuple:
+    ligne = (await db.execute(select(Chapitre.livre_id, VersionLivre.version).outerjoin(
+        VersionLivre, VersionLivre.livre_id == Chapitre.livre_id
+    ).where(Chapitre.id == chapitre_id))).first()
+    return (chapitre_id,) + (tuple(ligne) if ligne else (None, None))
+
+
+def calculer_etag(request: Request, *parties: Any) -> str:
+    """ETag fort : hash du validateur, du chemin et des paramètres de la requête"""
+    empreinte = repr((request.url.path, str(request.query_params), parties))
+    return '"' + hashlib.sha256(empreinte.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def non_modifie(request: Request, etag: str) -> Optional[Response]:
+    """Réponse 304 si l'en-tête If-None-Match du client correspond à l'ETag, sinon None"""
+    entete = request.headers.get("if-none-match")
+    if not entete:
+        return None
+    candidats = {valeur.strip().removeprefix("W/") for valeur in entete.split(",")}
+    if etag in candidats or "*" in candidats:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    return None
+
+
+def poser_etag(response: Response, etag: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
@@ -0,0 +1,216 @@
+"""
+Export d'un livre entier en Markdown, texte brut ou EPUB, produit au fil de la lecture.
+
+Les chapitres et leurs contenus sont lus par un curseur côté serveur, dans l'ordre de
+lecture (ordre des chapitres, puis des contenus) : un seul texte est en mémoire à la
+fois, et les premiers octets partent avant que la fin du livre soit lue. L'EPUB est
+zippé à la volée : seule l'entrée en cours (un chapitre compressé) est gardée en
+mémoire, le temps que zipfile réécrive son en-tête.
+"""
+import re
+import zipfile
+import unicodedata
+from datetime import datetime, timezone
+from html import escape
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from uuid import uuid5, NAMESPACE_URL
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from models import Chapitre, Contenu
+
+FORMATS = {
+    "md": ("text/markdown", "md"),
+    "txt": ("text/plain", "txt"),
+    "epub": ("application/epub+zip", "epub"),
+}
+
+# Lignes lues à la fois par le curseur côté serveur
+LIGNES_PAR_LOT = 20
+
+# (chapitre_id, titre du chapitre, texte généré ou None pour un chapitre vide)
+Ligne = Tuple[int, str, Optional[str]]
+
+
+async def lire_livre(moteur: AsyncEngine, livre_id: int) -> AsyncIterator[Ligne]:
+    """Chapitres et contenus du livre dans l'ordre de lecture, par lots, sur une connexion dédiée"""
+    requete = select(Chapitre.id, Chapitre.titre, Contenu.texte_genere).outerjoin(
+        Contenu, Contenu.chapitre_id == Chapitre.id
+    ).where(Chapitre.livre_id == livre_id).order_by(Chapitre.ordre, Chapitre.id, Contenu.id)
+
+    # Connexion propre au flux : la session de la requête est fermée avant l'envoi de la réponse
+    async with moteur.connect() as connexion:
+        resultat = await connexion.stream(requete.execution_options(yield_per=LIGNES_PAR_LOT))
+        async for chapitre_id, titre, texte in resultat:
+            yield chapitre_id, titre, texte
+
+
+def nom_fichier(titre: str, extension: str) -> str:
+    """Nom ASCII pour l'en-tête Content-Disposition (le nom UTF-8 est envoyé à part)"""
+    ascii_ = unicodedata.normalize("NFKD", titre).encode("ascii", "ignore").decode("ascii")
+    base = re.sub(r"[^A-Za-z0-9]+", "-", ascii_).strip("-").lower() or "livre"
+    return f"{base[:80]}.{extension}"
+
+
+async def exporter_texte(livre: Dict, lignes: AsyncIterator[Ligne], markdown: bool) -> AsyncIterator[bytes]:
+    if markdown:
+        entete = f"# {livre['titre']}\n\n" + (f"_{livre['description']}_\n\n" if livre.get("description") else "")
+    else:
+        entete = f"{livre['titre']}\n{'=' * len(livre['titre'])}\n\n" + (
+            f"{livre['description']}\n\n" if livre.get("description") else "")
+    yield entete.encode("utf-8")
+
+    chapitre_courant = None
+    async for chapitre_id, titre, texte in lignes:
+        if chapitre_id != chapitre_courant:
+            chapitre_courant = chapitre_id
+            titre_chapitre = f"## {titre}\n\n" if markdown else f"\n{titre}\n{'-' * len(titre)}\n\n"
+            yield titre_chapitre.encode("utf-8")
+        if texte:
+            yield (texte.strip() + "\n\n").encode("utf-8")
+
+
+class TamponZip:
+    """
+    Fichier de sortie de zipfile qui transmet les octets au fur et à mesure.
+
+    zipfile revient sur l'en-tête local d'une entrée une fois celle-ci écrite (taille,
+    CRC) : ce tampon se déclare donc déplaçable, mais seulement dans la partie pas
+    encore transmise, vidée entre deux entrées par vider().
+    """
+
+    def __init__(self):
+        self._tampon = bytearray()
+        self._transmis = 0
+        self._position = 0
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, position: int, origine: int = 0) -> int:
+        if origine == 2:
+            position += self._transmis + len(self._tampon)
+        elif origine == 1:
+            position += self._position
+        if position < self._transmis:
+            raise OSError("Retour sur des octets déjà transmis")
+        self._position = position
+        return position
+
+    def write(self, donnees) -> int:
+        debut = self._position - self._transmis
+        self._tampon[debut:debut + len(donnees)] = donnees
+        self._position += len(donnees)
+        return len(donnees)
+
+    def flush(self):
+        pass
+
+    def vider(self) -> bytes:
+        donnees = bytes(self._tampon)
+        self._transmis += len(donnees)
+        self._tampon.clear()
+        return donnees
+
+
+def _xhtml(titre: str, corps: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="fr" xml:lang="fr">\n'
+        f"<head><meta charset=\"utf-8\"/><title>{escape(titre)}</title></head>\n<body>\n{corps}</body>\n</html>\n"
+    )
+
+
+def _paragraphes(texte: str) -> str:
+    return "".join(f"<p>{escape(ligne)}</p>\n" for ligne in texte.split("\n") if ligne.strip())
+
+
+CONTAINER_XML = """<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>
+"""
+
+
+def _opf(livre: Dict, chapitres: List[Tuple[str, str]]) -> str:
+    identifiant = uuid5(NAMESPACE_URL, f"les-histoires-de-rebecca/livres/{livre['id']}")
+    modifie = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    items = "".join(
+        f'    <item id="{nom}" href="{nom}.xhtml" media-type="application/xhtml+xml"/>\n' for nom, _ in chapitres
+    )
+    spine = "".join(f'    <itemref idref="{nom}"/>\n' for nom, _ in chapitres)
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id-livre" xml:lang="fr">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="id-livre">urn:uuid:{identifiant}</dc:identifier>
+    <dc:title>{escape(livre['titre'])}</dc:title>
+    <dc:language>fr</dc:language>
+    <meta property="dcterms:modified">{modifie}</meta>
+  </metadata>
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+    <item id="titre" href="titre.xhtml" media-type="application/xhtml+xml"/>
+{items}  </manifest>
+  <spine>
+    <itemref idref="titre"/>
+{spine}  </spine>
+</package>
+"""
+
+
+def _nav(chapitres: List[Tuple[str, str]]) -> str:
+    liens = "".join(f'<li><a href="{nom}.xhtml">{escape(titre)}</a></li>\n' for nom, titre in chapitres)
+    return _xhtml("Table des matières", f'<nav epub:type="toc" id="toc"><h1>Table des matières</h1>\n<ol>\n{liens}</ol></nav>\n')
+
+
+async def exporter_epub(livre: Dict, lignes: AsyncIterator[Ligne]) -> AsyncIterator[bytes]:
+    """
+    EPUB 3 : une page de titre, un fichier XHTML par chapitre, puis la table des matières
+    et le manifeste, écrits en dernier puisqu'ils listent les chapitres lus entre-temps.
+    """
+    sortie = TamponZip()
+    archive = zipfile.ZipFile(sortie, "w", compression=zipfile.ZIP_DEFLATED)
+    # mimetype : première entrée, non compressée (exigé par le format)
+    archive.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+    archive.writestr("META-INF/container.xml", CONTAINER_XML)
+    description = f"<p><em>{escape(livre['description'])}</em></p>\n" if livre.get("description") else ""
+    archive.writestr("OEBPS/titre.xhtml", _xhtml(livre["titre"], f"<h1>{escape(livre['titre'])}</h1>\n{description}"))
+    yield sortie.vider()
+
+    chapitres: List[Tuple[str, str]] = []
+    entree = None
+    chapitre_courant = None
+    async for chapitre_id, titre, texte in lignes:
+        if chapitre_id != chapitre_courant:
+            if entree is not None:
+                entree.write(b"</body>\n</html>\n")
+                entree.close()
+                yield sortie.vider()
+            chapitre_courant = chapitre_id
+            nom = f"chapitre-{len(chapitres) + 1}"
+            chapitres.append((nom, titre))
+            info = zipfile.ZipInfo(f"OEBPS/{nom}.xhtml", date_time=datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            entree = archive.open(info, "w")
+            # En-tête et corps écrits séparément : le document est fermé au chapitre suivant
+            entree.write(_xhtml(titre, f"<h1>{escape(titre)}</h1>\n").rsplit("</body>", 1)[0].encode("utf-8"))
+        if texte:
+            entree.write(_paragraphes(texte).encode("utf-8"))
+    if entree is not None:
+        entree.write(b"</body>\n</html>\n")
+        entree.close()
+
+    archive.writestr("OEBPS/nav.xhtml", _nav(chapitres))
+    archive.writestr("OEBPS/content.opf", _opf(livre, chapitres))
+    archive.close()
+    yield sortie.vider()
+
+
+def exporter(format_: str, livre: Dict, lignes: AsyncIterator[Ligne]) -> AsyncIterator[bytes]:
+    if format_ == "epub":
+        return exporter_epub(livre, lignes)
+    return exporter_texte(livre, lignes, markdown=format_ == "md")
@@ -0,0 +1,184 @@
+"""
+Service des fichiers du frontend (build Vite copié dans backend/static).
+
+Le dossier est parcouru une fois, à la création de FichiersStatiques : les requêtes ne
+touchent plus au système de fichiers que pour lire le fichier envoyé. Pour chaque
+fichier, les variantes précompressées présentes à côté (`.br`, `.gz`) sont servies
+selon l'en-tête Accept-Encoding du client.
+
+- /assets/* : noms contenant une empreinte du contenu (Vite), donc jamais modifiés :
+  mis en cache un an (`immutable`), sans revalidation
+- index.html et les autres fichiers : revalidés à chaque visite (ETag, réponse 304)
+- toute autre route renvoie index.html (routage du SPA), gardé en mémoire avec ses variantes
+
+Les variantes sont produites après le build (voir le Dockerfile) :
+    python fichiers_statiques.py static
+(brotli si le paquet `brotli` est installé, gzip sinon seulement)
+"""
+import os
+import sys
+import gzip
+import mimetypes
+from typing import Dict
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+
+# Extensions qui valent la peine d'être compressées
+EXTENSIONS_COMPRESSIBLES = {".html", ".js", ".mjs", ".css", ".json", ".svg", ".txt", ".map", ".xml", ".webmanifest"}
+# Fichiers plus petits : la compression ne gagne rien
+TAILLE_MIN_COMPRESSION = 512
+
+CACHE_IMMUABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDER = "no-cache"
+
+# Encodage de l'en-tête Content-Encoding -> extension de la variante, par ordre de préférence
+ENCODAGES = (("br", ".br"), ("gzip", ".gz"))
+
+
+class Fichier:
+    """Un fichier du build et ses variantes précompressées"""
+
+    def __init__(self, chemin: str, relatif: str):
+        self.chemin = chemin
+        self.media_type = mimetypes.guess_type(relatif)[0] or "application/octet-stream"
+        self.immuable = relatif.startswith("assets/")
+        # Encodage ("" pour l'original) -> (chemin, stat)
+        self.variantes: Dict[str, tuple] = {"": (chemin, os.stat(chemin))}
+        for encodage, extension in ENCODAGES:
+            if os.path.isfile(chemin + extension):
+                self.variantes[encodage] = (chemin + extension, os.stat(chemin + extension))
+        stat = self.variantes[""][1]
+        self.empreinte = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+    def etag(self, encodage: str) -> str:
+        # Un ETag par représentation : les variantes n'ont pas les mêmes octets
+        return f'"{self.empreinte}{"-" + encodage if encodage else ""}"'
+
+
+def encodages_acceptes(request: Request) -> Dict[str, float]:
+    """Encodages de l'en-tête Accept-Encoding et leur poids q"""
+    acceptes = {}
+    for partie in request.headers.get("accept-encoding", "").split(","):
+        nom, _, parametres = partie.strip().partition(";")
+        poids = 1.0
+        parametres = parametres.strip()
+        if parametres.startswith("q="):
+            try:
+                poids = float(parametres[2:])
+            except ValueError:
+                poids = 0.0
+        if nom:
+            acceptes[nom.strip().lower()] = poids
+    return acceptes
+
+
+def choisir_encodage(fichier: Fichier, request: Request) -> str:
+    """
+    Variante disponible de plus grand poids q ; à poids égal, l'ordre d'ENCODAGES.
+    L'original (identity) n'est préféré que s'il est demandé avec un poids supérieur.
+    """
+    acceptes = encodages_acceptes(request)
+    defaut = acceptes.get("*", 0)
+    candidats = [
+        (acceptes.get(encodage, defaut), encodage) for encodage, _ in ENCODAGES
+        if encodage in fichier.variantes and acceptes.get(encodage, defaut) > 0
+    ]
+    # En dernier : max garde le premier des ex aequo ; seul candidat si aucune variante n'est acceptée
+    candidats.append((acceptes.get("identity", defaut), ""))
+    return max(candidats, key=lambda candidat: candidat[0])[1]
+
+
+def _correspond(request: Request, etag: str) -> bool:
+    entete = request.headers.get("if-none-match")
+    if not entete:
+        return False
+    candidats = {valeur.strip().removeprefix("W/") for valeur in entete.split(",")}
+    return etag in candidats or "*" in candidats
+
+
+class FichiersStatiques:
+    def __init__(self, dossier: str):
+        self.dossier = dossier
+        self.fichiers: Dict[str, Fichier] = {}
+        for racine, _, noms in os.walk(dossier):
+            for nom in noms:
+                if nom.endswith((".br", ".gz")):
+                    continue
+                chemin = os.path.join(racine, nom)
+                relatif = os.path.relpath(chemin, dossier).replace(os.sep, "/")
+                self.fichiers[relatif] = Fichier(chemin, relatif)
+
+        # index.html : renvoyé pour toutes les routes du SPA, gardé en mémoire
+        self.index = self.fichiers.get("index.html")
+        self._index_octets: Dict[str, bytes] = {}
+        if self.index is not None:
+            for encodage, (chemin, _) in self.index.variantes.items():
+                with open(chemin, "rb") as f:
+                    self._index_octets[encodage] = f.read()
+
+    def _entetes(self, fichier: Fichier, encodage: str) -> Dict[str, str]:
+        entetes = {
+            "ETag": fichier.etag(encodage),
+            "Cache-Control": CACHE_IMMUABLE if fichier.immuable else CACHE_REVALIDER,
+        }
+        if len(fichier.variantes) > 1:
+            entetes["Vary"] = "Accept-Encoding"
+        if encodage:
+            entetes["Content-Encoding"] = encodage
+        return entetes
+
+    def servir(self, chemin: str, request: Request) -> Response:
+        """Le fichier demandé ; index.html pour une route inconnue, 404 pour un asset inconnu"""
+        fichier = self.fichiers.get(chemin.lstrip("/")) if chemin else None
+        if fichier is None:
+            if chemin.startswith("assets/") or self.index is None:
+                # Un asset absent (ancienne version du build) ne doit pas recevoir index.html
+                return Response(status_code=404)
+            fichier = self.index
+
+        encodage = choisir_encodage(fichier, request)
+        entetes = self._entetes(fichier, encodage)
+        if _correspond(request, entetes["ETag"]):
+            return Response(status_code=304, headers=entetes)
+        if fichier is self.index:
+            return Response(self._index_octets[encodage], media_type=fichier.media_type, headers=entetes)
+
+        chemin_variante, stat = fichier.variantes[encodage]
+        reponse = FileResponse(chemin_variante, media_type=fichier.media_type, stat_result=stat)
+        # Remplace les en-têtes calculés par FileResponse (ETag de la variante, sans Cache-Control)
+        reponse.headers.update(entetes)
+        return reponse
+
+
+def precompresser(dossier: str) -> int:
+    """Écrit les variantes .gz (et .br si le paquet brotli est installé) des fichiers compressibles"""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        print("Paquet brotli absent : variantes .gz seulement", file=sys.stderr)
+
+    ecrits = 0
+    for racine, _, noms in os.walk(dossier):
+        for nom in noms:
+            chemin = os.path.join(racine, nom)
+            if os.path.splitext(nom)[1] not in EXTENSIONS_COMPRESSIBLES or os.path.getsize(chemin) < TAILLE_MIN_COMPRESSION:
+                continue
+            with open(chemin, "rb") as f:
+                contenu = f.read()
+            variantes = {".gz": gzip.compress(contenu, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variantes[".br"] = brotli.compress(contenu, quality=11)
+            for extension, compresse in variantes.items():
+                # Une variante plus grosse que l'original n'est pas gardée
+                if len(compresse) < len(contenu):
+                    with open(chemin + extension, "wb") as f:
+                        f.write(compresse)
+                    ecrits += 1
+    return ecrits
+
+
+if __name__ == "__main__":
+    dossier = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+    print(f"{precompresser(dossier)} variantes écrites dans {dossier}", file=sys.stderr)
@@ -0,0 +1,125 @@
+import logging
+import threading
+from typing import Callable, Dict, Optional, Iterator, Tuple
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Style, Livre, Chapitre, Contenu
+from cache_reference import cache_reference, cle_livre, cle_style, livre_en_dict, style_en_dict
+from claude_service import generer_histoire, generer_histoire_stream
+from contexte import construire_contexte
+
+logger = logging.getLogger(__name__)
+
+# Sérialise la vérification d'un contenu identique et son insertion
+_verrou_enregistrement = threading.Lock()
+
+
+def description_style(db: Session, livre_id: int) -> Optional[str]:
+    """Retourne la description du style du livre, s'il en a un (via le cache des données de référence)"""
+    livre = cache_reference.obtenir(cle_livre(livre_id), lambda: livre_en_dict(db.get(Livre, livre_id)))
+    if not livre or not livre["style_id"]:
+        return None
+    style = cache_reference.obtenir(cle_style(livre["style_id"]), lambda: style_en_dict(db.get(Style, livre["style_id"])))
+    return style["description"] if style else None
+
+
+def sauvegarder_contenu(db: Session, chapitre_id: int, prompt: str, resultat: Dict[str, str], niveau_strictesse: str,
+                        avant_commit: Optional[Callable[[Contenu], bool]] = None) -> Optional[Contenu]:
+    """
+    Enregistre le résultat d'une génération comme nouveau contenu du chapitre.
+
+    Des requêtes identiques simultanées partagent la même génération (voir
+    cache_generation.py) : si le chapitre a déjà ce texte pour ce prompt, le contenu
+    existant est retourné au lieu d'en insérer un second.
+
+    avant_commit(contenu) est appelé dans la même transaction, avant le commit, pour
+    y ajouter les écritures de l'appelant ; s'il retourne False, la transaction est
+    annulée et la fonction retourne None.
+    """
+    with _verrou_enregistrement:
+        db_contenu = db.query(Contenu).filter(
+            Contenu.chapitre_id == chapitre_id,
+            Contenu.texte_utilisateur == prompt,
+            Contenu.texte_genere == resultat["texte"]
+        ).first()
+        if db_contenu is None:
+            db_contenu = Contenu(
+                chapitre_id=chapitre_id,
+                texte_utilisateur=prompt,
+                texte_genere=resultat["texte"],
+                resume=resultat["resume"],
+                niveau_strictesse=niveau_strictesse
+            )
+            db.add(db_contenu)
+            db.flush()
+        if avant_commit is not None and not avant_commit(db_contenu):
+            db.rollback()
+            return None
+        db.commit()
+    db.refresh(db_contenu)
+    return db_contenu
+
+
+def generer_pour_chapitre(db: Session, chapitre: Chapitre, prompt: str, niveau_strictesse: Optional[str],
+                          nouvelle_variante: bool = False,
+                          avant_commit: Optional[Callable[[Contenu], bool]] = None) -> Optional[Contenu]:
+    """
+    Génère une histoire pour un chapitre et la sauvegarde comme nouveau contenu.
+
+    Les exceptions de génération sont propagées à l'appelant. avant_commit : voir sauvegarder_contenu.
+    """
+    niveau = niveau_strictesse or "modere"
+    contexte = construire_contexte(db, chapitre, prompt)
+    resultat = generer_histoire(
+        prompt,
+        description_style(db, chapitre.livre_id),
+        contexte["chapitres"],
+        niveau,
+        contexte["resume_histoire"],
+        contexte["passages"],
+        nouvelle_variante
+    )
+    return sauvegarder_contenu(db, chapitre.id, prompt, resultat, niveau, avant_commit)
+
+
+def generer_flux_pour_chapitre(chapitre_id: int, prompt: str, niveau_strictesse: str,
+                               style: Optional[str], contexte: Dict,
+                               nouvelle_variante: bool = False) -> Iterator[Tuple[str, object]]:
+    """
+    Génère une histoire en streaming puis la sauvegarde.
+
+    Yields:
+        ('texte' | 'resume', morceau) au fil de la génération, puis ('fin', Contenu)
+        une fois le contenu enregistré, ou ('erreur', message) en cas d'échec.
+
+    Le style et le contexte (voir construire_contexte) sont préparés par l'appelant : ce générateur ouvre
+    sa propre session pour ne pas garder celle de la requête pendant le streaming.
+    """
+    morceaux = {"texte": [], "resume": []}
+    try:
+        for partie, morceau in generer_histoire_stream(prompt, style, contexte["chapitres"], niveau_strictesse,
+                                                          contexte["resume_histoire"], contexte["passages"],
+                                                          nouvelle_variante):
+            morceaux[partie].append(morceau)
+            yield partie, morceau
+    except Exception as e:
+        yield "erreur", str(e)
+        return
+
+    resultat = {
+        "texte": "".join(morceaux["texte"]).strip(),
+        "resume": "".join(morceaux["resume"]).strip()
+    }
+    db = SessionLocal()
+    try:
+        contenu = sauvegarder_contenu(db, chapitre_id, prompt, resultat, niveau_strictesse)
+    except Exception as e:
+        # Le texte a été transmis en entier : le client doit savoir qu'il n'est pas enregistré
+        logger.exception(f"Enregistrement du contenu généré impossible (chapitre {chapitre_id})")
+        db.rollback()
+        yield "erreur", f"Histoire générée mais non enregistrée : {e}"
+        return
+    finally:
+        db.close()
+    yield "fin", contenu
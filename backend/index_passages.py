@@ -0,0 +1,219 @@
+import os
+import re
+import math
+import threading
+import unicodedata
+from datetime import datetime
+from collections import Counter, OrderedDict, defaultdict
+from typing import Collection, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import Chapitre, Contenu
+
+# Paramètres BM25 classiques
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Nombre de livres dont l'index est gardé en mémoire
+INDEX_LIVRES_MAX = int(os.environ.get("INDEX_LIVRES_MAX", "32"))
+
+MOTS_VIDES = set("""
+a ai au aux avec avait avoir c ce ces cet cette ceux chez comme d dans de des du elle elles en
+est et etait eu il ils j je l la le les leur leurs lui m ma mais me meme mes mon n ne ni nos notre
+nous on ou par pas plus pour qu que qui s sa sans se ses si son sont sur t ta te tes toi ton tous
+tout toute tres tu un une vos votre vous y ete etre fait faire alors puis aussi bien encore deja
+histoire chapitre raconte ecris genere
+""".split())
+
+_MOT = re.compile(r"\w+")
+# Entre deux mots, marque une nouvelle phrase (ou réplique) : la majuscule du mot suivant est de position
+_DEBUT_DE_PHRASE = re.compile(r"[.!?…:«“\"—\n]")
+
+
+def _normaliser(mot: str) -> str:
+    sans_accents = unicodedata.normalize("NFKD", mot).encode("ascii", "ignore").decode("ascii")
+    return sans_accents.lower()
+
+
+def tokeniser(texte: str) -> List[str]:
+    """Mots normalisés (minuscules, sans accents) hors mots vides"""
+    mots = (_normaliser(m) for m in _MOT.findall(texte))
+    return [m for m in mots if len(m) > 1 and m not in MOTS_VIDES and not m.isdigit()]
+
+
+def _mots_a_majuscule(texte: str) -> Tuple[Set[str], Set[str]]:
+    """Mots à majuscule normalisés, hors mots vides : (en début de phrase, en cours de phrase)"""
+    debut_de_phrase, en_cours_de_phrase = set(), set()
+    fin = None
+    for m in _MOT.finditer(texte):
+        mot = m.group()
+        if mot[0].isupper() and len(mot) > 1 and _normaliser(mot) not in MOTS_VIDES:
+            initial = fin is None or _DEBUT_DE_PHRASE.search(texte, fin, m.start())
+            (debut_de_phrase if initial else en_cours_de_phrase).add(_normaliser(mot))
+        fin = m.end()
+    return debut_de_phrase, en_cours_de_phrase
+
+
+def entites(texte: str, connus: Collection[str] = ()) -> Set[str]:
+    """
+    Noms propres probables (mots à majuscule) : personnages et lieux cités dans le prompt.
+
+    Un mot à majuscule en début de phrase ("Soudain", "Ensuite") n'est retenu que s'il en
+    porte une aussi en cours de phrase, dans le texte ou dans `connus` (noms vus ainsi dans le livre).
+    """
+    debut_de_phrase, en_cours_de_phrase = _mots_a_majuscule(texte)
+    return en_cours_de_phrase | {mot for mot in debut_de_phrase if mot in connus}
+
+
+def decouper_paragraphes(texte: str) -> List[str]:
+    return [p.strip() for p in re.split(r"\n\s*\n|\n", texte or "") if p.strip()]
+
+
+class IndexLivre:
+    """Index BM25 des paragraphes des contenus d'un livre, mis à jour contenu par contenu"""
+
+    def __init__(self):
+        self.passages: Dict[int, Tuple[int, int, str]] = {}  # id passage -> (contenu_id, chapitre_id, texte)
+        self.par_contenu: Dict[int, List[int]] = {}
+        self.dates: Dict[int, datetime] = {}  # contenu_id -> date de création
+        self.termes: Dict[int, Counter] = {}
+        self.longueurs: Dict[int, int] = {}
+        self.postings: Dict[str, Set[int]] = defaultdict(set)
+        # Mots à majuscule en cours de phrase (noms propres) -> nombre de passages qui les portent
+        self.noms: Counter = Counter()
+        self.noms_par_passage: Dict[int, Set[str]] = {}
+        self.longueur_totale = 0
+        self._prochain_id = 0
+        self.version: Optional[int] = None  # version du livre lors de la dernière synchronisation
+
+    def ajouter(self, contenu_id: int, chapitre_id: int, texte: str, date_creation: datetime):
+        ids = []
+        for paragraphe in decouper_paragraphes(texte):
+            termes = Counter(tokeniser(paragraphe))
+            if not termes:
+                continue
+            passage_id = self._prochain_id
+            self._prochain_id += 1
+            self.passages[passage_id] = (contenu_id, chapitre_id, paragraphe)
+            self.termes[passage_id] = termes
+            self.longueurs[passage_id] = sum(termes.values())
+            self.longueur_totale += self.longueurs[passage_id]
+            for terme in termes:
+                self.postings[terme].add(passage_id)
+            _, noms = _mots_a_majuscule(paragraphe)
+            self.noms_par_passage[passage_id] = noms
+            self.noms.update(noms)
+            ids.append(passage_id)
+        self.par_contenu[contenu_id] = ids
+        self.dates[contenu_id] = date_creation
+
+    def retirer(self, contenu_id: int):
+        self.dates.pop(contenu_id, None)
+        for passage_id in self.par_contenu.pop(contenu_id, []):
+            termes = self.termes.pop(passage_id)
+            self.longueur_totale -= self.longueurs.pop(passage_id)
+            for terme in termes:
+                self.postings[terme].discard(passage_id)
+                if not self.postings[terme]:
+                    del self.postings[terme]
+            for nom in self.noms_par_passage.pop(passage_id):
+                self.noms[nom] -= 1
+                if not self.noms[nom]:
+                    del self.noms[nom]
+            del self.passages[passage_id]
+
+    def rechercher(self, requete: str, chapitres_autorises: Set[int], limite: int) -> List[Tuple[float, int, int, str]]:
+        """
+        Retourne les meilleurs passages (score, contenu_id, chapitre_id, texte) pour la requête.
+
+        Si la requête cite des noms propres, seuls les passages qui en mentionnent au moins un sont retenus.
+        """
+        termes_requete = set(tokeniser(requete))
+        noms = entites(requete, self.noms) & termes_requete
+        if not termes_requete or not self.passages:
+            return []
+
+        nombre = len(self.passages)
+        longueur_moyenne = self.longueur_totale / nombre
+        scores: Dict[int, float] = defaultdict(float)
+        for terme in termes_requete:
+            candidats = self.postings.get(terme)
+            if not candidats:
+                continue
+            idf = math.log(1 + (nombre - len(candidats) + 0.5) / (len(candidats) + 0.5))
+            for passage_id in candidats:
+                if self.passages[passage_id][1] not in chapitres_autorises:
+                    continue
+                tf = self.termes[passage_id][terme]
+                longueur = self.longueurs[passage_id]
+                scores[passage_id] += idf * tf * (BM25_K1 + 1) / (
+                    tf + BM25_K1 * (1 - BM25_B + BM25_B * longueur / longueur_moyenne)
+                )
+
+        if noms:
+            scores = {pid: s for pid, s in scores.items() if noms & self.termes[pid].keys()}
+
+        meilleurs = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limite]
+        return [(score, *self.passages[pid]) for pid, score in meilleurs]
+
+
+class IndexPassages:
+    """
+    Index par livre, construits à la demande et gardés dans un LRU.
+
+    À chaque utilisation, la liste des contenus du livre est comparée à celle de l'index :
+    seuls les contenus ajoutés sont lus et découpés, les contenus supprimés sont retirés.
+    """
+
+    def __init__(self, taille_max: int = INDEX_LIVRES_MAX):
+        self.taille_max = taille_max
+        self._index: "OrderedDict[int, IndexLivre]" = OrderedDict()
+        self._verrou = threading.Lock()
+
+    def _synchroniser(self, db: Session, livre_id: int, index: IndexLivre):
+        # SQLite peut réattribuer l'id d'un contenu supprimé : la date de création les distingue
+        en_base = set(
+            db.query(Contenu.id, Contenu.date_creation)
+            .join(Chapitre, Contenu.chapitre_id == Chapitre.id)
+            .filter(Chapitre.livre_id == livre_id)
+        )
+        indexes = set(index.dates.items())
+
+        for contenu_id, _ in indexes - en_base:
+            index.retirer(contenu_id)
+
+        nouveaux = [contenu_id for contenu_id, _ in en_base - indexes]
+        if nouveaux:
+            lignes = db.query(Contenu.id, Contenu.chapitre_id, Contenu.texte_genere).filter(
+                Contenu.id.in_(nouveaux)
+            ).all()
+            dates = dict(en_base)
+            for contenu_id, chapitre_id, texte in lignes:
+                index.ajouter(contenu_id, chapitre_id, texte or "", dates[contenu_id])
+
+    def rechercher(self, db: Session, livre_id: int, requete: str, chapitres_autorises: Set[int],
+                   limite: int = 6, version: Optional[int] = None) -> List[Tuple[float, int, int, str]]:
+        """
+        Recherche dans l'index du livre, après l'avoir synchronisé avec la base.
+
+        Si la version du livre (voir versions.py) est fournie et n'a pas changé depuis
+        la dernière synchronisation, la base n'est pas interrogée.
+        """
+        with self._verrou:
+            index = self._index.pop(livre_id, None) or IndexLivre()
+            self._index[livre_id] = index
+            while len(self._index) > self.taille_max:
+                self._index.popitem(last=False)
+
+            if version is None or index.version != version:
+                self._synchroniser(db, livre_id, index)
+                index.version = version
+            return index.rechercher(requete, chapitres_autorises, limite)
+
+    def oublier(self, livre_id: int):
+        with self._verrou:
+            self._index.pop(livre_id, None)
+
+
+index_passages = IndexPassages()
@@ -0,0 +1,302 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import logging
+import threading
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import update, or_
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Chapitre, JobGeneration
+from generation import generer_pour_chapitre
+from admission import admission
+
+logger = logging.getLogger(__name__)
+
+# Nombre maximum de générations Claude exécutées en parallèle
+GENERATION_WORKERS = int(os.environ.get("GENERATION_WORKERS", "2"))
+
+# Intervalle (secondes) auquel un processus signale que ses jobs en cours sont toujours exécutés
+JOB_BATTEMENT_SECONDES = float(os.environ.get("JOB_BATTEMENT_SECONDES", "30"))
+# Durée (secondes) sans battement au-delà de laquelle un job en cours est considéré abandonné et repris
+JOB_BAIL_SECONDES = float(os.environ.get("JOB_BAIL_SECONDES", "120"))
+# Attente maximum (secondes) avant de réessayer un job refusé par le disjoncteur : l'attente part
+# du Retry-After du refus et double à chaque nouveau refus
+JOB_REESSAI_MAX_SECONDES = float(os.environ.get("JOB_REESSAI_MAX_SECONDES", "300"))
+
+_executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="generation")
+
+# Identifiant de ce processus dans la colonne proprietaire des jobs qu'il exécute
+PROPRIETAIRE = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Un événement par job planifié dans ce processus, déclenché (puis oublié) quand le job se termine
+_evenements: Dict[int, threading.Event] = {}
+# Refus consécutifs du disjoncteur par job, pour l'attente avant le prochain essai
+_refus: Dict[int, int] = {}
+_verrou = threading.Lock()
+
+
+_battement: Optional[threading.Thread] = None
+
+
+def _planifier(job_id: int):
+    with _verrou:
+        if job_id in _evenements:
+            return
+        _evenements[job_id] = threading.Event()
+    _demarrer_battement()
+    _lancer(job_id)
+
+
+def _lancer(job_id: int, delai: float = 0):
+    """Confie le job au pool de workers, tout de suite ou après `delai` secondes"""
+    # Les journaux du job gardent l'identifiant de la requête qui l'a soumis
+    tache = functools.partial(_executor.submit, contextvars.copy_context().run, _executer_job, job_id)
+    if not delai:
+        tache()
+        return
+    minuterie = threading.Timer(delai, tache)
+    minuterie.daemon = True
+    minuterie.start()
+
+
+def _signaler_fin(job_id: int):
+    with _verrou:
+        evenement = _evenements.pop(job_id, None)
+        _refus.pop(job_id, None)
+    if evenement:
+        evenement.set()
+
+
+def _libre(limite: datetime):
+    """Condition SQL d'un job sans propriétaire, ou dont le propriétaire n'a pas battu depuis `limite`"""
+    return or_(JobGeneration.proprietaire.is_(None), JobGeneration.date_battement.is_(None),
+               JobGeneration.date_battement < limite)
+
+
+def soumettre_job(db: Session, chapitre_id: int, prompt: str, niveau_strictesse: Optional[str]) -> JobGeneration:
+    """Enregistre un job de génération et le confie au pool de workers"""
+    # En attente au nom de ce processus, qui le planifie : les autres ne le prennent que si le bail expire
+    job = JobGeneration(
+        chapitre_id=chapitre_id,
+        prompt=prompt,
+        niveau_strictesse=niveau_strictesse or "modere",
+        statut="en_attente",
+        proprietaire=PROPRIETAIRE,
+        date_battement=datetime.utcnow()
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    _planifier(job.id)
+    return job
+
+
+def _reserver(db: Session, job_id: int) -> bool:
+    """
+    Passe le job en cours au nom de ce processus, s'il est toujours en attente et à ce
+    processus ou sans propriétaire valide.
+
+    Une seule requête UPDATE conditionnelle : de deux workers (threads ou processus)
+    qui tentent de prendre le même job, un seul modifie la ligne.
+    """
+    maintenant = datetime.utcnow()
+    limite = maintenant - timedelta(seconds=JOB_BAIL_SECONDES)
+    resultat = db.execute(
+        update(JobGeneration)
+        .where(JobGeneration.id == job_id, JobGeneration.statut == "en_attente",
+               or_(JobGeneration.proprietaire == PROPRIETAIRE, _libre(limite)))
+        .values(statut="en_cours", date_debut=maintenant, proprietaire=PROPRIETAIRE, date_battement=maintenant)
+    )
+    db.commit()
+    return resultat.rowcount == 1
+
+
+def _terminer(db: Session, job_id: int, **valeurs) -> bool:
+    """Enregistre l'issue du job dans la transaction en cours, si ce processus en est toujours propriétaire"""
+    resultat = db.execute(
+        update(JobGeneration)
+        .where(JobGeneration.id == job_id, JobGeneration.statut == "en_cours",
+               JobGeneration.proprietaire == PROPRIETAIRE)
+        .values(date_fin=datetime.utcnow(), **valeurs)
+    )
+    return resultat.rowcount == 1
+
+
+def _differer(db: Session, job_id: int, refus: HTTPException) -> float:
+    """
+    Remet en attente, toujours au nom de ce processus, un job refusé par le disjoncteur :
+    le backend est indisponible, le job n'a pas échoué. Retourne le délai avant de le réessayer.
+    """
+    with _verrou:
+        refus_consecutifs = _refus[job_id] = _refus.get(job_id, 0) + 1
+    retry_after = float((refus.headers or {}).get("Retry-After", 1))
+    delai = min(retry_after * 2 ** (refus_consecutifs - 1), JOB_REESSAI_MAX_SECONDES)
+    db.execute(
+        update(JobGeneration)
+        .where(JobGeneration.id == job_id, JobGeneration.statut == "en_cours",
+               JobGeneration.proprietaire == PROPRIETAIRE)
+        .values(statut="en_attente", date_debut=None, date_battement=datetime.utcnow())
+    )
+    db.commit()
+    logger.warning(f"Job {job_id} refusé ({refus.detail}) : nouvel essai dans {delai:.0f} s",
+                   extra={"champs": {"job_id": job_id, "refus": refus_consecutifs}})
+    return delai
+
+
+def _executer_job(job_id: int):
+    """Exécute un job dans un thread du pool, avec sa propre session"""
+    db = SessionLocal()
+    # Délai avant le prochain essai si le job est remis en attente (sinon, il est terminé)
+    delai = None
+    try:
+        if not _reserver(db, job_id):
+            return
+        job = db.get(JobGeneration, job_id)
+
+        try:
+            chapitre = db.query(Chapitre).filter(Chapitre.id == job.chapitre_id).first()
+            if not chapitre:
+                raise Exception("Chapitre non trouvé")
+            # Contenu et fin du job dans la même transaction : un arrêt entre les deux ne
+            # laisse pas un contenu enregistré pour un job qui sera repris
+            # Les jobs passent par le même contrôle d'admission, sans limite de file : ils attendent déjà dans la base
+            try:
+                place = admission.admettre(borne=False)
+            except HTTPException as refus:
+                delai = _differer(db, job_id, refus)
+                return
+            with place:
+                contenu = generer_pour_chapitre(
+                    db, chapitre, job.prompt, job.niveau_strictesse,
+                    avant_commit=lambda c: _terminer(db, job_id, statut="termine", contenu_id=c.id)
+                )
+            if contenu is None:
+                logger.warning(f"Job {job_id} repris par un autre processus : résultat abandonné",
+                               extra={"champs": {"job_id": job_id}})
+        except Exception as e:
+            logger.error(f"Job {job_id} échoué: {e}", extra={"champs": {"job_id": job_id}})
+            db.rollback()
+            _terminer(db, job_id, statut="echoue", erreur=str(e))
+            db.commit()
+    except Exception:
+        logger.exception(f"Erreur inattendue pour le job {job_id}", extra={"champs": {"job_id": job_id}})
+    finally:
+        db.close()
+        if delai is None:
+            _signaler_fin(job_id)
+        else:
+            _lancer(job_id, delai)
+
+
+def _liberer_jobs_abandonnes(db: Session) -> List[int]:
+    """Remet en attente les jobs en cours dont le propriétaire n'a pas battu depuis JOB_BAIL_SECONDES"""
+    limite = datetime.utcnow() - timedelta(seconds=JOB_BAIL_SECONDES)
+    resultat = db.execute(
+        update(JobGeneration)
+        .where(JobGeneration.statut == "en_cours",
+               or_(JobGeneration.date_battement.is_(None), JobGeneration.date_battement < limite))
+        .values(statut="en_attente", date_debut=None, proprietaire=None, date_battement=None)
+        .returning(JobGeneration.id)
+    )
+    ids = [job_id for (job_id,) in resultat]
+    db.commit()
+    if ids:
+        logger.warning(f"{len(ids)} job(s) abandonné(s) remis en attente", extra={"champs": {"job_ids": ids}})
+    return ids
+
+
+def _jobs_a_prendre(db: Session) -> List[int]:
+    """Jobs en attente sans propriétaire, ou dont le propriétaire n'a pas battu depuis JOB_BAIL_SECONDES"""
+    limite = datetime.utcnow() - timedelta(seconds=JOB_BAIL_SECONDES)
+    return [
+        job_id for (job_id,) in db.query(JobGeneration.id)
+        .filter(JobGeneration.statut == "en_attente", _libre(limite))
+        .order_by(JobGeneration.id)
+    ]
+
+
+def _battre():
+    """
+    Thread du processus : prolonge le bail des jobs qu'il a planifiés (en cours, en attente
+    ou différés), et reprend les jobs en attente d'aucun processus actif (processus arrêté
+    pendant une génération ou avant d'avoir pris un job soumis).
+    """
+    while True:
+        db = SessionLocal()
+        try:
+            with _verrou:
+                planifies = list(_evenements)
+            if planifies:
+                db.execute(
+                    update(JobGeneration)
+                    .where(JobGeneration.id.in_(planifies), JobGeneration.proprietaire == PROPRIETAIRE,
+                           JobGeneration.statut.in_(("en_attente", "en_cours")))
+                    .values(date_battement=datetime.utcnow())
+                )
+                db.commit()
+            _liberer_jobs_abandonnes(db)
+            for job_id in _jobs_a_prendre(db):
+                _planifier(job_id)
+        except Exception:
+            logger.exception("Battement des jobs impossible")
+        finally:
+            db.close()
+        time.sleep(JOB_BATTEMENT_SECONDES)
+
+
+def _demarrer_battement():
+    global _battement
+    with _verrou:
+        if _battement is not None:
+            return
+        _battement = threading.Thread(target=_battre, name="jobs-battement", daemon=True)
+    _battement.start()
+
+
+def reprendre_jobs():
+    """
+    Replanifie les jobs non terminés au démarrage.
+
+    Un job n'est repris que si son bail a expiré : il peut être exécuté ou planifié par
+    un autre processus (plusieurs workers uvicorn), qui le prolonge tant qu'il s'en
+    occupe. Les autres jobs abandonnés sont repris plus tard par le thread de battement.
+    """
+    db = SessionLocal()
+    try:
+        _liberer_jobs_abandonnes(db)
+        ids = _jobs_a_prendre(db)
+    finally:
+        db.close()
+
+    for job_id in ids:
+        _planifier(job_id)
+    _demarrer_battement()
+    if ids:
+        logger.info(f"{len(ids)} job(s) de génération replanifié(s)")
+
+
+async def attendre_job(job_id: int, delai: float):
+    """
+    Attend, sans bloquer de thread, que le job se termine ou que le délai expire.
+
+    Ne fait rien si le job n'est pas en cours dans ce processus.
+    """
+    with _verrou:
+        evenement = _evenements.get(job_id)
+    if evenement is None:
+        return
+
+    loop = asyncio.get_running_loop()
+    fin = loop.time() + delai
+    while not evenement.is_set() and loop.time() < fin:
+        await asyncio.sleep(0.25)
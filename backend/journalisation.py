@@ -0,0 +1,184 @@
+"""
+Journalisation structurée (une ligne JSON par événement), sans bloquer les requêtes.
+
+Le thread appelant ne fait que figer l'enregistrement (message, identifiant de
+corrélation) et le déposer dans une file bornée ; la mise en forme et l'écriture sont
+faites par le thread d'un QueueListener. Si la file est pleine, l'enregistrement est
+abandonné et compté, plutôt que de ralentir la requête.
+
+Champs structurés : `logger.info("message", extra={"champs": {...}})`. Les charges
+volumineuses (sortie du CLI, prompt...) passent par `extra={"charge": texte}` : elles ne
+sont gardées que pour une fraction LOG_ECHANTILLON_CHARGES des enregistrements, tronquées
+à LOG_CHARGE_MAX caractères ; sinon seule leur taille est journalisée.
+
+Réglages :
+- LOG_LEVEL : niveau global (INFO par défaut)
+- LOG_NIVEAUX : niveaux par logger, ex. "claude_service=DEBUG,sqlalchemy.engine=INFO"
+- LOG_FORMAT : json (défaut) ou texte, plus lisible en développement
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from contextvars import ContextVar
+from typing import Optional
+from uuid import uuid4
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_NIVEAUX = os.environ.get("LOG_NIVEAUX", "")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+# Nombre maximum d'enregistrements en attente d'écriture
+LOG_FILE_TAILLE = int(os.environ.get("LOG_FILE_TAILLE", "10000"))
+# Proportion des enregistrements dont la charge volumineuse est gardée (0 : jamais, 1 : toujours)
+LOG_ECHANTILLON_CHARGES = float(os.environ.get("LOG_ECHANTILLON_CHARGES", "0.01"))
+# Longueur maximale d'une charge gardée (caractères)
+LOG_CHARGE_MAX = int(os.environ.get("LOG_CHARGE_MAX", "2000"))
+
+# En-tête portant l'identifiant de corrélation, repris du client s'il le fournit
+ENTETE_CORRELATION = "X-Request-ID"
+
+# Identifiant de la requête en cours ; suit la requête dans le pool de threads, et dans les
+# threads de génération et de jobs qui copient le contexte (voir cache_generation.py, jobs.py)
+id_correlation: ContextVar[Optional[str]] = ContextVar("id_correlation", default=None)
+
+
+class FormateurJSON(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entree = {
+            "ts": f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))}.{int(record.msecs):03d}Z",
+            "niveau": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "id_correlation", None):
+            entree["id_correlation"] = record.id_correlation
+        entree.update(getattr(record, "champs", None) or {})
+        if getattr(record, "charge", None) is not None:
+            entree["charge"] = record.charge
+        if record.exc_info:
+            entree["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entree, ensure_ascii=False, default=str)
+
+
+class FormateurTexte(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(id_correlation)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "id_correlation"):
+            record.id_correlation = None
+        ligne = super().format(record)
+        champs = getattr(record, "champs", None)
+        if champs:
+            ligne += " " + " ".join(f"{cle}={valeur}" for cle, valeur in champs.items())
+        if getattr(record, "charge", None) is not None:
+            ligne += f"\n{record.charge}"
+        return ligne
+
+
+def echantillonner_charge(charge: str) -> object:
+    """Charge gardée (tronquée) pour une fraction des enregistrements, sa taille sinon"""
+    if random.random() >= LOG_ECHANTILLON_CHARGES:
+        return {"caracteres": len(charge)}
+    if len(charge) > LOG_CHARGE_MAX:
+        return charge[:LOG_CHARGE_MAX] + f"… ({len(charge)} caractères)"
+    return charge
+
+
+class GestionnaireFile(logging.handlers.QueueHandler):
+    """
+    QueueHandler qui ne met pas en forme dans le thread appelant (la mise en forme
+    est laissée au QueueListener) et n'attend jamais une place dans la file.
+    """
+
+    def __init__(self, file: queue.Queue):
+        super().__init__(file)
+        self.abandons = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Figé ici : les arguments peuvent changer, et le contexte n'est pas celui du listener
+        record.msg = record.getMessage()
+        record.args = None
+        if not hasattr(record, "id_correlation"):
+            record.id_correlation = id_correlation.get()
+        charge = getattr(record, "charge", None)
+        if isinstance(charge, str):
+            record.charge = echantillonner_charge(charge)
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.abandons += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+gestionnaire: Optional[GestionnaireFile] = None
+
+
+def configurer_journalisation():
+    """Installe la file et son listener sur le logger racine (une seule fois par processus)"""
+    global _listener, gestionnaire
+    if _listener is not None:
+        return
+
+    sortie = logging.StreamHandler(sys.stderr)
+    sortie.setFormatter(FormateurTexte() if LOG_FORMAT == "texte" else FormateurJSON())
+    file: queue.Queue = queue.Queue(maxsize=LOG_FILE_TAILLE)
+    gestionnaire = GestionnaireFile(file)
+
+    racine = logging.getLogger()
+    for ancien in list(racine.handlers):
+        racine.removeHandler(ancien)
+    racine.addHandler(gestionnaire)
+    racine.setLevel(LOG_LEVEL)
+    for reglage in filter(None, (r.strip() for r in LOG_NIVEAUX.split(","))):
+        nom, _, niveau = reglage.partition("=")
+        logging.getLogger(nom.strip()).setLevel(niveau.strip().upper())
+
+    # Les loggers d'uvicorn écrivent sur leurs propres handlers : ils passent aussi par la file
+    for nom in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        logger = logging.getLogger(nom)
+        logger.handlers = []
+        logger.propagate = True
+
+    _listener = logging.handlers.QueueListener(file, sortie, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+class MiddlewareCorrelation:
+    """
+    Middleware ASGI : attribue à chaque requête un identifiant de corrélation (repris de
+    l'en-tête X-Request-ID s'il est fourni), visible dans tous ses journaux et renvoyé
+    dans la réponse.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        entete = ENTETE_CORRELATION.lower().encode("latin-1")
+        recu = next((valeur for nom, valeur in scope["headers"] if nom == entete), None)
+        identifiant = recu.decode("latin-1")[:64] if recu else uuid4().hex[:16]
+        jeton = id_correlation.set(identifiant)
+
+        async def envoyer(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (entete, identifiant.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, envoyer)
+        finally:
+            id_correlation.reset(jeton)
@@ -1,24 +1,61 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session, joinedload
-from typing import List
+from fastapi.responses import StreamingResponse
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from typing import List, Optional, Union
 import os
-
-from database import engine, get_db, Base
-from models import Livre, Chapitre, Contenu, Style
+import sys
+import json
+import logging
+import weakref
+import threading
+from urllib.parse import quote
+
+from database import DATABASE_URL, engine, async_engine, get_db, get_async_db, SessionLocal
+from models import Livre, Chapitre, Contenu, Style, JobGeneration
 from schemas import (
     LivreCreate, LivreResponse,
-    ChapitreCreate, ChapitreResponse,
+    ChapitreCreate, ChapitreResponse, ChapitresBulkRequest, ChapitresBulkResponse,
     ContenuCreate, ContenuResponse,
     GenerationRequest, GenerationResponse,
-    StyleCreate, StyleResponse
+    StyleCreate, StyleResponse,
+    JobResponse, MemoireLivreResponse, LivreCompletResponse,
+    LivreResumeResponse, ChapitreResumeResponse, ContenuResumeResponse,
+    ResultatRechercheResponse
+)
+from pagination import preparer_page, decouper_page, ENTETE_CURSEUR
+from serialisation import (
+    ReponseRapide, COLONNES_LIVRE_AVEC_STYLE, CHAMPS_CHAPITRE, CHAMPS_CONTENU, colonnes, en_dicts, livres_en_dicts
+)
+from migrations import migrer
+from recherche import rechercher
+from export import FORMATS as FORMATS_EXPORT, exporter, lire_livre, nom_fichier
+import transfert
+from cache_reference import (
+    cache_reference, cle_style, cle_livre, CLE_STYLES, style_en_dict, livre_en_dict, styles_en_liste
 )
-from claude_service import generer_histoire
+from journalisation import configurer_journalisation, MiddlewareCorrelation, ENTETE_CORRELATION
+from metriques import registre, instrumenter_moteur, MiddlewareMetriques
+from etags import (
+    calculer_etag, non_modifie, poser_etag,
+    validateur_livres, validateur_livre, validateur_chapitres, validateur_contenus
+)
+import versions  # enregistre aussi les événements qui incrémentent la version des livres
+
+# Les modules de génération (claude_service, backends_generation, pool_claude, contexte,
+# memoire, generation, jobs...) sont importés par les routes qui s'en servent : le démarrage n'en paie pas le coût.
 
-# Création des tables
-Base.metadata.create_all(bind=engine)
+# Démarrage rapide (serverless, activé par défaut sur Vercel) : pas de pré-démarrage
+# des processus Claude ni de reprise des jobs, dont les threads ne survivraient pas
+# à la mise en veille de l'instance
+DEMARRAGE_RAPIDE = os.environ.get("DEMARRAGE_RAPIDE", "1" if os.environ.get("VERCEL") else "0") == "1"
+
+configurer_journalisation()
+logger = logging.getLogger(__name__)
 
 # Styles prédéfinis
 STYLES_PREDEFINIS = [
@@ -34,21 +71,51 @@ STYLES_PREDEFINIS = [
 
 
 def initialiser_styles(db: Session):
-    """Initialise les styles prédéfinis s'ils n'existent pas"""
-    for style_data in STYLES_PREDEFINIS:
-        existing = db.query(Style).filter(Style.nom == style_data["nom"]).first()
-        if not existing:
-            style = Style(
-                nom=style_data["nom"],
-                description=style_data["description"],
-                est_predefini=True
-            )
-            db.add(style)
+    """Insère les styles prédéfinis qui n'existent pas encore, en une seule requête"""
+    db.execute(
+        insert(Style)
+        .values([{**style_data, "est_predefini": True} for style_data in STYLES_PREDEFINIS])
+        .on_conflict_do_nothing(index_elements=[Style.nom])
+    )
     db.commit()
+    cache_reference.invalider_style()
+
+
+_base_prete = False
+_verrou_base = threading.Lock()
+
+
+def preparer_base():
+    """
+    Met le schéma à jour et insère les styles prédéfinis, une fois par processus.
+
+    Appelée au démarrage, et à défaut par la première requête (certains hébergeurs
+    serverless n'envoient pas l'événement de démarrage). Sur une base à jour, ne coûte
+    qu'une lecture de PRAGMA user_version et l'insertion ignorée des styles.
+    """
+    global _base_prete
+    with _verrou_base:
+        if _base_prete:
+            return
+        logger.info(f"Base de données : {DATABASE_URL}")
+        migrer(engine)
+        db = SessionLocal()
+        try:
+            initialiser_styles(db)
+        finally:
+            db.close()
+        _base_prete = True
+
+
+async def _exiger_base():
+    if not _base_prete:
+        # Migrations et styles bloquent (verrou, SQLite) : hors de la boucle d'événements
+        await run_in_threadpool(preparer_base)
 
 app = FastAPI(
     title="Les Histoires de Rebecca",
-    description="API pour créer et générer des histoires magiques pour Rebecca"
+    description="API pour créer et générer des histoires magiques pour Rebecca",
+    dependencies=[Depends(_exiger_base)]
 )
 
 # CORS pour permettre au frontend de communiquer
@@ -58,238 +125,748 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[ENTETE_CURSEUR, "ETag", ENTETE_CORRELATION],
 )
+app.add_middleware(MiddlewareMetriques)
+app.add_middleware(MiddlewareCorrelation)
+instrumenter_moteur(engine)
+instrumenter_moteur(async_engine.sync_engine)
 
 
 # Initialisation des styles au démarrage
 @app.on_event("startup")
 def startup_event():
-    from database import SessionLocal
-    db = SessionLocal()
-    try:
-        initialiser_styles(db)
-    finally:
-        db.close()
+    preparer_base()
+    if DEMARRAGE_RAPIDE:
+        return
+    from backends_generation import backend_generation
+    import jobs
+    # Backend cli : localiser le CLI et pré-démarrer les processus Claude ; http : ouvrir le client
+    backend_generation.demarrer()
+    # Relancer les générations restées en file lors du dernier arrêt
+    jobs.reprendre_jobs()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if "backends_generation" in sys.modules:
+        sys.modules["backends_generation"].backend_generation.arreter()
+    await async_engine.dispose()
 
 
 # ==================== STYLES ====================
+# Les routes CRUD sont asynchrones (session aiosqlite, voir database.py) : elles ne
+# prennent pas de thread du pool, que les générations peuvent occuper longtemps.
+# Styles et métadonnées des livres sont lus à travers cache_reference, que les routes
+# qui les modifient invalident.
+
+async def _style(db: AsyncSession, style_id: int) -> Optional[dict]:
+    async def charger():
+        return style_en_dict(await db.get(Style, style_id))
+    return await cache_reference.obtenir_async(cle_style(style_id), charger)
+
+
+async def _livre(db: AsyncSession, livre_id: int) -> Optional[dict]:
+    async def charger():
+        return livre_en_dict(await db.get(Livre, livre_id))
+    return await cache_reference.obtenir_async(cle_livre(livre_id), charger)
+
 
 @app.get("/styles", response_model=List[StyleResponse])
-def lister_styles(db: Session = Depends(get_db)):
+async def lister_styles(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
     """Liste tous les styles disponibles"""
-    return db.query(Style).order_by(Style.est_predefini.desc(), Style.nom).all()
+    async def charger():
+        return styles_en_liste(
+            (await db.scalars(select(Style).order_by(Style.est_predefini.desc(), Style.nom))).all()
+        )
+    styles = await cache_reference.obtenir_async(CLE_STYLES, charger)
+
+    etag = calculer_etag(request, styles)
+    reponse_304 = non_modifie(request, etag)
+    if reponse_304:
+        return reponse_304
+    poser_etag(response, etag)
+    return styles
 
 
 @app.post("/styles", response_model=StyleResponse)
-def creer_style(style: StyleCreate, db: Session = Depends(get_db)):
+async def creer_style(style: StyleCreate, db: AsyncSession = Depends(get_async_db)):
     """Crée un nouveau style personnalisé"""
-    existing = db.query(Style).filter(Style.nom == style.nom).first()
+    existing = await db.scalar(select(Style).where(Style.nom == style.nom))
     if existing:
         raise HTTPException(status_code=400, detail="Un style avec ce nom existe déjà")
 
     db_style = Style(**style.model_dump(), est_predefini=False)
     db.add(db_style)
-    db.commit()
-    db.refresh(db_style)
+    await db.commit()
+    await db.refresh(db_style)
+    await cache_reference.invalider_style_async(db_style.id)
     return db_style
 
 
 @app.delete("/styles/{style_id}")
-def supprimer_style(style_id: int, db: Session = Depends(get_db)):
+async def supprimer_style(style_id: int, db: AsyncSession = Depends(get_async_db)):
     """Supprime un style personnalisé (les prédéfinis ne peuvent pas être supprimés)"""
-    style = db.query(Style).filter(Style.id == style_id).first()
+    style = await db.get(Style, style_id)
     if not style:
         raise HTTPException(status_code=404, detail="Style non trouvé")
     if style.est_predefini:
         raise HTTPException(status_code=400, detail="Les styles prédéfinis ne peuvent pas être supprimés")
 
     # Mettre à null le style_id des livres qui utilisent ce style
-    db.query(Livre).filter(Livre.style_id == style_id).update({"style_id": None})
-    db.delete(style)
-    db.commit()
+    livres_modifies = (await db.scalars(
+        update(Livre).where(Livre.style_id == style_id).values(style_id=None).returning(Livre.id)
+    )).all()
+    await db.delete(style)
+    await db.commit()
+    await cache_reference.invalider_style_async(style_id)
+    await cache_reference.invalider_livres_async(livres_modifies)
     return {"message": "Style supprimé"}
 
 
+# ==================== LISTES ====================
+# Les listes acceptent `limite` et `apres` (pagination par curseur, le curseur suivant
+# est renvoyé dans l'en-tête X-Curseur-Suivant) et `vue=resume`, qui omet les textes.
+# Les lectures portent un ETag (voir etags.py) : un If-None-Match qui correspond
+# renvoie 304 avant tout chargement d'objet.
+
+def _reponse_liste(lignes, curseur: Optional[str], response: Response):
+    if curseur:
+        response.headers[ENTETE_CURSEUR] = curseur
+    return lignes
+
+
+def _reponse_rapide(contenu, curseur: Optional[str], response: Response) -> ReponseRapide:
+    """Réponse encodée sans passer par le response_model (voir serialisation.py), avec les en-têtes posés sur `response`"""
+    _reponse_liste(contenu, curseur, response)
+    entetes = {nom: response.headers[nom] for nom in (ENTETE_CURSEUR, "ETag", "Cache-Control") if nom in response.headers}
+    return ReponseRapide(contenu, headers=entetes)
+
+
+def _reponse_resume(lignes, curseur: Optional[str], response: Response) -> ReponseRapide:
+    return _reponse_rapide([dict(ligne._mapping) for ligne in lignes], curseur, response)
+
+
+async def _page(db: AsyncSession, requete, colonne, colonne_id, apres, limite, cle, objets: bool = True):
+    """Exécute une page de la requête (objets ORM, ou lignes de colonnes)"""
+    requete = preparer_page(requete, colonne, colonne_id, apres, limite)
+    resultat = await db.execute(requete)
+    lignes = resultat.scalars().all() if objets else resultat.all()
+    return decouper_page(lignes, limite, cle)
+
+
 # ==================== LIVRES ====================
 
-@app.get("/livres", response_model=List[LivreResponse])
-def lister_livres(db: Session = Depends(get_db)):
-    """Liste tous les livres"""
-    livres = db.query(Livre).options(joinedload(Livre.style_rel)).all()
-    # Convertir style_rel en style pour la réponse
-    for livre in livres:
-        livre.style = livre.style_rel
-    return livres
+@app.get("/livres", response_model=Union[List[LivreResponse], List[LivreResumeResponse]])
+async def lister_livres(
+    request: Request,
+    response: Response,
+    limite: Optional[int] = Query(None, ge=1, le=500),
+    apres: Optional[str] = None,
+    vue: str = Query("complete", pattern="^(complete|resume)$"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Liste les livres, par date de création"""
+    etag = calculer_etag(request, await validateur_livres(db))
+    reponse_304 = non_modifie(request, etag)
+    if reponse_304:
+        return reponse_304
+    poser_etag(response, etag)
+
+    cle = lambda livre: (livre.date_creation, livre.id)  # noqa: E731
+    if vue == "resume":
+        nombre_chapitres = select(func.count(Chapitre.id)).where(
+            Chapitre.livre_id == Livre.id
+        ).correlate(Livre).scalar_subquery()
+        requete = select(
+            Livre.id, Livre.titre, Livre.style_id, Livre.date_creation,
+            nombre_chapitres.label("nombre_chapitres")
+        )
+        lignes, curseur = await _page(db, requete, Livre.date_creation, Livre.id, apres, limite, cle, objets=False)
+        return _reponse_resume(lignes, curseur, response)
+
+    requete = select(*COLONNES_LIVRE_AVEC_STYLE).outerjoin(Style, Style.id == Livre.style_id)
+    lignes, curseur = await _page(db, requete, Livre.date_creation, Livre.id, apres, limite, cle, objets=False)
+    return _reponse_rapide(livres_en_dicts(lignes), curseur, response)
 
 
 @app.post("/livres", response_model=LivreResponse)
-def creer_livre(livre: LivreCreate, db: Session = Depends(get_db)):
+async def creer_livre(livre: LivreCreate, db: AsyncSession = Depends(get_async_db)):
     """Crée un nouveau livre"""
+    style = None
     if livre.style_id:
-        style = db.query(Style).filter(Style.id == livre.style_id).first()
+        style = await _style(db, livre.style_id)
         if not style:
             raise HTTPException(status_code=404, detail="Style non trouvé")
 
     db_livre = Livre(**livre.model_dump())
     db.add(db_livre)
-    db.commit()
-    db.refresh(db_livre)
+    await db.commit()
+    await db.refresh(db_livre)
+    await cache_reference.invalider_livres_async([db_livre.id])
     # Charger le style pour la réponse
-    if db_livre.style_id:
-        db_livre.style = db.query(Style).filter(Style.id == db_livre.style_id).first()
+    db_livre.style = style
     return db_livre
 
 
 @app.get("/livres/{livre_id}", response_model=LivreResponse)
-def obtenir_livre(livre_id: int, db: Session = Depends(get_db)):
+async def obtenir_livre(livre_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
     """Obtient un livre par son ID"""
-    livre = db.query(Livre).options(joinedload(Livre.style_rel)).filter(Livre.id == livre_id).first()
+    livre = await _livre(db, livre_id)
     if not livre:
         raise HTTPException(status_code=404, detail="Livre non trouvé")
-    livre.style = livre.style_rel
+    livre = {**livre, "style": await _style(db, livre["style_id"]) if livre["style_id"] else None}
+
+    etag = calculer_etag(request, livre)
+    reponse_304 = non_modifie(request, etag)
+    if reponse_304:
+        return reponse_304
+    poser_etag(response, etag)
     return livre
 
 
+# Champs texte d'un contenu qui peuvent être omis de /livres/{id}/complet
+CHAMPS_CONTENU_EXCLUABLES = {"texte_utilisateur", "texte_genere", "resume"}
+
+
+@app.get("/livres/{livre_id}/complet", response_model=LivreCompletResponse)
+async def obtenir_livre_complet(
+    livre_id: int,
+    request: Request,
+    exclure: Optional[str] = Query(None, description="Champs de contenu à omettre, séparés par des virgules"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Obtient un livre avec son style, ses chapitres ordonnés et leurs contenus.
+
+    Trois requêtes SQL quelle que soit la taille du livre, lues en lignes Core sans objet
+    ORM. Les champs exclus (ex. `exclure=texte_utilisateur`) ne sont ni lus en base ni envoyés.
+    """
+    exclus = {champ.strip() for champ in (exclure or "").split(",") if champ.strip()}
+    inconnus = exclus - CHAMPS_CONTENU_EXCLUABLES
+    if inconnus:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Champs non excluables: {', '.join(sorted(inconnus))} "
+                   f"(possibles: {', '.join(sorted(CHAMPS_CONTENU_EXCLUABLES))})"
+        )
+
+    validateur = await validateur_livre(db, livre_id)
+    if validateur is None:
+        raise HTTPException(status_code=404, detail="Livre non trouvé")
+    etag = calculer_etag(request, validateur)
+    reponse_304 = non_modifie(request, etag)
+    if reponse_304:
+        return reponse_304
+
+    livres = livres_en_dicts((await db.execute(
+        select(*COLONNES_LIVRE_AVEC_STYLE).outerjoin(Style, Style.id == Livre.style_id).where(Livre.id == livre_id)
+    )).all())
+    if not livres:
+        raise HTTPException(status_code=404, detail="Livre non trouvé")
+
+    chapitres = en_dicts((await db.execute(
+        select(*colonnes(Chapitre, CHAMPS_CHAPITRE)).where(Chapitre.livre_id == livre_id)
+        .order_by(Chapitre.ordre, Chapitre.id)
+    )).all(), CHAMPS_CHAPITRE)
+    contenus_par_chapitre = {chapitre["id"]: [] for chapitre in chapitres}
+    for chapitre in chapitres:
+        chapitre["contenus"] = contenus_par_chapitre[chapitre["id"]]
+
+    champs_contenu = [champ for champ in CHAMPS_CONTENU if champ not in exclus]
+    position_chapitre = champs_contenu.index("chapitre_id")
+    lignes = await db.execute(
+        select(*colonnes(Contenu, champs_contenu))
+        .where(Contenu.chapitre_id.in_(select(Chapitre.id).where(Chapitre.livre_id == livre_id)))
+        .order_by(Contenu.id)
+    )
+    for ligne in lignes:
+        contenus_par_chapitre[ligne[position_chapitre]].append(dict(zip(champs_contenu, ligne)))
+
+    return poser_etag(ReponseRapide({**livres[0], "chapitres": chapitres}), etag)
+
+
 @app.delete("/livres/{livre_id}")
-def supprimer_livre(livre_id: int, db: Session = Depends(get_db)):
-    """Supprime un livre et tous ses chapitres"""
+async def supprimer_livre(livre_id: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    Supprime un livre et tous ses chapitres.
+
+    Une seule requête DELETE : chapitres, contenus, résumés et jobs suivent par les
+    ON DELETE CASCADE de la base, sans être chargés (mémoire constante quelle que soit
+    la taille du livre).
+    """
+    resultat = await db.execute(
+        delete(Livre).where(Livre.id == livre_id).execution_options(synchronize_session=False)
+    )
+    if not resultat.rowcount:
+        raise HTTPException(status_code=404, detail="Livre non trouvé")
+    # Les suppressions en cascade de la base ne passent pas par les événements de versions.py
+    await (await db.connection()).run_sync(versions.incrementer_version, livre_id)
+    await db.commit()
+    await cache_reference.invalider_livres_async([livre_id])
+    _oublier_index_passages(livre_id)
+    return {"message": "Livre supprimé"}
+
+
+def _oublier_index_passages(livre_id: int):
+    """Écarte l'index de passages du livre, s'il a été chargé (voir index_passages.py)"""
+    if "index_passages" in sys.modules:
+        sys.modules["index_passages"].index_passages.oublier(livre_id)
+
+
+@app.get("/livres/{livre_id}/memoire", response_model=MemoireLivreResponse)
+def obtenir_memoire(livre_id: int, db: Session = Depends(get_db)):
+    """Résumé chapitre par chapitre du livre, tel qu'utilisé comme contexte de génération"""
+    from memoire import actualiser_memoire
     livre = db.query(Livre).filter(Livre.id == livre_id).first()
     if not livre:
         raise HTTPException(status_code=404, detail="Livre non trouvé")
-    db.delete(livre)
-    db.commit()
-    return {"message": "Livre supprimé"}
+
+    chapitres = db.query(Chapitre).filter(Chapitre.livre_id == livre_id).order_by(Chapitre.ordre).all()
+    # Lu avant actualiser_memoire, dont le commit expire les objets chargés
+    entrees = [{"chapitre_id": chap.id, "titre": chap.titre, "ordre": chap.ordre} for chap in chapitres]
+    resumes = actualiser_memoire(db, chapitres)
+    return MemoireLivreResponse(
+        livre_id=livre_id,
+        chapitres=[{**entree, "resume": resumes[entree["chapitre_id"]]} for entree in entrees]
+    )
+
+
+@app.get("/livres/{livre_id}/export")
+async def exporter_livre(
+    livre_id: int,
+    format: str = Query("md", pattern="^(md|epub|txt)$"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Exporte le livre entier (Markdown, EPUB ou texte), envoyé au fur et à mesure de la
+    lecture des chapitres : la mémoire utilisée ne dépend pas de la taille du livre.
+    """
+    livre = await _livre(db, livre_id)
+    if not livre:
+        raise HTTPException(status_code=404, detail="Livre non trouvé")
+
+    media_type, extension = FORMATS_EXPORT[format]
+    nom = nom_fichier(livre["titre"], extension)
+    nom_utf8 = quote(f"{livre['titre']}.{extension}")
+    return StreamingResponse(
+        exporter(format, livre, lire_livre(async_engine, livre_id)),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=\"{nom}\"; filename*=UTF-8''{nom_utf8}"}
+    )
 
 
 # ==================== CHAPITRES ====================
 
-@app.get("/livres/{livre_id}/chapitres", response_model=List[ChapitreResponse])
-def lister_chapitres(livre_id: int, db: Session = Depends(get_db)):
-    """Liste tous les chapitres d'un livre"""
-    return db.query(Chapitre).filter(Chapitre.livre_id == livre_id).order_by(Chapitre.ordre).all()
+@app.get("/livres/{livre_id}/chapitres", response_model=Union[List[ChapitreResponse], List[ChapitreResumeResponse]])
+async def lister_chapitres(
+    livre_id: int,
+    request: Request,
+    response: Response,
+    limite: Optional[int] = Query(None, ge=1, le=500),
+    apres: Optional[str] = None,
+    vue: str = Query("complete", pattern="^(complete|resume)$"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Liste les chapitres d'un livre, dans l'ordre"""
+    etag = calculer_etag(request, await validateur_chapitres(db, livre_id))
+    reponse_304 = non_modifie(request, etag)
+    if reponse_304:
+        return reponse_304
+    poser_etag(response, etag)
+
+    cle = lambda chapitre: (chapitre.ordre, chapitre.id)  # noqa: E731
+    if vue == "resume":
+        contenus_du_chapitre = Contenu.chapitre_id == Chapitre.id
+        requete = select(
+            Chapitre.id, Chapitre.livre_id, Chapitre.titre, Chapitre.ordre, Chapitre.date_creation,
+            select(func.count(Contenu.id)).where(contenus_du_chapitre)
+            .correlate(Chapitre).scalar_subquery().label("nombre_contenus"),
+            select(func.coalesce(func.sum(func.length(Contenu.texte_genere)), 0)).where(contenus_du_chapitre)
+            .correlate(Chapitre).scalar_subquery().label("longueur_texte")
+        ).where(Chapitre.livre_id == livre_id)
+        lignes, curseur = await _page(db, requete, Chapitre.ordre, Chapitre.id, apres, limite, cle, objets=False)
+        return _reponse_resume(lignes, curseur, response)
+
+    requete = select(*colonnes(Chapitre, CHAMPS_CHAPITRE)).where(Chapitre.livre_id == livre_id)
+    lignes, curseur = await _page(db, requete, Chapitre.ordre, Chapitre.id, apres, limite, cle, objets=False)
+    return _reponse_rapide(en_dicts(lignes, CHAMPS_CHAPITRE), curseur, response)
 
 
 @app.post("/livres/{livre_id}/chapitres", response_model=ChapitreResponse)
-def creer_chapitre(livre_id: int, chapitre: ChapitreCreate, db: Session = Depends(get_db)):
+async def creer_chapitre(livre_id: int, chapitre: ChapitreCreate, db: AsyncSession = Depends(get_async_db)):
     """Crée un nouveau chapitre dans un livre"""
-    livre = db.query(Livre).filter(Livre.id == livre_id).first()
+    livre = await db.get(Livre, livre_id)
     if not livre:
         raise HTTPException(status_code=404, detail="Livre non trouvé")
 
-    db_chapitre = Chapitre(livre_id=livre_id, **chapitre.model_dump())
+    donnees = chapitre.model_dump()
+    if donnees["ordre"] is None:
+        donnees["ordre"] = 1
+    db_chapitre = Chapitre(livre_id=livre_id, **donnees)
     db.add(db_chapitre)
-    db.commit()
-    db.refresh(db_chapitre)
+    await db.commit()
+    await db.refresh(db_chapitre)
     return db_chapitre
 
 
+@app.patch("/livres/{livre_id}/chapitres:bulk", response_model=ChapitresBulkResponse)
+async def modifier_chapitres_en_masse(
+    livre_id: int, operations: ChapitresBulkRequest, db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Applique en une transaction, dans cet ordre : la suppression de chapitres (avec leurs
+    contenus), le déplacement de contenus entre chapitres du livre, puis le
+    réordonnancement de tous les chapitres restants.
+
+    Chaque opération est une seule requête UPDATE ou DELETE, quel que soit le nombre
+    de lignes concernées. Rien n'est appliqué si une opération est invalide.
+    """
+    if not await _livre(db, livre_id):
+        raise HTTPException(status_code=404, detail="Livre non trouvé")
+
+    chapitres = set((await db.scalars(select(Chapitre.id).where(Chapitre.livre_id == livre_id))).all())
+    supprimes = set(operations.supprimer or [])
+    if supprimes - chapitres:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Chapitres absents du livre: {', '.join(map(str, sorted(supprimes - chapitres)))}"
+        )
+    restants = chapitres - supprimes
+    deplacements = operations.deplacer or []
+    for deplacement in deplacements:
+        if deplacement.chapitre_id not in restants:
+            raise HTTPException(
+                status_code=400, detail=f"Chapitre de destination absent du livre: {deplacement.chapitre_id}"
+            )
+    ordre = operations.ordre
+    if ordre is not None and (len(ordre) != len(restants) or set(ordre) != restants):
+        raise HTTPException(status_code=400, detail="ordre doit lister une fois chacun des chapitres restants du livre")
+
+    chapitres_supprimes = contenus_deplaces = 0
+    if supprimes:
+        # Contenus, résumés et jobs des chapitres suivent par ON DELETE CASCADE
+        resultat = await db.execute(
+            delete(Chapitre).where(Chapitre.livre_id == livre_id, Chapitre.id.in_(supprimes))
+            .execution_options(synchronize_session=False)
+        )
+        chapitres_supprimes = resultat.rowcount
+
+    chapitres_du_livre = select(Chapitre.id).where(Chapitre.livre_id == livre_id)
+    for deplacement in deplacements:
+        contenu_ids = set(deplacement.contenu_ids)
+        resultat = await db.execute(
+            update(Contenu).where(Contenu.id.in_(contenu_ids), Contenu.chapitre_id.in_(chapitres_du_livre))
+            .values(chapitre_id=deplacement.chapitre_id)
+            .execution_options(synchronize_session=False)
+        )
+        if resultat.rowcount != len(contenu_ids):
+            await db.rollback()
+            raise HTTPException(status_code=400, detail="Contenus absents des chapitres restants du livre")
+        contenus_deplaces += resultat.rowcount
+
+    if ordre:
+        await db.execute(
+            update(Chapitre).where(Chapitre.livre_id == livre_id)
+            .values(ordre=case({chapitre_id: rang for rang, chapitre_id in enumerate(ordre, 1)}, value=Chapitre.id))
+            .execution_options(synchronize_session=False)
+        )
+
+    if chapitres_supprimes or contenus_deplaces or ordre:
+        # Les requêtes en masse ne passent pas par les événements de versions.py
+        await (await db.connection()).run_sync(versions.incrementer_version, livre_id)
+    await db.commit()
+    if contenus_deplaces:
+        # L'index de passages retient le chapitre de chaque contenu
+        _oublier_index_passages(livre_id)
+    return ChapitresBulkResponse(
+        livre_id=livre_id, chapitres_supprimes=chapitres_supprimes,
+        contenus_deplaces=contenus_deplaces, chapitres_reordonnes=len(ordre or [])
+    )
+
+
 @app.delete("/chapitres/{chapitre_id}")
-def supprimer_chapitre(chapitre_id: int, db: Session = Depends(get_db)):
+async def supprimer_chapitre(chapitre_id: int, db: AsyncSession = Depends(get_async_db)):
     """Supprime un chapitre"""
-    chapitre = db.query(Chapitre).filter(Chapitre.id == chapitre_id).first()
+    chapitre = await db.get(Chapitre, chapitre_id)
     if not chapitre:
         raise HTTPException(status_code=404, detail="Chapitre non trouvé")
-    db.delete(chapitre)
-    db.commit()
+    await db.delete(chapitre)
+    await db.commit()
     return {"message": "Chapitre supprimé"}
 
 
 # ==================== CONTENUS ====================
 
-@app.get("/chapitres/{chapitre_id}/contenus", response_model=List[ContenuResponse])
-def lister_contenus(chapitre_id: int, db: Session = Depends(get_db)):
-    """Liste tous les contenus d'un chapitre"""
-    return db.query(Contenu).filter(Contenu.chapitre_id == chapitre_id).all()
+@app.get("/chapitres/{chapitre_id}/contenus", response_model=Union[List[ContenuResponse], List[ContenuResumeResponse]])
+async def lister_contenus(
+    chapitre_id: int,
+    request: Request,
+    response: Response,
+    limite: Optional[int] = Query(None, ge=1, le=500),
+    apres: Optional[str] = None,
+    vue: str = Query("complete", pattern="^(complete|resume)$"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Liste les contenus d'un chapitre, par date de création"""
+    etag = calculer_etag(request, await validateur_contenus(db, chapitre_id))
+    reponse_304 = non_modifie(request, etag)
+    if reponse_304:
+        return reponse_304
+    poser_etag(response, etag)
+
+    cle = lambda contenu: (contenu.date_creation, contenu.id)  # noqa: E731
+    if vue == "resume":
+        requete = select(
+            Contenu.id, Contenu.chapitre_id, Contenu.resume, Contenu.niveau_strictesse, Contenu.date_creation,
+            func.coalesce(func.length(Contenu.texte_genere), 0).label("longueur_texte")
+        ).where(Contenu.chapitre_id == chapitre_id)
+        lignes, curseur = await _page(db, requete, Contenu.date_creation, Contenu.id, apres, limite, cle, objets=False)
+        return _reponse_resume(lignes, curseur, response)
+
+    requete = select(*colonnes(Contenu, CHAMPS_CONTENU)).where(Contenu.chapitre_id == chapitre_id)
+    lignes, curseur = await _page(db, requete, Contenu.date_creation, Contenu.id, apres, limite, cle, objets=False)
+    return _reponse_rapide(en_dicts(lignes, CHAMPS_CONTENU), curseur, response)
 
 
 @app.post("/chapitres/{chapitre_id}/contenus", response_model=ContenuResponse)
-def creer_contenu(chapitre_id: int, contenu: ContenuCreate, db: Session = Depends(get_db)):
+async def creer_contenu(chapitre_id: int, contenu: ContenuCreate, db: AsyncSession = Depends(get_async_db)):
     """Crée un nouveau contenu dans un chapitre"""
-    chapitre = db.query(Chapitre).filter(Chapitre.id == chapitre_id).first()
+    chapitre = await db.get(Chapitre, chapitre_id)
     if not chapitre:
         raise HTTPException(status_code=404, detail="Chapitre non trouvé")
 
     db_contenu = Contenu(chapitre_id=chapitre_id, **contenu.model_dump())
     db.add(db_contenu)
-    db.commit()
-    db.refresh(db_contenu)
+    await db.commit()
+    await db.refresh(db_contenu)
     return db_contenu
 
 
 @app.delete("/contenus/{contenu_id}")
-def supprimer_contenu(contenu_id: int, db: Session = Depends(get_db)):
+async def supprimer_contenu(contenu_id: int, db: AsyncSession = Depends(get_async_db)):
     """Supprime un contenu"""
-    contenu = db.query(Contenu).filter(Contenu.id == contenu_id).first()
+    contenu = await db.get(Contenu, contenu_id)
     if not contenu:
         raise HTTPException(status_code=404, detail="Contenu non trouvé")
-    db.delete(contenu)
-    db.commit()
+    await db.delete(contenu)
+    await db.commit()
     return {"message": "Contenu supprimé"}
 
 
+# ==================== IMPORT / EXPORT ====================
+
+@app.get("/bibliotheque/export")
+async def exporter_bibliotheque(livre_id: Optional[List[int]] = Query(None)):
+    """
+    Exporte les styles et les livres (tous, ou ceux donnés par `livre_id`, répétable)
+    avec leurs chapitres et contenus, en NDJSON, au fil de la lecture (voir transfert.py).
+    """
+    regroupeur = transfert.Regroupeur()
+
+    async def corps():
+        async for morceau in transfert.exporter_async(async_engine, livre_id, regroupeur):
+            yield morceau
+        logger.info("Export NDJSON", extra={"champs": regroupeur.bilan()})
+
+    return StreamingResponse(
+        corps(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="bibliotheque.ndjson"'}
+    )
+
+
+@app.post("/bibliotheque/import")
+async def importer_bibliotheque(request: Request):
+    """
+    Ajoute à la base les enregistrements d'un export NDJSON (corps de la requête, lu au
+    fil de l'eau), par lots d'une transaction chacun, avec de nouveaux ids. Retourne le
+    nombre d'enregistrements importés par type et le débit.
+    """
+    importeur = transfert.Importeur()
+    try:
+        await importeur.importer_async(async_engine, transfert.lignes_flux(request.stream()))
+    except transfert.ErreurImport as e:
+        raise HTTPException(
+            status_code=400, detail=f"{e} ({importeur.ecrites} enregistrements importés avant l'erreur)"
+        )
+    finally:
+        if importeur.comptes["style"]:
+            await cache_reference.invalider_style_async()
+    bilan = importeur.bilan()
+    logger.info("Import NDJSON", extra={"champs": bilan})
+    return bilan
+
+
+# ==================== RECHERCHE ====================
+
+@app.get("/recherche", response_model=List[ResultatRechercheResponse])
+async def rechercher_texte(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limite: int = Query(20, ge=1, le=100),
+    apres: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Recherche dans les titres des livres et chapitres et dans les textes et résumés générés.
+
+    Résultats classés par pertinence, avec un extrait surligné ; le curseur de la page
+    suivante est renvoyé dans l'en-tête X-Curseur-Suivant.
+    """
+    resultats, curseur = await rechercher(db, q, apres, limite)
+    return _reponse_liste(resultats, curseur, response)
+
+
 # ==================== GÉNÉRATION ====================
 
 @app.post("/chapitres/{chapitre_id}/generer", response_model=ContenuResponse)
-def generer_contenu(chapitre_id: int, request: GenerationRequest, db: Session = Depends(get_db)):
+def generer_contenu(chapitre_id: int, request: GenerationRequest, requete: Request, db: Session = Depends(get_db)):
     """Génère une histoire avec Claude et la sauvegarde dans le chapitre"""
+    from generation import generer_pour_chapitre
+    from admission import admission, identifier_client
     chapitre = db.query(Chapitre).filter(Chapitre.id == chapitre_id).first()
     if not chapitre:
         raise HTTPException(status_code=404, detail="Chapitre non trouvé")
 
-    # Récupérer le style du livre associé
-    livre = db.query(Livre).options(joinedload(Livre.style_rel)).filter(Livre.id == chapitre.livre_id).first()
-    style_description = None
-    if livre and livre.style_rel:
-        style_description = livre.style_rel.description
-
-    # Récupérer les chapitres précédents pour le contexte
-    chapitres_precedents = db.query(Chapitre).filter(
-        Chapitre.livre_id == chapitre.livre_id,
-        Chapitre.ordre < chapitre.ordre
-    ).order_by(Chapitre.ordre).all()
-
-    # Construire le contexte des chapitres précédents
-    contexte_precedent = []
-    for chap in chapitres_precedents:
-        contenus = db.query(Contenu).filter(Contenu.chapitre_id == chap.id).all()
-        textes = [c.texte_genere for c in contenus if c.texte_genere]
-        if textes:
-            contexte_precedent.append({
-                "titre": chap.titre,
-                "contenu": "\n\n".join(textes)
-            })
+    with admission.admettre(identifier_client(requete)):
+        try:
+            return generer_pour_chapitre(
+                db, chapitre, request.prompt, request.niveau_strictesse, bool(request.nouvelle_variante)
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+
+def _evenement_sse(evenement: str, donnees: dict) -> str:
+    return f"event: {evenement}\ndata: {json.dumps(donnees, ensure_ascii=False)}\n\n"
 
+
+@app.post("/chapitres/{chapitre_id}/generer-stream")
+def generer_contenu_stream(chapitre_id: int, request: GenerationRequest, requete: Request, db: Session = Depends(get_db)):
+    """
+    Génère une histoire en la transmettant au fil de l'eau (Server-Sent Events).
+
+    Événements émis : `texte` et `resume` ({"texte": morceau}) pendant la génération,
+    puis `fin` (le contenu enregistré) ou `erreur` ({"detail": message}).
+    """
+    from generation import generer_flux_pour_chapitre, description_style
+    from contexte import construire_contexte
+    from admission import admission, identifier_client
+    chapitre = db.query(Chapitre).filter(Chapitre.id == chapitre_id).first()
+    if not chapitre:
+        raise HTTPException(status_code=404, detail="Chapitre non trouvé")
+
+    # Admise avant la réponse, pour pouvoir encore répondre 429 ; gardée jusqu'à la fin du flux
+    place = admission.admettre(identifier_client(requete))
     try:
-        resultat = generer_histoire(
+        flux = generer_flux_pour_chapitre(
+            chapitre_id,
             request.prompt,
-            style_description,
-            contexte_precedent,
-            request.niveau_strictesse or "modere"
+            request.niveau_strictesse or "modere",
+            description_style(db, chapitre.livre_id),
+            construire_contexte(db, chapitre, request.prompt),
+            bool(request.nouvelle_variante)
         )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-    db_contenu = Contenu(
-        chapitre_id=chapitre_id,
-        texte_utilisateur=request.prompt,
-        texte_genere=resultat["texte"],
-        resume=resultat["resume"],
-        niveau_strictesse=request.niveau_strictesse or "modere"
+    except BaseException:
+        place.liberer()
+        raise
+
+    def evenements():
+        try:
+            for evenement, donnees in flux:
+                if evenement == "fin":
+                    yield _evenement_sse("fin", ContenuResponse.model_validate(donnees).model_dump(mode="json"))
+                elif evenement == "erreur":
+                    yield _evenement_sse("erreur", {"detail": donnees})
+                else:
+                    yield _evenement_sse(evenement, {"texte": donnees})
+        finally:
+            place.liberer()
+
+    corps = evenements()
+    # Client parti avant le premier morceau : le générateur jamais démarré n'exécute pas son finally
+    weakref.finalize(corps, place.liberer)
+    return StreamingResponse(
+        corps,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
-    db.add(db_contenu)
-    db.commit()
-    db.refresh(db_contenu)
-    return db_contenu
+
+
+@app.post("/chapitres/{chapitre_id}/jobs", response_model=JobResponse, status_code=202)
+def soumettre_generation(chapitre_id: int, request: GenerationRequest, db: Session = Depends(get_db)):
+    """Met en file une génération et retourne immédiatement le job à suivre"""
+    import jobs
+    chapitre = db.query(Chapitre).filter(Chapitre.id == chapitre_id).first()
+    if not chapitre:
+        raise HTTPException(status_code=404, detail="Chapitre non trouvé")
+    return jobs.soumettre_job(db, chapitre_id, request.prompt, request.niveau_strictesse)
+
+
+def _lire_job(job_id: int):
+    db = SessionLocal()
+    try:
+        return db.query(JobGeneration).filter(JobGeneration.id == job_id).first()
+    finally:
+        db.close()
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def obtenir_job(job_id: int, attendre: float = Query(0, ge=0, le=60)):
+    """
+    Retourne l'état d'un job de génération.
+
+    Avec `attendre`, la requête patiente jusqu'à ce nombre de secondes que le job se termine.
+    """
+    if attendre:
+        import jobs
+        await jobs.attendre_job(job_id, attendre)
+    job = await run_in_threadpool(_lire_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job non trouvé")
+    return job
+
+
+@app.get("/generation/statut")
+def statut_generation():
+    """État du backend de génération (CLI et pool de processus pré-démarrés, ou client http) et des caches"""
+    from backends_generation import backend_generation
+    from admission import admission
+    from contexte import constructeur_contexte
+    from cache_generation import cache_generation
+    return {
+        **backend_generation.statut(),
+        "admission": admission.statut(),
+        "contexte": constructeur_contexte.statistiques(),
+        "cache_generation": cache_generation.statistiques(),
+        "cache_reference": cache_reference.statistiques()
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+def metriques():
+    """Métriques de ce worker au format texte de Prometheus (voir metriques.py)"""
+    return Response(registre.exposer(), media_type="text/plain; version=0.0.4")
 
 
 @app.post("/generer-preview", response_model=GenerationResponse)
-def generer_preview(request: GenerationRequest):
+def generer_preview(request: GenerationRequest, requete: Request):
     """Génère une histoire sans la sauvegarder (prévisualisation)"""
-    try:
-        texte_genere = generer_histoire(request.prompt)
-        return GenerationResponse(texte_genere=texte_genere)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    from claude_service import generer_histoire
+    from admission import admission, identifier_client
+    with admission.admettre(identifier_client(requete)):
+        try:
+            resultat = generer_histoire(
+                request.prompt,
+                niveau_strictesse=request.niveau_strictesse or "modere",
+                nouvelle_variante=bool(request.nouvelle_variante),
+                # Rien n'est enregistré : une prévisualisation identique récente peut être resservie
+                reutiliser_resultat=True
+            )
+            return GenerationResponse(texte_genere=resultat["texte"], resume=resultat["resume"])
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 # ==================== ROOT ====================
@@ -297,22 +874,19 @@ def generer_preview(request: GenerationRequest):
 # Chemin vers les fichiers statiques du frontend
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
 
-# Servir les fichiers statiques du frontend si le dossier existe
+# Servir les fichiers statiques du frontend si le dossier existe (voir fichiers_statiques.py)
 if os.path.exists(STATIC_DIR):
-    # Monter les assets statiques
-    app.mount("/assets", StaticFiles(directory=os.path.join(STATIC_DIR, "assets")), name="assets")
+    from fichiers_statiques import FichiersStatiques
+    frontend = FichiersStatiques(STATIC_DIR)
 
     @app.get("/")
-    def serve_frontend():
-        return FileResponse(os.path.join(STATIC_DIR, "index.html"))
+    async def serve_frontend(request: Request):
+        return frontend.servir("", request)
 
     @app.get("/{path:path}")
-    def serve_frontend_routes(path: str):
-        # Pour le SPA routing - renvoyer index.html pour les routes non-API
-        file_path = os.path.join(STATIC_DIR, path)
-        if os.path.exists(file_path) and os.path.isfile(file_path):
-            return FileResponse(file_path)
-        return FileResponse(os.path.join(STATIC_DIR, "index.html"))
+    async def serve_frontend_routes(path: str, request: Request):
+        # Fichier du build, sinon index.html pour le routage du SPA
+        return frontend.servir(path, request)
 else:
     @app.get("/")
     def root():
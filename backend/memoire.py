@@ -0,0 +1,124 @@
+import os
+import re
+from typing import List, Dict, Tuple
+
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models import Chapitre, Contenu, ResumeChapitre
+
+# Longueur maximale du résumé conservé pour un chapitre (caractères)
+RESUME_CHAPITRE_MAX = int(os.environ.get("RESUME_CHAPITRE_MAX", "800"))
+
+_FIN_DE_PHRASE = re.compile(r"(?<=[.!?…])\s+")
+
+
+def _tronquer(texte: str, longueur: int) -> str:
+    if len(texte) <= longueur:
+        return texte
+    coupe = texte[:longueur].rsplit(" ", 1)[0]
+    return coupe.rstrip(" ,;:") + "…"
+
+
+def compresser_texte(texte: str, longueur: int = RESUME_CHAPITRE_MAX) -> str:
+    """
+    Condense un texte sans appel à Claude : premières et dernière phrases.
+
+    Sert pour les chapitres dont les contenus n'ont pas de résumé "Idée".
+    """
+    phrases = [p for p in _FIN_DE_PHRASE.split(" ".join(texte.split())) if p]
+    if len(phrases) > 3:
+        phrases = phrases[:2] + ["[…]", phrases[-1]]
+    return _tronquer(" ".join(phrases), longueur)
+
+
+def resumer_contenus(contenus: List[Contenu]) -> str:
+    """Résumé d'un chapitre à partir du champ `resume` de ses contenus, ou de leur texte à défaut"""
+    morceaux = []
+    for contenu in contenus:
+        if contenu.resume:
+            morceaux.append(contenu.resume.strip())
+        elif contenu.texte_genere:
+            morceaux.append(compresser_texte(contenu.texte_genere))
+    return _tronquer("\n".join(morceaux), RESUME_CHAPITRE_MAX)
+
+
+def _empreintes(db: Session, chapitre_ids: List[int]) -> Dict[int, str]:
+    """Empreinte de l'ensemble des contenus de chaque chapitre (un contenu ne change pas après insertion)"""
+    lignes = db.query(
+        Contenu.chapitre_id,
+        func.count(Contenu.id),
+        func.sum(Contenu.id),
+        func.max(Contenu.date_creation)
+    ).filter(Contenu.chapitre_id.in_(chapitre_ids)).group_by(Contenu.chapitre_id).all()
+    return {
+        chapitre_id: f"{nombre}:{somme}:{date_max.isoformat() if date_max else ''}"
+        for chapitre_id, nombre, somme, date_max in lignes
+    }
+
+
+def actualiser_memoire(db: Session, chapitres: List[Chapitre]) -> Dict[int, str]:
+    """
+    Retourne le résumé de chaque chapitre, en ne recalculant que ceux dont les contenus ont changé.
+
+    Les résumés sont stockés dans `resumes_chapitres` : un chapitre inchangé ne coûte
+    qu'une ligne de la requête d'empreintes.
+    """
+    if not chapitres:
+        return {}
+
+    ids = [chap.id for chap in chapitres]
+    empreintes = _empreintes(db, ids)
+    existants = {
+        r.chapitre_id: r
+        for r in db.query(ResumeChapitre).filter(ResumeChapitre.chapitre_id.in_(ids)).all()
+    }
+
+    resumes = {}
+    a_ecrire = []
+    for chap in chapitres:
+        empreinte = empreintes.get(chap.id, "vide")
+        existant = existants.get(chap.id)
+        if existant and existant.empreinte == empreinte:
+            resumes[chap.id] = existant.resume
+            continue
+
+        contenus = db.query(Contenu).filter(Contenu.chapitre_id == chap.id).order_by(Contenu.id).all()
+        resume = resumer_contenus(contenus)
+        a_ecrire.append({"chapitre_id": chap.id, "livre_id": chap.livre_id, "empreinte": empreinte,
+                         "resume": resume, "date_maj": datetime.utcnow()})
+        resumes[chap.id] = resume
+
+    if a_ecrire:
+        # Upsert : deux générations simultanées sur le même livre peuvent résumer le même chapitre
+        requete = insert(ResumeChapitre)
+        db.execute(requete.on_conflict_do_update(index_elements=[ResumeChapitre.chapitre_id], set_={
+            "empreinte": requete.excluded.empreinte,
+            "resume": requete.excluded.resume,
+            "date_maj": requete.excluded.date_maj,
+        }), a_ecrire)
+        db.commit()
+    return resumes
+
+
+def assembler_resume(chapitres: List[Tuple[int, str]], resumes: Dict[int, str], budget: int) -> str:
+    """
+    Assemble "l'histoire jusqu'ici" à partir des résumés de chapitres (id, titre), dans la limite du budget.
+
+    Quand le budget est dépassé, chaque résumé est raccourci de la même proportion,
+    pour que le début de l'histoire reste représenté autant que la fin.
+    """
+    entrees = [(titre, resumes.get(chapitre_id, "")) for chapitre_id, titre in chapitres]
+    entrees = [(titre, resume) for titre, resume in entrees if resume]
+    if not entrees or budget <= 0:
+        return ""
+
+    total = sum(len(titre) + len(resume) + 6 for titre, resume in entrees)
+    if total > budget:
+        ratio = budget / total
+        entrees = [(titre, _tronquer(resume, max(int(len(resume) * ratio), 60))) for titre, resume in entrees]
+
+    return "\n".join(f"- {titre} : {resume}" for titre, resume in entrees)[:budget]
@@ -0,0 +1,271 @@
+"""
+Métriques au format texte de Prometheus, exposées par GET /metrics.
+
+Compteurs, jauges et histogrammes sont tenus dans le processus (un registre par
+worker, comme le client Prometheus sans mode multiprocessus) :
+- http_* : durée de chaque requête par route, et requêtes SQL qu'elle a émises
+- sql_* : toutes les requêtes SQL, y compris hors requête HTTP (jobs de génération)
+- generation_* : découpage d'une génération (lancement du processus, premier octet,
+  fin), taille du prompt et du contexte, générations en cours
+- admission_*, disjoncteur_* : contrôle d'admission des générations (voir admission.py)
+"""
+import time
+import threading
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Bornes des histogrammes de durée (secondes) : des requêtes de quelques ms aux générations de plusieurs dizaines de s
+BORNES_DUREE = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _echapper(valeur: str) -> str:
+    return valeur.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _nombre(valeur: float) -> str:
+    if valeur == float("inf"):
+        return "+Inf"
+    return repr(float(valeur)) if valeur != int(valeur) else str(int(valeur))
+
+
+class Metrique:
+    type = ""
+
+    def __init__(self, nom: str, aide: str, etiquettes: Sequence[str] = ()):
+        self.nom = nom
+        self.aide = aide
+        self.etiquettes = tuple(etiquettes)
+        self._verrou = threading.Lock()
+        self._valeurs: Dict[Tuple[str, ...], object] = {}
+
+    def _cle(self, etiquettes: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(etiquettes[nom]) for nom in self.etiquettes)
+
+    def _format_etiquettes(self, cle: Tuple[str, ...], supplement: str = "") -> str:
+        paires = [f'{nom}="{_echapper(valeur)}"' for nom, valeur in zip(self.etiquettes, cle)]
+        if supplement:
+            paires.append(supplement)
+        return "{" + ",".join(paires) + "}" if paires else ""
+
+    def _lignes(self) -> List[str]:
+        raise NotImplementedError
+
+    def exposer(self) -> List[str]:
+        return [f"# HELP {self.nom} {self.aide}", f"# TYPE {self.nom} {self.type}", *self._lignes()]
+
+
+class Compteur(Metrique):
+    type = "counter"
+
+    def inc(self, valeur: float = 1, **etiquettes: str):
+        cle = self._cle(etiquettes)
+        with self._verrou:
+            self._valeurs[cle] = self._valeurs.get(cle, 0) + valeur
+
+    def _lignes(self) -> List[str]:
+        with self._verrou:
+            valeurs = sorted(self._valeurs.items())
+        return [f"{self.nom}{self._format_etiquettes(cle)} {_nombre(valeur)}" for cle, valeur in valeurs]
+
+
+class Jauge(Compteur):
+    type = "gauge"
+
+    def dec(self, valeur: float = 1, **etiquettes: str):
+        self.inc(-valeur, **etiquettes)
+
+    def definir(self, valeur: float, **etiquettes: str):
+        cle = self._cle(etiquettes)
+        with self._verrou:
+            self._valeurs[cle] = valeur
+
+    def _lignes(self) -> List[str]:
+        if not self.etiquettes and not self._valeurs:
+            return [f"{self.nom} 0"]
+        return super()._lignes()
+
+
+class Histogramme(Metrique):
+    type = "histogram"
+
+    def __init__(self, nom: str, aide: str, etiquettes: Sequence[str] = (), bornes: Sequence[float] = BORNES_DUREE):
+        super().__init__(nom, aide, etiquettes)
+        self.bornes = tuple(sorted(bornes)) + (float("inf"),)
+
+    def observer(self, valeur: float, **etiquettes: str):
+        cle = self._cle(etiquettes)
+        with self._verrou:
+            serie = self._valeurs.get(cle)
+            if serie is None:
+                serie = self._valeurs[cle] = {"compteurs": [0] * len(self.bornes), "somme": 0.0, "total": 0}
+            for i, borne in enumerate(self.bornes):
+                if valeur <= borne:
+                    serie["compteurs"][i] += 1
+                    break
+            serie["somme"] += valeur
+            serie["total"] += 1
+
+    def _lignes(self) -> List[str]:
+        with self._verrou:
+            series = sorted((cle, dict(serie, compteurs=list(serie["compteurs"]))) for cle, serie in self._valeurs.items())
+        lignes = []
+        for cle, serie in series:
+            cumul = 0
+            for borne, compte in zip(self.bornes, serie["compteurs"]):
+                cumul += compte
+                le = f'le="{_nombre(borne)}"'
+                lignes.append(f"{self.nom}_bucket{self._format_etiquettes(cle, le)} {cumul}")
+            lignes.append(f"{self.nom}_sum{self._format_etiquettes(cle)} {_nombre(serie['somme'])}")
+            lignes.append(f"{self.nom}_count{self._format_etiquettes(cle)} {serie['total']}")
+        return lignes
+
+
+class Registre:
+    def __init__(self):
+        self.metriques: List[Metrique] = []
+
+    def enregistrer(self, metrique: Metrique) -> Metrique:
+        self.metriques.append(metrique)
+        return metrique
+
+    def exposer(self) -> str:
+        return "\n".join(ligne for metrique in self.metriques for ligne in metrique.exposer()) + "\n"
+
+
+registre = Registre()
+
+# ==================== HTTP ====================
+
+http_duree = registre.enregistrer(Histogramme(
+    "http_requete_duree_secondes", "Durée des requêtes HTTP, jusqu'au dernier octet de la réponse",
+    ("methode", "route", "statut")
+))
+http_sql_requetes = registre.enregistrer(Histogramme(
+    "http_requete_sql_requetes", "Nombre de requêtes SQL émises par une requête HTTP",
+    ("route",), bornes=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+))
+http_sql_duree = registre.enregistrer(Histogramme(
+    "http_requete_sql_duree_secondes", "Temps passé en SQL par une requête HTTP", ("route",)
+))
+
+# ==================== SQL ====================
+
+sql_requetes = registre.enregistrer(Compteur("sql_requetes_total", "Requêtes SQL exécutées"))
+sql_duree = registre.enregistrer(Compteur("sql_duree_secondes_total", "Temps total passé en SQL"))
+
+# ==================== GÉNÉRATION ====================
+
+generation_lancement = registre.enregistrer(Histogramme(
+    "generation_lancement_secondes", "Obtention d'un processus claude (pris dans le pool ou lancé à froid)"
+))
+generation_premier_octet = registre.enregistrer(Histogramme(
+    "generation_premier_octet_secondes", "Délai entre l'envoi du prompt et la première sortie du CLI"
+))
+generation_duree = registre.enregistrer(Histogramme(
+    "generation_duree_secondes", "Durée totale d'une génération par le CLI, lancement compris", ("resultat",)
+))
+generation_contexte_duree = registre.enregistrer(Histogramme(
+    "generation_contexte_duree_secondes", "Assemblage du contexte des chapitres précédents"
+))
+generation_prompt_caracteres = registre.enregistrer(Histogramme(
+    "generation_prompt_caracteres", "Taille du prompt complet envoyé au CLI (caractères)",
+    bornes=(1000, 2500, 5000, 10000, 20000, 40000, 80000, 160000)
+))
+generation_contexte_chapitres = registre.enregistrer(Histogramme(
+    "generation_contexte_chapitres", "Nombre de chapitres précédents repris en entier dans le prompt",
+    bornes=(0, 1, 2, 3, 5, 10, 20)
+))
+generations_en_cours = registre.enregistrer(Jauge("generations_en_cours", "Générations en cours par le CLI"))
+
+# ==================== ADMISSION ====================
+
+admission_actives = registre.enregistrer(Jauge(
+    "admission_generations_actives", "Générations admises (places occupées sur GENERATION_CONCURRENCE_MAX)"
+))
+admission_file = registre.enregistrer(Jauge("admission_file_attente", "Générations en attente d'une place"))
+admission_attente = registre.enregistrer(Histogramme(
+    "admission_attente_secondes", "Attente d'une place avant d'être admis"
+))
+admission_admises = registre.enregistrer(Compteur("admission_admises_total", "Générations admises"))
+admission_rejets = registre.enregistrer(Compteur(
+    "admission_rejets_total", "Générations refusées (429 ou 503), par motif", ("motif",)
+))
+disjoncteur_etat = registre.enregistrer(Jauge(
+    "disjoncteur_generation_etat", "État du disjoncteur des générations : 0 fermé, 1 ouvert, 2 semi-ouvert"
+))
+
+
+# ==================== INSTRUMENTATION ====================
+
+# [nombre, durée] des requêtes SQL de la requête HTTP en cours ; copié vers le pool de
+# threads et les greenlets de SQLAlchemy async avec le contexte, la liste est partagée
+_sql_requete_courante: ContextVar[Optional[list]] = ContextVar("sql_requete_courante", default=None)
+
+
+def instrumenter_moteur(moteur: Engine):
+    """Compte les requêtes SQL du moteur (pour un moteur async : async_engine.sync_engine)"""
+
+    @event.listens_for(moteur, "before_cursor_execute")
+    def _avant(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("debuts_requetes", []).append(time.perf_counter())
+
+    @event.listens_for(moteur, "after_cursor_execute")
+    def _apres(conn, cursor, statement, parameters, context, executemany):
+        duree = time.perf_counter() - conn.info["debuts_requetes"].pop()
+        sql_requetes.inc()
+        sql_duree.inc(duree)
+        courante = _sql_requete_courante.get()
+        if courante is not None:
+            courante[0] += 1
+            courante[1] += duree
+
+
+class MiddlewareMetriques:
+    """
+    Middleware ASGI : durée de chaque requête jusqu'au dernier octet envoyé (réponses
+    en streaming comprises), et requêtes SQL émises, par modèle de route (/livres/{livre_id}).
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[object, str] = {}
+
+    def _route(self, scope) -> str:
+        point = scope.get("endpoint")
+        if point is None:
+            return "non_trouvee"
+        if point not in self._routes:
+            # Relu à chaque route inconnue : des routes peuvent être ajoutées après le démarrage
+            self._routes = {
+                getattr(route, "endpoint", None) or getattr(route, "app", None): route.path
+                for route in scope["app"].routes
+            }
+        return self._routes.get(point, "non_trouvee")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        debut = time.perf_counter()
+        sql = [0, 0.0]
+        jeton = _sql_requete_courante.set(sql)
+        statut = [500]
+
+        async def envoyer(message):
+            if message["type"] == "http.response.start":
+                statut[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, envoyer)
+        finally:
+            _sql_requete_courante.reset(jeton)
+            route = self._route(scope)
+            http_duree.observer(time.perf_counter() - debut, methode=scope["method"], route=route,
+                                statut=str(statut[0]))
+            http_sql_requetes.observer(sql[0], route=route)
+            http_sql_duree.observer(sql[1], route=route)
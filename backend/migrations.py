@@ -0,0 +1,304 @@
+"""
+Migrations du schéma SQLite.
+
+La version du schéma est stockée dans `PRAGMA user_version`. Au démarrage, `migrer`
+applique dans l'ordre les migrations plus récentes que la base, chacune dans sa
+transaction ; une base neuve est créée par create_all, complété par les migrations
+que models.py ne décrit pas (tables virtuelles, triggers).
+
+Pour faire évoluer le schéma : modifier models.py, puis ajouter une fonction à
+MIGRATIONS qui amène une base existante au même état. Une migration écrit son DDL en
+clair au lieu de le lire dans models.py, qui décrit toujours la dernière version.
+"""
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from database import Base
+from recherche import creer_index as creer_index_recherche
+import models  # noqa: F401  (enregistre les tables dans Base.metadata)
+
+logger = logging.getLogger(__name__)
+
+
+def _version(connection: Connection) -> int:
+    return connection.execute(text("PRAGMA user_version")).scalar()
+
+
+# Schéma figé de chaque étape : une migration amène la base à l'état de sa version, qui ne
+# doit pas suivre les évolutions ultérieures de models.py (une colonne ajoutée par une
+# migration suivante la ferait échouer). Tables : définition après le nom ; index : DDL complet.
+
+# v1 : tables créées par create_all avant l'introduction des migrations
+_TABLES_V1 = {
+    "styles": """(
+        id INTEGER NOT NULL,
+        nom VARCHAR(100) NOT NULL,
+        description TEXT NOT NULL,
+        est_predefini BOOLEAN,
+        date_creation DATETIME,
+        PRIMARY KEY (id),
+        UNIQUE (nom)
+    )""",
+    "versions_livres": """(
+        livre_id INTEGER NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (livre_id)
+    )""",
+    "livres": """(
+        id INTEGER NOT NULL,
+        titre VARCHAR(255) NOT NULL,
+        description TEXT,
+        style_id INTEGER,
+        date_creation DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(style_id) REFERENCES styles (id)
+    )""",
+    "chapitres": """(
+        id INTEGER NOT NULL,
+        livre_id INTEGER NOT NULL,
+        titre VARCHAR(255) NOT NULL,
+        ordre INTEGER,
+        date_creation DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(livre_id) REFERENCES livres (id)
+    )""",
+    "contenus": """(
+        id INTEGER NOT NULL,
+        chapitre_id INTEGER NOT NULL,
+        texte_utilisateur TEXT,
+        texte_genere TEXT,
+        resume TEXT,
+        niveau_strictesse VARCHAR(20),
+        date_creation DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(chapitre_id) REFERENCES chapitres (id)
+    )""",
+    "resumes_chapitres": """(
+        chapitre_id INTEGER NOT NULL,
+        livre_id INTEGER NOT NULL,
+        empreinte VARCHAR(100) NOT NULL,
+        resume TEXT NOT NULL,
+        date_maj DATETIME,
+        PRIMARY KEY (chapitre_id),
+        FOREIGN KEY(chapitre_id) REFERENCES chapitres (id),
+        FOREIGN KEY(livre_id) REFERENCES livres (id)
+    )""",
+    "jobs_generation": """(
+        id INTEGER NOT NULL,
+        chapitre_id INTEGER NOT NULL,
+        prompt TEXT NOT NULL,
+        niveau_strictesse VARCHAR(20),
+        statut VARCHAR(20) NOT NULL,
+        erreur TEXT,
+        contenu_id INTEGER,
+        date_creation DATETIME,
+        date_debut DATETIME,
+        date_fin DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(chapitre_id) REFERENCES chapitres (id),
+        FOREIGN KEY(contenu_id) REFERENCES contenus (id)
+    )""",
+}
+_INDEX_V1 = {
+    "styles": ["CREATE INDEX IF NOT EXISTS ix_styles_id ON styles (id)"],
+    "versions_livres": [],
+    "livres": ["CREATE INDEX IF NOT EXISTS ix_livres_id ON livres (id)"],
+    "chapitres": ["CREATE INDEX IF NOT EXISTS ix_chapitres_id ON chapitres (id)"],
+    "contenus": ["CREATE INDEX IF NOT EXISTS ix_contenus_id ON contenus (id)"],
+    "resumes_chapitres": ["CREATE INDEX IF NOT EXISTS ix_resumes_chapitres_livre_id ON resumes_chapitres (livre_id)"],
+    "jobs_generation": ["CREATE INDEX IF NOT EXISTS ix_jobs_generation_id ON jobs_generation (id)"],
+}
+
+# v2 : clés étrangères avec ON DELETE, index composites (chapitres.ordre encore facultatif)
+_TABLES_V2 = {
+    "livres": _TABLES_V1["livres"].replace(
+        "REFERENCES styles (id)", "REFERENCES styles (id) ON DELETE SET NULL"
+    ),
+    "chapitres": _TABLES_V1["chapitres"].replace(
+        "REFERENCES livres (id)", "REFERENCES livres (id) ON DELETE CASCADE"
+    ),
+    "contenus": _TABLES_V1["contenus"].replace(
+        "REFERENCES chapitres (id)", "REFERENCES chapitres (id) ON DELETE CASCADE"
+    ),
+    "resumes_chapitres": _TABLES_V1["resumes_chapitres"].replace(
+        "REFERENCES chapitres (id)", "REFERENCES chapitres (id) ON DELETE CASCADE"
+    ).replace(
+        "REFERENCES livres (id)", "REFERENCES livres (id) ON DELETE CASCADE"
+    ),
+    "jobs_generation": _TABLES_V1["jobs_generation"].replace(
+        "REFERENCES chapitres (id)", "REFERENCES chapitres (id) ON DELETE CASCADE"
+    ).replace(
+        "REFERENCES contenus (id)", "REFERENCES contenus (id) ON DELETE SET NULL"
+    ),
+}
+_INDEX_V2 = {
+    "livres": _INDEX_V1["livres"] + [
+        "CREATE INDEX IF NOT EXISTS ix_livres_date_creation ON livres (date_creation, id)",
+    ],
+    "chapitres": _INDEX_V1["chapitres"] + [
+        "CREATE INDEX IF NOT EXISTS ix_chapitres_livre_ordre ON chapitres (livre_id, ordre, id)",
+    ],
+    "contenus": _INDEX_V1["contenus"] + [
+        "CREATE INDEX IF NOT EXISTS ix_contenus_chapitre_date ON contenus (chapitre_id, date_creation, id)",
+    ],
+    "resumes_chapitres": _INDEX_V1["resumes_chapitres"],
+    "jobs_generation": _INDEX_V1["jobs_generation"] + [
+        "CREATE INDEX IF NOT EXISTS ix_jobs_generation_chapitre_id ON jobs_generation (chapitre_id)",
+        "CREATE INDEX IF NOT EXISTS ix_jobs_generation_statut ON jobs_generation (statut, id)",
+    ],
+}
+
+# v5 : chapitres.ordre obligatoire
+_CHAPITRES_V5 = _TABLES_V2["chapitres"].replace("ordre INTEGER,", "ordre INTEGER NOT NULL,")
+
+
+def _reconstruire_table(connection: Connection, nom: str, definition: str, index: List[str]):
+    """
+    Recrée une table selon `definition` (SQLite ne sait pas modifier une contrainte).
+
+    Procédure recommandée par SQLite : nouvelle table, copie, suppression de l'ancienne,
+    renommage. Les clés étrangères doivent être désactivées pendant l'opération. Les index
+    et triggers, supprimés avec l'ancienne table, sont recréés.
+    """
+    temporaire = f"_migration_{nom}"
+    triggers = connection.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (nom,)
+    ).scalars().all()
+
+    connection.exec_driver_sql(f"CREATE TABLE {temporaire} {definition}")
+    colonnes_existantes = {colonne["name"] for colonne in inspect(connection).get_columns(nom)}
+    colonnes = ", ".join(
+        c["name"] for c in inspect(connection).get_columns(temporaire) if c["name"] in colonnes_existantes
+    )
+    connection.exec_driver_sql(f"INSERT INTO {temporaire} ({colonnes}) SELECT {colonnes} FROM {nom}")
+    connection.exec_driver_sql(f"DROP TABLE {nom}")
+    connection.exec_driver_sql(f"ALTER TABLE {temporaire} RENAME TO {nom}")
+    for ddl in index + triggers:
+        connection.exec_driver_sql(ddl)
+
+
+def _m001_tables_initiales(connection: Connection):
+    """Tables créées par create_all avant l'introduction des migrations (celles qui manquent)"""
+    for nom, definition in _TABLES_V1.items():
+        connection.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {nom} {definition}")
+        for ddl in _INDEX_V1[nom]:
+            connection.exec_driver_sql(ddl)
+
+
+def _m002_cascades_et_index(connection: Connection):
+    """ON DELETE CASCADE / SET NULL au niveau de la base et index composites des filtres fréquents"""
+    for nom, definition in _TABLES_V2.items():
+        _reconstruire_table(connection, nom, definition, _INDEX_V2[nom])
+
+    # Lignes orphelines laissées par l'absence de contraintes : traitées comme l'aurait fait
+    # la cascade, jusqu'à ce qu'il n'en reste plus (supprimer un chapitre orphelin rend ses contenus orphelins)
+    while True:
+        orphelines = connection.exec_driver_sql("PRAGMA foreign_key_check").fetchall()
+        if not orphelines:
+            break
+        for nom, rowid, parent, _ in orphelines:
+            if nom == "livres":
+                connection.exec_driver_sql("UPDATE livres SET style_id = NULL WHERE rowid = ?", (rowid,))
+            elif nom == "jobs_generation" and parent == "contenus":
+                connection.exec_driver_sql("UPDATE jobs_generation SET contenu_id = NULL WHERE rowid = ?", (rowid,))
+            else:
+                connection.exec_driver_sql(f"DELETE FROM {nom} WHERE rowid = ?", (rowid,))
+        logger.warning(f"{len(orphelines)} ligne(s) orpheline(s) corrigée(s)")
+
+
+def _m003_recherche_plein_texte(connection: Connection):
+    """Index FTS5 des titres et contenus, tenu à jour par triggers (voir recherche.py)"""
+    creer_index_recherche(connection)
+
+
+def _m004_bail_des_jobs(connection: Connection):
+    """Propriétaire et battement des jobs en cours, pour ne reprendre que ceux dont le bail a expiré"""
+    # Colonnes déjà présentes si la table a été créée par un create_all postérieur à ce modèle
+    existantes = {colonne["name"] for colonne in inspect(connection).get_columns("jobs_generation")}
+    for colonne, type_sql in (("proprietaire", "VARCHAR(100)"), ("date_battement", "DATETIME")):
+        if colonne not in existantes:
+            connection.exec_driver_sql(f"ALTER TABLE jobs_generation ADD COLUMN {colonne} {type_sql}")
+
+
+def _m005_ordre_obligatoire(connection: Connection):
+    """
+    Chapitres.ordre NOT NULL : la pagination par (ordre, id) et les chapitres précédents
+    (ordre < n) ignoraient les chapitres sans ordre. Triés en tête jusqu'ici (NULL avant
+    tout nombre), ils sont placés avant le premier chapitre de leur livre.
+    """
+    # Premier ordre de chaque livre lu avant la mise à jour, qui le modifierait au fil des lignes
+    premiers = connection.exec_driver_sql(
+        "SELECT livre_id, COALESCE(MIN(ordre), 1) FROM chapitres "
+        "WHERE livre_id IN (SELECT livre_id FROM chapitres WHERE ordre IS NULL) GROUP BY livre_id"
+    ).fetchall()
+    for livre_id, premier in premiers:
+        connection.exec_driver_sql(
+            "UPDATE chapitres SET ordre = ? WHERE livre_id = ? AND ordre IS NULL", (premier - 1, livre_id)
+        )
+    _reconstruire_table(connection, "chapitres", _CHAPITRES_V5, _INDEX_V2["chapitres"])
+
+
+# (description, migration, décrite par models.py : inutile sur une base créée par create_all)
+MIGRATIONS: List[Tuple[str, Callable[[Connection], None], bool]] = [
+    ("tables initiales", _m001_tables_initiales, True),
+    ("cascades et index composites", _m002_cascades_et_index, True),
+    ("recherche plein texte", _m003_recherche_plein_texte, False),
+    ("bail des jobs", _m004_bail_des_jobs, True),
+    ("ordre des chapitres obligatoire", _m005_ordre_obligatoire, True),
+]
+
+VERSION_SCHEMA = len(MIGRATIONS)
+
+
+def _transaction(connection: Connection):
+    transaction = connection.begin()
+    # pysqlite n'ouvre pas de transaction avant les instructions DDL : on l'ouvre explicitement
+    connection.exec_driver_sql("BEGIN IMMEDIATE")
+    return transaction
+
+
+def migrer(engine: Engine):
+    """
+    Amène la base à VERSION_SCHEMA.
+
+    Plusieurs processus peuvent démarrer en même temps sur la même base : la version est
+    relue dans chaque transaction (BEGIN IMMEDIATE, qui réserve l'écriture), et une
+    migration déjà appliquée par un autre processus est sautée.
+    """
+    with engine.connect() as connection:
+        # Hors transaction : ce pragma est ignoré dans une transaction
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        version = _version(connection)
+        connection.commit()
+        try:
+            if version >= VERSION_SCHEMA:
+                return
+
+            with _transaction(connection):
+                neuve = _version(connection) == 0 and not inspect(connection).has_table("livres")
+                if neuve:
+                    Base.metadata.create_all(bind=connection)
+                    for _, migration, dans_modeles in MIGRATIONS:
+                        if not dans_modeles:
+                            migration(connection)
+                    connection.exec_driver_sql(f"PRAGMA user_version={VERSION_SCHEMA}")
+            if neuve:
+                logger.info(f"Base créée (schéma v{VERSION_SCHEMA})")
+                return
+
+            for numero, (description, migration, _) in enumerate(MIGRATIONS, start=1):
+                if numero <= version:
+                    continue
+                with _transaction(connection):
+                    version = _version(connection)
+                    if numero <= version:
+                        continue
+                    migration(connection)
+                    connection.exec_driver_sql(f"PRAGMA user_version={numero}")
+                logger.info(f"Migration {numero} appliquée : {description}")
+        finally:
+            connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+            connection.commit()
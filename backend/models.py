@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -23,9 +23,13 @@ class Livre(Base):
     id = Column(Integer, primary_key=True, index=True)
     titre = Column(String(255), nullable=False)
     description = Column(Text, nullable=True)
-    style_id = Column(Integer, ForeignKey("styles.id"), nullable=True)
+    style_id = Column(Integer, ForeignKey("styles.id", ondelete="SET NULL"), nullable=True)
     date_creation = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_livres_date_creation", "date_creation", "id"),
+    )
+
     style_rel = relationship("Style", back_populates="livres")
     chapitres = relationship("Chapitre", back_populates="livre", cascade="all, delete-orphan")
 
@@ -34,24 +38,75 @@ class Chapitre(Base):
     __tablename__ = "chapitres"
 
     id = Column(Integer, primary_key=True, index=True)
-    livre_id = Column(Integer, ForeignKey("livres.id"), nullable=False)
+    livre_id = Column(Integer, ForeignKey("livres.id", ondelete="CASCADE"), nullable=False)
     titre = Column(String(255), nullable=False)
-    ordre = Column(Integer, default=1)
+    ordre = Column(Integer, nullable=False, default=1)
     date_creation = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_chapitres_livre_ordre", "livre_id", "ordre", "id"),
+    )
+
     livre = relationship("Livre", back_populates="chapitres")
     contenus = relationship("Contenu", back_populates="chapitre", cascade="all, delete-orphan")
+    resume_memoire = relationship("ResumeChapitre", uselist=False, cascade="all, delete-orphan")
 
 
 class Contenu(Base):
     __tablename__ = "contenus"
 
     id = Column(Integer, primary_key=True, index=True)
-    chapitre_id = Column(Integer, ForeignKey("chapitres.id"), nullable=False)
+    chapitre_id = Column(Integer, ForeignKey("chapitres.id", ondelete="CASCADE"), nullable=False)
     texte_utilisateur = Column(Text, nullable=True)
     texte_genere = Column(Text, nullable=True)
     resume = Column(Text, nullable=True)  # Résumé "Idée" auto-généré
     niveau_strictesse = Column(String(20), nullable=True)  # libre, modere, strict
     date_creation = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_contenus_chapitre_date", "chapitre_id", "date_creation", "id"),
+    )
+
     chapitre = relationship("Chapitre", back_populates="contenus")
+
+
+class ResumeChapitre(Base):
+    """Résumé condensé d'un chapitre, utilisé comme mémoire "l'histoire jusqu'ici" du livre"""
+    __tablename__ = "resumes_chapitres"
+
+    chapitre_id = Column(Integer, ForeignKey("chapitres.id", ondelete="CASCADE"), primary_key=True)
+    livre_id = Column(Integer, ForeignKey("livres.id", ondelete="CASCADE"), nullable=False, index=True)
+    empreinte = Column(String(100), nullable=False)  # état des contenus au moment du résumé
+    resume = Column(Text, nullable=False)
+    date_maj = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class VersionLivre(Base):
+    """Compteur incrémenté à chaque création, modification ou suppression d'un chapitre ou contenu du livre"""
+    __tablename__ = "versions_livres"
+
+    # Pas de clé étrangère : le compteur survit au livre pour rester croissant si l'id est réattribué
+    livre_id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class JobGeneration(Base):
+    __tablename__ = "jobs_generation"
+
+    id = Column(Integer, primary_key=True, index=True)
+    chapitre_id = Column(Integer, ForeignKey("chapitres.id", ondelete="CASCADE"), nullable=False, index=True)
+    prompt = Column(Text, nullable=False)
+    niveau_strictesse = Column(String(20), nullable=True)
+    statut = Column(String(20), nullable=False, default="en_attente")  # en_attente, en_cours, termine, echoue
+    erreur = Column(Text, nullable=True)
+    contenu_id = Column(Integer, ForeignKey("contenus.id", ondelete="SET NULL"), nullable=True)
+    date_creation = Column(DateTime, default=datetime.utcnow)
+    date_debut = Column(DateTime, nullable=True)
+    date_fin = Column(DateTime, nullable=True)
+    # Processus qui exécute le job, et dernier signe de vie de ce processus (bail, voir jobs.py)
+    proprietaire = Column(String(100), nullable=True)
+    date_battement = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_generation_statut", "statut", "id"),
+    )
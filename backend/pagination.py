@@ -0,0 +1,60 @@
+import json
+import base64
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import DateTime, tuple_
+
+# En-tête portant le curseur de la page suivante (absent sur la dernière page)
+ENTETE_CURSEUR = "X-Curseur-Suivant"
+
+
+def encoder_curseur(valeur: Any, identifiant: int) -> str:
+    if isinstance(valeur, datetime):
+        valeur = valeur.isoformat()
+    brut = json.dumps([valeur, identifiant], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(brut).decode("ascii").rstrip("=")
+
+
+def decoder_curseur(curseur: str, colonne=None) -> Tuple[Any, int]:
+    try:
+        brut = base64.urlsafe_b64decode(curseur + "=" * (-len(curseur) % 4))
+        valeur, identifiant = json.loads(brut)
+        if colonne is not None and isinstance(colonne.type, DateTime):
+            valeur = datetime.fromisoformat(valeur)
+        return valeur, int(identifiant)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide")
+
+
+def preparer_page(requete, colonne, colonne_id, apres: Optional[str], limite: Optional[int]):
+    """
+    Ordonne la requête (Query ou select) sur (colonne, id) et la limite à la page demandée.
+
+    Chaque page reprend strictement après la dernière ligne de la précédente, via un
+    index plutôt qu'un OFFSET : le coût d'une page ne dépend pas de sa position.
+    Une ligne de plus que la limite est lue pour savoir s'il reste une page.
+    """
+    requete = requete.order_by(colonne, colonne_id)
+    if apres:
+        valeur, identifiant = decoder_curseur(apres, colonne)
+        requete = requete.filter(tuple_(colonne, colonne_id) > (valeur, identifiant))
+    if limite is not None:
+        requete = requete.limit(limite + 1)
+    return requete
+
+
+def decouper_page(lignes: List, limite: Optional[int],
+                  cle: Callable[[Any], Tuple[Any, int]]) -> Tuple[List, Optional[str]]:
+    """
+    Args:
+        cle: extrait (valeur de colonne, id) d'une ligne du résultat
+
+    Returns:
+        Les lignes de la page et le curseur de la page suivante (None s'il n'y en a pas)
+    """
+    if limite is not None and len(lignes) > limite:
+        return lignes[:limite], encoder_curseur(*cle(lignes[limite - 1]))
+    return lignes, None
+
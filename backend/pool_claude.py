@@ -0,0 +1,256 @@
+import os
+import time
+import shutil
+import tempfile
+import logging
+import threading
+import subprocess
+from collections import deque
+from typing import Optional, Dict, List, Deque, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Arguments passés à chaque processus Claude : le prompt est envoyé sur stdin,
+# ce qui permet de lancer le processus avant de connaître la requête.
+ARGUMENTS_CLAUDE = ["-p", "--output-format", "stream-json", "--verbose", "--include-partial-messages"]
+
+# Nombre de processus prêts à l'emploi (0 pour désactiver le pré-démarrage)
+POOL_TAILLE = int(os.environ.get("CLAUDE_POOL_TAILLE", "2"))
+# Un processus inutilisé depuis plus longtemps est remplacé (secondes)
+POOL_AGE_MAX = float(os.environ.get("CLAUDE_POOL_AGE_MAX", "600"))
+# Intervalle de revérification du binaire claude (secondes)
+REVALIDATION_INTERVALLE = float(os.environ.get("CLAUDE_REVALIDATION_INTERVALLE", "300"))
+
+
+class DecouverteCLI:
+    """Localise le binaire claude et sa version, une fois, puis à intervalle régulier"""
+
+    def __init__(self):
+        self.chemin: Optional[str] = None
+        self.version: Optional[str] = None
+        self.date_verification: Optional[float] = None
+        self._verrou = threading.Lock()
+
+    def verifier(self) -> bool:
+        """Relance la découverte. Retourne True si le binaire ou sa version a changé."""
+        chemin = shutil.which("claude")
+        version = None
+        if chemin:
+            try:
+                resultat = subprocess.run([chemin, "--version"], capture_output=True, text=True, timeout=30)
+                version = resultat.stdout.strip() or None
+            except (OSError, subprocess.TimeoutExpired) as e:
+                logger.warning(f"claude --version a échoué: {e}")
+
+        with self._verrou:
+            change = (chemin, version) != (self.chemin, self.version)
+            self.chemin, self.version = chemin, version
+            self.date_verification = time.time()
+
+        if change:
+            logger.info(f"Claude CLI: {chemin or 'introuvable'} ({version or 'version inconnue'})")
+        return change
+
+    def obtenir_chemin(self) -> str:
+        if self.date_verification is None:
+            self.verifier()
+        if not self.chemin:
+            raise FileNotFoundError("claude")
+        return self.chemin
+
+
+class PoolProcessus:
+    """
+    Garde des processus `claude -p` démarrés à l'avance, en attente du prompt sur stdin.
+
+    Un processus ne sert qu'une génération : il est remplacé en arrière-plan
+    dès qu'il est pris, pour que la requête suivante le trouve déjà prêt.
+    """
+
+    def __init__(self, decouverte: DecouverteCLI, taille: int = POOL_TAILLE, age_max: float = POOL_AGE_MAX):
+        self.decouverte = decouverte
+        self.taille = taille
+        self.age_max = age_max
+        self._prets: Deque[Tuple[subprocess.Popen, float]] = deque()
+        self._verrou = threading.Lock()
+        self._remplissage_en_cours = False
+        self._minuteur: Optional[threading.Timer] = None
+        self.stats = {
+            "processus_lances": 0,
+            "reutilisations": 0,
+            "demarrages_a_froid": 0,
+            "processus_recycles": 0,
+            # Retour de Popen : le processus est créé, pas encore prêt à répondre
+            "duree_popen_totale": 0.0,
+            "duree_popen_derniere": None,
+            # Envoi du prompt -> première sortie, selon que le processus a été pris dans le pool
+            # (CLI déjà démarré) ou lancé à froid (démarrage du CLI compris) : l'écart est ce que le pool fait gagner
+            "premier_octet_pret_total": 0.0,
+            "premier_octet_pret_nombre": 0,
+            "premier_octet_froid_total": 0.0,
+            "premier_octet_froid_nombre": 0,
+        }
+
+    def _lancer(self) -> subprocess.Popen:
+        chemin = self.decouverte.obtenir_chemin()
+        # stderr n'est lu qu'à la fin : un fichier évite de bloquer le processus sur un pipe plein
+        erreurs = tempfile.TemporaryFile(mode="w+")
+        debut = time.perf_counter()
+        try:
+            process = subprocess.Popen(
+                [chemin, *ARGUMENTS_CLAUDE],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=erreurs,
+                text=True,
+                bufsize=1,
+                env={**os.environ}
+            )
+        except OSError:
+            erreurs.close()
+            raise
+        process.erreurs = erreurs
+        process.pris_dans_le_pool = False
+        duree = time.perf_counter() - debut
+        with self._verrou:
+            self.stats["processus_lances"] += 1
+            self.stats["duree_popen_totale"] += duree
+            self.stats["duree_popen_derniere"] = duree
+        return process
+
+    @staticmethod
+    def _arreter(process: subprocess.Popen):
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        for flux in (process.stdin, process.stdout, process.erreurs):
+            if not flux.closed:
+                flux.close()
+
+    @staticmethod
+    def lire_erreurs(process: subprocess.Popen) -> str:
+        process.erreurs.seek(0)
+        return process.erreurs.read()
+
+    def liberer(self, process: subprocess.Popen):
+        """Termine un processus acquis (tué s'il tourne encore) et ferme ses flux"""
+        self._arreter(process)
+
+    def acquerir(self) -> subprocess.Popen:
+        """Retourne un processus prêt, ou en démarre un si le pool est vide"""
+        maintenant = time.time()
+        process = None
+        a_recycler: List[subprocess.Popen] = []
+        with self._verrou:
+            while self._prets:
+                candidat, date_lancement = self._prets.popleft()
+                if candidat.poll() is None and maintenant - date_lancement < self.age_max:
+                    process = candidat
+                    self.stats["reutilisations"] += 1
+                    break
+                a_recycler.append(candidat)
+                self.stats["processus_recycles"] += 1
+            if process is None:
+                self.stats["demarrages_a_froid"] += 1
+
+        for candidat in a_recycler:
+            self._arreter(candidat)
+        self.remplir_en_arriere_plan()
+        if process is None:
+            return self._lancer()
+        process.pris_dans_le_pool = True
+        return process
+
+    def noter_premier_octet(self, process: subprocess.Popen, duree: float):
+        """Délai entre l'envoi du prompt et la première sortie du processus acquis"""
+        origine = "pret" if process.pris_dans_le_pool else "froid"
+        with self._verrou:
+            self.stats[f"premier_octet_{origine}_total"] += duree
+            self.stats[f"premier_octet_{origine}_nombre"] += 1
+
+    def remplir(self):
+        """Démarre des processus jusqu'à atteindre la taille du pool"""
+        try:
+            while True:
+                with self._verrou:
+                    if len(self._prets) >= self.taille:
+                        return
+                try:
+                    process = self._lancer()
+                except OSError as e:
+                    logger.warning(f"Impossible de pré-démarrer claude: {e}")
+                    return
+                with self._verrou:
+                    self._prets.append((process, time.time()))
+        finally:
+            with self._verrou:
+                self._remplissage_en_cours = False
+
+    def remplir_en_arriere_plan(self):
+        with self._verrou:
+            if self.taille <= 0 or self._remplissage_en_cours:
+                return
+            self._remplissage_en_cours = True
+        threading.Thread(target=self.remplir, name="pool-claude", daemon=True).start()
+
+    def vider(self):
+        """Arrête les processus en attente (binaire changé ou arrêt du serveur)"""
+        with self._verrou:
+            processus = [p for p, _ in self._prets]
+            self._prets.clear()
+        for process in processus:
+            self._arreter(process)
+
+    def _revalider(self):
+        try:
+            if self.decouverte.verifier():
+                self.vider()
+            self.remplir_en_arriere_plan()
+        finally:
+            self._programmer_revalidation()
+
+    def _programmer_revalidation(self):
+        self._minuteur = threading.Timer(REVALIDATION_INTERVALLE, self._revalider)
+        self._minuteur.daemon = True
+        self._minuteur.start()
+
+    def demarrer(self):
+        """Découvre le binaire, remplit le pool et programme la revérification périodique"""
+        self.decouverte.verifier()
+        self.remplir_en_arriere_plan()
+        self._programmer_revalidation()
+
+    def arreter(self):
+        if self._minuteur:
+            self._minuteur.cancel()
+        self.vider()
+
+    def statut(self) -> Dict:
+        with self._verrou:
+            stats = dict(self.stats)
+            prets = len(self._prets)
+        popen = stats.pop("duree_popen_totale")
+        moyennes = {}
+        for origine in ("pret", "froid"):
+            total = stats.pop(f"premier_octet_{origine}_total")
+            nombre = stats[f"premier_octet_{origine}_nombre"]
+            moyennes[f"premier_octet_moyen_{origine}"] = total / nombre if nombre else None
+        return {
+            "cli": {
+                "chemin": self.decouverte.chemin,
+                "version": self.decouverte.version,
+                "date_verification": self.decouverte.date_verification,
+            },
+            "pool": {
+                "taille": self.taille,
+                "prets": prets,
+                "age_max": self.age_max,
+                **stats,
+                "duree_popen_moyenne": popen / stats["processus_lances"] if stats["processus_lances"] else None,
+                **moyennes,
+            },
+        }
+
+
+decouverte = DecouverteCLI()
+pool = PoolProcessus(decouverte)
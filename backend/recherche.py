@@ -0,0 +1,164 @@
+"""
+Recherche plein texte (SQLite FTS5) sur les titres des livres et chapitres et sur les contenus générés.
+
+La table virtuelle `recherche` a une ligne par livre, chapitre et contenu ; son rowid
+encode le type et l'id de la ligne d'origine (id * 4 + type), ce qui permet aux triggers
+de la tenir à jour en une opération par écriture, et aux résultats d'être rattachés à
+leur livre et chapitre par simple jointure (un chapitre déplacé n'a pas à être réindexé).
+"""
+import re
+import html
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from pagination import encoder_curseur, decoder_curseur
+
+TYPE_LIVRE, TYPE_CHAPITRE, TYPE_CONTENU = 1, 2, 3
+TYPES = {TYPE_LIVRE: "livre", TYPE_CHAPITRE: "chapitre", TYPE_CONTENU: "contenu"}
+
+# Poids bm25 des colonnes (titre, resume, texte) : un titre qui correspond compte plus qu'une mention dans le texte
+POIDS_COLONNES = (5.0, 2.0, 1.0)
+# Nombre de mots autour des termes trouvés dans l'extrait
+MOTS_EXTRAIT = 16
+# Délimiteurs des termes trouvés posés par snippet() (caractères à usage privé, absents
+# des textes), remplacés par <mark> une fois le texte de l'extrait échappé
+DEBUT_TERME, FIN_TERME = "\ue000", "\ue001"
+
+DDL_RECHERCHE = [
+    # remove_diacritics : "etoile" trouve "étoile"
+    """CREATE VIRTUAL TABLE recherche USING fts5(
+        titre, resume, texte, tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    f"INSERT INTO recherche(recherche, rank) VALUES ('rank', 'bm25({', '.join(map(str, POIDS_COLONNES))})')",
+
+    f"""CREATE TRIGGER recherche_livres_ai AFTER INSERT ON livres BEGIN
+        INSERT INTO recherche(rowid, titre) VALUES (new.id * 4 + {TYPE_LIVRE}, new.titre);
+    END""",
+    f"""CREATE TRIGGER recherche_livres_au AFTER UPDATE OF titre ON livres BEGIN
+        UPDATE recherche SET titre = new.titre WHERE rowid = new.id * 4 + {TYPE_LIVRE};
+    END""",
+    f"""CREATE TRIGGER recherche_livres_ad AFTER DELETE ON livres BEGIN
+        DELETE FROM recherche WHERE rowid = old.id * 4 + {TYPE_LIVRE};
+    END""",
+
+    f"""CREATE TRIGGER recherche_chapitres_ai AFTER INSERT ON chapitres BEGIN
+        INSERT INTO recherche(rowid, titre) VALUES (new.id * 4 + {TYPE_CHAPITRE}, new.titre);
+    END""",
+    f"""CREATE TRIGGER recherche_chapitres_au AFTER UPDATE OF titre ON chapitres BEGIN
+        UPDATE recherche SET titre = new.titre WHERE rowid = new.id * 4 + {TYPE_CHAPITRE};
+    END""",
+    f"""CREATE TRIGGER recherche_chapitres_ad AFTER DELETE ON chapitres BEGIN
+        DELETE FROM recherche WHERE rowid = old.id * 4 + {TYPE_CHAPITRE};
+    END""",
+
+    f"""CREATE TRIGGER recherche_contenus_ai AFTER INSERT ON contenus BEGIN
+        INSERT INTO recherche(rowid, resume, texte) VALUES (new.id * 4 + {TYPE_CONTENU}, new.resume, new.texte_genere);
+    END""",
+    f"""CREATE TRIGGER recherche_contenus_au AFTER UPDATE OF resume, texte_genere ON contenus BEGIN
+        UPDATE recherche SET resume = new.resume, texte = new.texte_genere WHERE rowid = new.id * 4 + {TYPE_CONTENU};
+    END""",
+    f"""CREATE TRIGGER recherche_contenus_ad AFTER DELETE ON contenus BEGIN
+        DELETE FROM recherche WHERE rowid = old.id * 4 + {TYPE_CONTENU};
+    END""",
+]
+
+
+def creer_index(connection: Connection):
+    """Crée la table FTS5 et ses triggers, et y indexe les lignes existantes"""
+    for ddl in DDL_RECHERCHE:
+        connection.exec_driver_sql(ddl)
+    connection.exec_driver_sql(f"INSERT INTO recherche(rowid, titre) SELECT id * 4 + {TYPE_LIVRE}, titre FROM livres")
+    connection.exec_driver_sql(
+        f"INSERT INTO recherche(rowid, titre) SELECT id * 4 + {TYPE_CHAPITRE}, titre FROM chapitres"
+    )
+    connection.exec_driver_sql(
+        f"INSERT INTO recherche(rowid, resume, texte) "
+        f"SELECT id * 4 + {TYPE_CONTENU}, resume, texte_genere FROM contenus"
+    )
+
+
+_MOT = re.compile(r"\w+\*?")
+
+
+def requete_fts(q: str) -> str:
+    """
+    Traduit la saisie de l'utilisateur en requête FTS5 : tous les mots doivent être présents,
+    un mot terminé par * est un préfixe. La syntaxe FTS5 (opérateurs, colonnes) n'est pas
+    exposée, pour qu'aucune saisie ne provoque d'erreur de syntaxe.
+    """
+    termes = []
+    for mot in _MOT.findall(q):
+        prefixe = mot.endswith("*")
+        mot = mot.rstrip("*")
+        if mot:
+            termes.append(f'"{mot}"' + ("*" if prefixe else ""))
+    if not termes:
+        raise HTTPException(status_code=400, detail="La recherche doit contenir au moins un mot")
+    return " ".join(termes)
+
+
+_SQL_RECHERCHE = f"""
+SELECT t.rowid, t.rang, t.extrait,
+       l.id AS livre_id, l.titre AS livre_titre,
+       ch.id AS chapitre_id, ch.titre AS chapitre_titre,
+       co.id AS contenu_id
+FROM (
+    SELECT rowid, rank AS rang,
+           snippet(recherche, -1, :debut_terme, :fin_terme, '…', {MOTS_EXTRAIT}) AS extrait
+    FROM recherche
+    WHERE recherche MATCH :requete {{apres}}
+    ORDER BY rank, rowid
+    LIMIT :limite
+) AS t
+LEFT JOIN contenus co ON t.rowid % 4 = {TYPE_CONTENU} AND co.id = t.rowid / 4
+LEFT JOIN chapitres ch ON ch.id = CASE t.rowid % 4
+    WHEN {TYPE_CHAPITRE} THEN t.rowid / 4 WHEN {TYPE_CONTENU} THEN co.chapitre_id END
+LEFT JOIN livres l ON l.id = CASE t.rowid % 4 WHEN {TYPE_LIVRE} THEN t.rowid / 4 ELSE ch.livre_id END
+ORDER BY t.rang, t.rowid
+"""
+
+
+def extrait_html(extrait: Optional[str]) -> Optional[str]:
+    """Extrait échappé pour HTML, termes trouvés entourés de <mark> : les textes indexés ne sont pas du HTML sûr"""
+    if extrait is None:
+        return None
+    return html.escape(extrait).replace(DEBUT_TERME, "<mark>").replace(FIN_TERME, "</mark>")
+
+
+async def rechercher(db: AsyncSession, q: str, apres: Optional[str], limite: int) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Résultats classés par pertinence (bm25), avec un extrait HTML échappé où les termes
+    sont entourés de <mark>.
+
+    Pagination par curseur sur (rang, rowid), comme les listes (voir pagination.py).
+    """
+    parametres = {"requete": requete_fts(q), "limite": limite + 1,
+                  "debut_terme": DEBUT_TERME, "fin_terme": FIN_TERME}
+    filtre_apres = ""
+    if apres:
+        parametres["rang"], parametres["rowid"] = decoder_curseur(apres)
+        filtre_apres = "AND (rank, rowid) > (:rang, :rowid)"
+
+    lignes = (await db.execute(text(_SQL_RECHERCHE.format(apres=filtre_apres)), parametres)).all()
+    curseur = None
+    if len(lignes) > limite:
+        lignes = lignes[:limite]
+        curseur = encoder_curseur(lignes[-1].rang, lignes[-1].rowid)
+
+    return [
+        {
+            "type": TYPES[ligne.rowid % 4],
+            "livre_id": ligne.livre_id,
+            "livre_titre": ligne.livre_titre,
+            "chapitre_id": ligne.chapitre_id,
+            "chapitre_titre": ligne.chapitre_titre,
+            "contenu_id": ligne.contenu_id,
+            "extrait": extrait_html(ligne.extrait),
+            "score": -ligne.rang,
+        }
+        for ligne in lignes
+    ], curseur
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional
+from typing import Optional, List
 
 
 # Style schemas
@@ -61,6 +61,25 @@ class ChapitreResponse(ChapitreBase):
         from_attributes = True
 
 
+# Modifications en masse des chapitres d'un livre (PATCH /livres/{id}/chapitres:bulk)
+class DeplacementContenus(BaseModel):
+    contenu_ids: List[int]
+    chapitre_id: int  # chapitre de destination, dans le même livre
+
+
+class ChapitresBulkRequest(BaseModel):
+    supprimer: Optional[List[int]] = None  # chapitres à supprimer, avec leurs contenus
+    deplacer: Optional[List[DeplacementContenus]] = None
+    ordre: Optional[List[int]] = None  # tous les chapitres restants du livre, dans le nouvel ordre
+
+
+class ChapitresBulkResponse(BaseModel):
+    livre_id: int
+    chapitres_supprimes: int
+    contenus_deplaces: int
+    chapitres_reordonnes: int
+
+
 # Contenu schemas
 class ContenuBase(BaseModel):
     texte_utilisateur: Optional[str] = None
@@ -82,12 +101,90 @@ class ContenuResponse(ContenuBase):
         from_attributes = True
 
 
+# Vues "resume" des listes : identifiants, titres, résumé et longueur, sans le texte
+class LivreResumeResponse(BaseModel):
+    id: int
+    titre: str
+    style_id: Optional[int] = None
+    date_creation: datetime
+    nombre_chapitres: int
+
+
+class ChapitreResumeResponse(BaseModel):
+    id: int
+    livre_id: int
+    titre: str
+    ordre: Optional[int] = None
+    date_creation: datetime
+    nombre_contenus: int
+    longueur_texte: int
+
+
+class ContenuResumeResponse(BaseModel):
+    id: int
+    chapitre_id: int
+    resume: Optional[str] = None
+    niveau_strictesse: Optional[str] = None
+    date_creation: datetime
+    longueur_texte: int
+
+
+# Livre complet (lecture en une requête)
+class ChapitreCompletResponse(ChapitreResponse):
+    contenus: List[ContenuResponse] = []
+
+
+class LivreCompletResponse(LivreResponse):
+    chapitres: List[ChapitreCompletResponse] = []
+
+
+# Mémoire "l'histoire jusqu'ici" d'un livre
+class ResumeChapitreResponse(BaseModel):
+    chapitre_id: int
+    titre: str
+    ordre: int
+    resume: str
+
+
+class MemoireLivreResponse(BaseModel):
+    livre_id: int
+    chapitres: List[ResumeChapitreResponse]
+
+
 # Schema pour la génération de texte
 class GenerationRequest(BaseModel):
     prompt: str
     niveau_strictesse: Optional[str] = "modere"  # libre, modere, strict
+    nouvelle_variante: Optional[bool] = False  # ignorer le cache pour obtenir un nouveau texte
 
 
 class GenerationResponse(BaseModel):
     texte_genere: str
     resume: Optional[str] = None
+
+
+# Schema pour les jobs de génération asynchrone
+class JobResponse(BaseModel):
+    id: int
+    chapitre_id: int
+    statut: str
+    erreur: Optional[str] = None
+    contenu_id: Optional[int] = None
+    date_creation: datetime
+    date_debut: Optional[datetime] = None
+    date_fin: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+# Recherche plein texte
+class ResultatRechercheResponse(BaseModel):
+    type: str  # livre, chapitre, contenu
+    livre_id: Optional[int] = None
+    livre_titre: Optional[str] = None
+    chapitre_id: Optional[int] = None
+    chapitre_titre: Optional[str] = None
+    contenu_id: Optional[int] = None
+    extrait: Optional[str] = None  # HTML échappé, termes trouvés entourés de <mark>
+    score: float
@@ -0,0 +1,87 @@
+"""
+Sérialisation rapide des réponses volumineuses (listes de livres, chapitres, contenus,
+livre complet).
+
+Plutôt que de charger des objets ORM, de les valider un par un avec les schémas
+pydantic (from_attributes) puis d'encoder le résultat avec le module json, les routes
+lisent des lignes Core (tuples de colonnes), en font des dicts et les encodent avec
+orjson. Les schémas de schemas.py restent la référence : ils fixent les colonnes lues
+(mêmes champs, même forme de réponse) et décrivent les réponses dans l'OpenAPI.
+
+Sans le paquet orjson, l'encodage se rabat sur json (même résultat, plus lent).
+
+Voir benchmarks/cout_serialisation.py pour le coût par Mo des deux chemins.
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Sequence
+
+from fastapi import Response
+
+from models import Style, Livre, Chapitre, Contenu
+from schemas import StyleResponse, LivreResponse, ChapitreResponse, ContenuResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _par_defaut(valeur: Any):
+    if isinstance(valeur, datetime):
+        return valeur.isoformat()
+    raise TypeError(f"Type non sérialisable: {type(valeur).__name__}")
+
+
+def encoder(contenu: Any) -> bytes:
+    if orjson is not None:
+        # Dates naïves sans fuseau, comme pydantic : "2024-01-01T12:00:00.123456"
+        return orjson.dumps(contenu)
+    return json.dumps(contenu, ensure_ascii=False, separators=(",", ":"), default=_par_defaut).encode("utf-8")
+
+
+class ReponseRapide(Response):
+    """Réponse JSON encodée par orjson ; le contenu ne doit contenir que des types JSON et des dates"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return encoder(content)
+
+
+def _champs(schema, modele) -> List[str]:
+    """Champs du schéma qui sont des colonnes du modèle, dans l'ordre du schéma"""
+    return [champ for champ in schema.model_fields if champ in modele.__table__.c]
+
+
+CHAMPS_STYLE = _champs(StyleResponse, Style)
+CHAMPS_LIVRE = _champs(LivreResponse, Livre)
+CHAMPS_CHAPITRE = _champs(ChapitreResponse, Chapitre)
+CHAMPS_CONTENU = _champs(ContenuResponse, Contenu)
+
+
+def colonnes(modele, champs: Sequence[str]) -> List:
+    return [getattr(modele, champ) for champ in champs]
+
+
+# Colonnes du style d'un livre, préfixées pour ne pas masquer celles du livre (style_id)
+COLONNES_LIVRE_AVEC_STYLE = colonnes(Livre, CHAMPS_LIVRE) + [
+    getattr(Style, champ).label(f"style__{champ}") for champ in CHAMPS_STYLE
+]
+
+
+def en_dicts(lignes: Iterable, champs: Sequence[str]) -> List[Dict]:
+    """Lignes Core dont les colonnes sont exactement `champs`, dans cet ordre"""
+    return [dict(zip(champs, ligne)) for ligne in lignes]
+
+
+def livres_en_dicts(lignes: Iterable) -> List[Dict]:
+    """Lignes de COLONNES_LIVRE_AVEC_STYLE, au format de LivreResponse (style imbriqué ou None)"""
+    n = len(CHAMPS_LIVRE)
+    position_id_style = n + CHAMPS_STYLE.index("id")
+    livres = []
+    for ligne in lignes:
+        livre = dict(zip(CHAMPS_LIVRE, ligne[:n]))
+        livre["style"] = dict(zip(CHAMPS_STYLE, ligne[n:])) if ligne[position_id_style] is not None else None
+        livres.append(livre)
+    return livres
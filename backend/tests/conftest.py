@@ -0,0 +1,40 @@
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules du backend (importés à plat, comme par main.py) et substituts des benchmarks
+sys.path[:0] = [BACKEND, os.path.join(BACKEND, "benchmarks")]
+# Base de l'application (database.py) propre à la session de tests, sans processus Claude ni reprise des jobs
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(prefix="histoires-tests-"), "histoires.db"))
+os.environ.setdefault("DEMARRAGE_RAPIDE", "1")
+
+
+@pytest.fixture
+def serveur():
+    """Démarre une application ASGI sur un port libre ; retourne son URL. Arrêtée en fin de test."""
+    import uvicorn
+
+    serveurs = []
+
+    def demarrer(app) -> str:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        instance = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        fil = threading.Thread(target=instance.run, daemon=True)
+        fil.start()
+        while not instance.started:
+            time.sleep(0.02)
+        serveurs.append((instance, fil))
+        return f"http://127.0.0.1:{port}"
+
+    yield demarrer
+    for instance, fil in serveurs:
+        instance.should_exit = True
+        fil.join(timeout=5)
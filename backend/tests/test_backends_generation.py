@@ -0,0 +1,122 @@
+"""Backend http contre le substitut local de l'API Messages (benchmarks/faux_api_messages.py)"""
+import time
+
+import pytest
+
+import backends_generation
+from backends_generation import BackendHTTP
+from faux_api_messages import creer_app
+
+
+@pytest.fixture
+def backend():
+    backends = []
+
+    def creer(url: str, tentatives: int = 3) -> BackendHTTP:
+        instance = BackendHTTP(url=url, cle_api="test", tentatives=tentatives)
+        backends.append(instance)
+        return instance
+
+    yield creer
+    for instance in backends:
+        instance.arreter()
+
+
+@pytest.fixture(autouse=True)
+def delai_reessai_court(monkeypatch):
+    monkeypatch.setattr(backends_generation, "GENERATION_HTTP_DELAI_REESSAI", 0.2)
+
+
+def _ecarts(dates):
+    return [apres - avant for avant, apres in zip(dates, dates[1:])]
+
+
+def test_texte_du_flux_assemble(serveur, backend):
+    app = creer_app(latence=0, duree=0.05, mots=100)
+    http = backend(serveur(app))
+
+    morceaux = list(http.generer("Il était une fois"))
+
+    assert len(morceaux) > 1
+    assert "".join(morceaux) == app.state.textes[0]
+    assert "---RESUME---" in "".join(morceaux)
+    assert app.state.requetes == 1
+
+
+def test_reessai_sur_529_avec_attente_croissante(serveur, backend):
+    app = creer_app(latence=0, duree=0.01, mots=16, echecs=2)
+    http = backend(serveur(app))
+
+    texte = "".join(http.generer("prompt"))
+
+    assert texte == app.state.textes[0]
+    assert app.state.requetes == 3
+    assert http.stats["reessais"] == 2
+    # Délai de 0.2 s doublé à chaque tentative, multiplié par un facteur entre 0.5 et 1
+    premier, second = _ecarts(app.state.dates)
+    assert 0.1 <= premier < 0.4
+    assert 0.2 <= second < 0.6
+
+
+def test_abandon_apres_la_derniere_tentative(serveur, backend):
+    app = creer_app(latence=0, echecs=10)
+    http = backend(serveur(app), tentatives=3)
+
+    with pytest.raises(Exception, match="529"):
+        list(http.generer("prompt"))
+    assert app.state.requetes == 3
+    assert http.stats["erreurs"] == 1
+
+
+def test_retry_after_respecte(serveur, backend):
+    app = creer_app(latence=0, duree=0.01, mots=16, echecs=1, retry_after="1")
+    http = backend(serveur(app))
+
+    "".join(http.generer("prompt"))
+
+    assert app.state.requetes == 2
+    # Sans l'en-tête, la première attente serait d'au plus 0.2 s
+    assert _ecarts(app.state.dates)[0] >= 1.0
+
+
+def test_pas_de_reessai_apres_du_texte(serveur, backend):
+    app = creer_app(latence=0, duree=0.05, mots=80, erreur_apres=3)
+    http = backend(serveur(app))
+
+    recus = []
+    with pytest.raises(Exception, match="overloaded_error"):
+        for morceau in http.generer("prompt"):
+            recus.append(morceau)
+
+    assert "".join(recus) == app.state.textes[0]
+    assert app.state.requetes == 1
+    assert http.stats["reessais"] == 0
+
+
+def test_delai_de_generation_depasse(serveur, backend, monkeypatch):
+    monkeypatch.setattr(backends_generation, "TIMEOUT_GENERATION", 0.3)
+    app = creer_app(latence=5)
+    http = backend(serveur(app))
+
+    debut = time.monotonic()
+    with pytest.raises(Exception, match="trop de temps"):
+        list(http.generer("prompt"))
+    assert time.monotonic() - debut < 2
+    assert app.state.requetes == 1
+
+
+def test_annulation_par_le_client(serveur, backend):
+    app = creer_app(latence=0, duree=10, mots=400)
+    http = backend(serveur(app))
+
+    flux = http.generer("prompt")
+    assert next(flux)
+    flux.close()
+
+    # La requête est annulée : le serveur voit la connexion se fermer avant la fin du flux
+    limite = time.monotonic() + 5
+    while app.state.flux_interrompus == 0 and time.monotonic() < limite:
+        time.sleep(0.05)
+    assert app.state.flux_interrompus == 1
+    assert app.state.requetes == 1
+    assert http.stats["erreurs"] == 0
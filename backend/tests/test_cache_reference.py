@@ -0,0 +1,217 @@
+"""Cache des données de référence, sur les stockages memoire et redis-local"""
+import sys
+import asyncio
+import types
+
+import pytest
+from fastapi.testclient import TestClient
+
+import cache_reference
+import main
+from cache_reference import CacheReference, StockageMemoire, StockageRedis, RedisLocal, RedisLocalAsync
+from cache_reference import cle_livre
+
+STOCKAGES = ["memoire", "redis-local"]
+
+
+class Horloge:
+    def __init__(self):
+        self.maintenant = 1000.0
+
+    def monotonic(self) -> float:
+        return self.maintenant
+
+
+@pytest.fixture
+def horloge(monkeypatch):
+    instance = Horloge()
+    monkeypatch.setattr(cache_reference, "time", types.SimpleNamespace(monotonic=instance.monotonic))
+    return instance
+
+
+def _stockage(nom: str, taille_max: int = 100, ttl: int = 60):
+    if nom == "memoire":
+        return StockageMemoire(taille_max=taille_max, ttl=ttl)
+    local = RedisLocal()
+    return StockageRedis(local, RedisLocalAsync(local), ttl=ttl, nom=nom)
+
+
+class Chargeur:
+    """Valeur de la base simulée, et nombre de chargements"""
+
+    def __init__(self, valeur):
+        self.valeur = valeur
+        self.appels = 0
+
+    def __call__(self):
+        self.appels += 1
+        return self.valeur
+
+
+@pytest.mark.parametrize("nom", STOCKAGES)
+def test_succes_et_echecs_comptes(nom):
+    cache = CacheReference(_stockage(nom))
+    charger = Chargeur({"id": 1})
+
+    assert cache.obtenir("style:1", charger) == {"id": 1}
+    assert cache.obtenir("style:1", charger) == {"id": 1}
+    assert asyncio.run(cache.obtenir_async("style:1", _asynchrone(charger))) == {"id": 1}
+
+    assert charger.appels == 1
+    statistiques = cache.statistiques()
+    assert (statistiques["succes"], statistiques["echecs"]) == (2, 1)
+    assert statistiques["stockage"] == nom
+
+
+@pytest.mark.parametrize("nom", STOCKAGES)
+def test_ligne_absente_non_gardee(nom):
+    cache = CacheReference(_stockage(nom))
+    charger = Chargeur(None)
+
+    assert cache.obtenir("livre:404", charger) is None
+    assert cache.obtenir("livre:404", charger) is None
+    assert charger.appels == 2
+
+
+def test_eviction_lru():
+    # Deux entrées par clé (génération et valeur) : la troisième clé évince la moins récemment lue
+    stockage = _stockage("memoire", taille_max=5)
+    cache = CacheReference(stockage)
+    chargeurs = {cle: Chargeur(cle) for cle in ("a", "b", "c")}
+
+    cache.obtenir("a", chargeurs["a"])
+    cache.obtenir("b", chargeurs["b"])
+    cache.obtenir("a", chargeurs["a"])  # "a" devient la plus récente
+    cache.obtenir("c", chargeurs["c"])
+
+    assert stockage.evictions >= 1
+    cache.obtenir("a", chargeurs["a"])
+    cache.obtenir("b", chargeurs["b"])
+    assert chargeurs["a"].appels == 1
+    assert chargeurs["b"].appels == 2
+
+
+@pytest.mark.parametrize("nom", STOCKAGES)
+def test_expiration(nom, horloge):
+    cache = CacheReference(_stockage(nom, ttl=60))
+    charger = Chargeur({"id": 1})
+
+    cache.obtenir("style:1", charger)
+    horloge.maintenant += 59
+    cache.obtenir("style:1", charger)
+    assert charger.appels == 1
+
+    horloge.maintenant += 2
+    cache.obtenir("style:1", charger)
+    assert charger.appels == 2
+
+
+@pytest.mark.parametrize("nom", STOCKAGES)
+def test_invalidation(nom):
+    cache = CacheReference(_stockage(nom))
+    charger = Chargeur({"titre": "Avant"})
+    cache.obtenir(cle_livre(1), charger)
+
+    charger.valeur = {"titre": "Après"}
+    cache.invalider_livres([1])
+
+    assert cache.obtenir(cle_livre(1), charger) == {"titre": "Après"}
+    assert cache.stats["invalidations"] == 1
+
+
+@pytest.mark.parametrize("nom", STOCKAGES)
+def test_chargement_tardif_ne_recouvre_pas_l_invalidation(nom):
+    cache = CacheReference(_stockage(nom))
+
+    def charger_pendant_une_modification():
+        # Lecture de la base avant la modification, invalidation avant la fin du chargement
+        ancienne = {"titre": "Avant"}
+        cache.invalider_livres([1])
+        return ancienne
+
+    assert cache.obtenir(cle_livre(1), charger_pendant_une_modification) == {"titre": "Avant"}
+    assert cache.obtenir(cle_livre(1), Chargeur({"titre": "Après"})) == {"titre": "Après"}
+
+
+@pytest.mark.parametrize("nom", STOCKAGES)
+def test_chargement_tardif_asynchrone(nom):
+    cache = CacheReference(_stockage(nom))
+
+    async def scenario():
+        async def charger_pendant_une_modification():
+            await cache.invalider_async(cle_livre(1))
+            return {"titre": "Avant"}
+
+        await cache.obtenir_async(cle_livre(1), charger_pendant_une_modification)
+        return await cache.obtenir_async(cle_livre(1), _asynchrone(Chargeur({"titre": "Après"})))
+
+    assert asyncio.run(scenario()) == {"titre": "Après"}
+
+
+def test_redis_absent_nomme_le_paquet(monkeypatch):
+    monkeypatch.setitem(sys.modules, "redis", None)
+    with pytest.raises(RuntimeError, match="redis"):
+        cache_reference.creer_stockage("redis")
+
+
+def _asynchrone(charger):
+    async def charger_async():
+        return charger()
+    return charger_async
+
+
+# ==================== Invalidation par les routes ====================
+
+@pytest.fixture(params=STOCKAGES)
+def client(request, monkeypatch):
+    cache = CacheReference(_stockage(request.param))
+    monkeypatch.setattr(main, "cache_reference", cache)
+    with TestClient(main.app) as instance:
+        instance.cache = cache
+        yield instance
+
+
+def _noms_styles(client):
+    return {style["nom"] for style in client.get("/styles").json()}
+
+
+def test_creer_et_supprimer_style(client):
+    assert "Onirique" not in _noms_styles(client)
+
+    style = client.post("/styles", json={"nom": "Onirique", "description": "Rêveur"}).json()
+    assert "Onirique" in _noms_styles(client)
+
+    livre = client.post("/livres", json={"titre": "Songes", "style_id": style["id"]}).json()
+    assert client.get(f"/livres/{livre['id']}").json()["style_id"] == style["id"]
+
+    assert client.delete(f"/styles/{style['id']}").status_code == 200
+    assert "Onirique" not in _noms_styles(client)
+    # Le livre, gardé dans le cache avec son style, est relu sans lui
+    relu = client.get(f"/livres/{livre['id']}").json()
+    assert relu["style_id"] is None
+    assert relu["style"] is None
+    client.delete(f"/livres/{livre['id']}")
+
+
+def test_creer_et_supprimer_livre(client):
+    livre = client.post("/livres", json={"titre": "Premier"}).json()
+    assert client.get(f"/livres/{livre['id']}").json()["titre"] == "Premier"
+
+    assert client.delete(f"/livres/{livre['id']}").status_code == 200
+    assert client.get(f"/livres/{livre['id']}").status_code == 404
+
+    # SQLite réattribue l'id du dernier livre supprimé : le nouveau livre ne doit pas hériter d'une entrée
+    client.cache.obtenir(cle_livre(livre["id"]), lambda: {**livre, "titre": "Périmé"})
+    nouveau = client.post("/livres", json={"titre": "Second"}).json()
+    assert nouveau["id"] == livre["id"]
+    assert client.get(f"/livres/{nouveau['id']}").json()["titre"] == "Second"
+    client.delete(f"/livres/{nouveau['id']}")
+
+
+def test_liste_des_styles_servie_par_le_cache(client):
+    client.get("/styles")
+    avant = dict(client.cache.stats)
+    client.get("/styles")
+
+    assert client.cache.stats["succes"] == avant["succes"] + 1
+    assert client.cache.stats["echecs"] == avant["echecs"]
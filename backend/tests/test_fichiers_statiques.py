@@ -0,0 +1,39 @@
+"""Choix de la variante précompressée selon Accept-Encoding"""
+import pytest
+from starlette.requests import Request
+
+from fichiers_statiques import Fichier, choisir_encodage
+
+
+@pytest.fixture
+def fichier(tmp_path):
+    chemin = tmp_path / "app.js"
+    for suffixe in ("", ".br", ".gz"):
+        (tmp_path / f"app.js{suffixe}").write_bytes(b"x")
+    return Fichier(str(chemin), "assets/app.js")
+
+
+def _requete(accept_encoding: str) -> Request:
+    return Request({"type": "http", "headers": [(b"accept-encoding", accept_encoding.encode())]})
+
+
+@pytest.mark.parametrize("entete, attendu", [
+    ("gzip, deflate, br", "br"),
+    ("gzip;q=1.0, br;q=0.5", "gzip"),
+    ("br;q=0.8, gzip;q=0.8", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("gzip;q=0.5, identity", ""),
+    ("gzip;q=0.5", "gzip"),
+    ("*", "br"),
+    ("*;q=0.5, br;q=0.1", "gzip"),
+    ("deflate", ""),
+    ("", ""),
+])
+def test_variante_de_plus_grand_poids(fichier, entete, attendu):
+    assert choisir_encodage(fichier, _requete(entete)) == attendu
+
+
+def test_variante_absente_ignoree(fichier, tmp_path):
+    (tmp_path / "app.js.br").unlink()
+    sans_br = Fichier(fichier.chemin, "assets/app.js")
+    assert choisir_encodage(sans_br, _requete("br;q=1, gzip;q=0.2")) == "gzip"
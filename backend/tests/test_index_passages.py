@@ -0,0 +1,36 @@
+"""Noms propres des prompts et filtre des passages de l'index BM25"""
+from datetime import datetime
+
+from index_passages import IndexLivre, entites
+
+
+def test_majuscule_de_debut_de_phrase_ignoree():
+    assert entites("Soudain, Marie entre dans la forêt. Ensuite elle retrouve Paul.") == {"marie", "paul"}
+
+
+def test_debut_de_phrase_retenu_si_nom_ailleurs_dans_le_texte():
+    assert entites("Marie se cache. Le loup cherche Marie.") == {"marie"}
+
+
+def test_debut_de_phrase_retenu_si_nom_connu():
+    assert entites("Marie arrive au château.") == set()
+    assert entites("Marie arrive au château.", connus={"marie"}) == {"marie"}
+
+
+def test_replique_et_apostrophe():
+    # Majuscule d'une réplique : de position ; après une apostrophe : nom propre
+    assert entites("Il dit : « Viens voir l'Ogre. »") == {"ogre"}
+
+
+def test_recherche_filtree_par_les_noms_du_livre():
+    index = IndexLivre()
+    maintenant = datetime.utcnow()
+    index.ajouter(1, 10, "Dans la clairière, Marie trouve une clé dorée.", maintenant)
+    index.ajouter(2, 10, "Soudain la clé dorée brille au fond du puits.", maintenant)
+
+    # "Marie", en début de prompt, est reconnue par le livre ; "Soudain" ne filtre rien
+    assert [contenu for _, contenu, _, _ in index.rechercher("Marie cherche la clé dorée", {10}, 5)] == [1]
+    assert {contenu for _, contenu, _, _ in index.rechercher("Soudain, une clé dorée", {10}, 5)} == {1, 2}
+
+    index.retirer(1)
+    assert "marie" not in index.noms
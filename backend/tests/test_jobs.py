@@ -0,0 +1,112 @@
+"""File de jobs : refus du disjoncteur, reprise des jobs en attente d'un processus arrêté"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import jobs
+from admission import ControleurAdmission
+from migrations import migrer
+from models import Livre, Chapitre, Contenu, JobGeneration
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    migrer(engine)
+    sessions = sessionmaker(bind=engine, autoflush=False)
+    with sessions() as db:
+        livre = Livre(titre="Livre")
+        db.add(livre)
+        db.flush()
+        db.add(Chapitre(id=1, livre_id=livre.id, titre="Chapitre", ordre=1))
+        db.commit()
+
+    monkeypatch.setattr(jobs, "SessionLocal", sessions)
+    # Battement déclenché à la main par les tests
+    monkeypatch.setattr(jobs, "_demarrer_battement", lambda: None)
+    yield sessions
+    engine.dispose()
+
+
+@pytest.fixture
+def generations(monkeypatch):
+    """Générations effectuées ; chacune enregistre un contenu comme generer_pour_chapitre"""
+    appels = []
+
+    def generer(db, chapitre, prompt, niveau, avant_commit=None):
+        appels.append(prompt)
+        contenu = Contenu(chapitre_id=chapitre.id, texte_utilisateur=prompt, texte_genere="Texte")
+        db.add(contenu)
+        db.flush()
+        avant_commit(contenu)
+        db.commit()
+        return contenu
+
+    monkeypatch.setattr(jobs, "generer_pour_chapitre", generer)
+    return appels
+
+
+def _attendre(job_id: int, delai: float = 10):
+    with jobs._verrou:
+        evenement = jobs._evenements.get(job_id)
+    if evenement is not None:
+        assert evenement.wait(delai)
+
+
+def _job(sessions, job_id: int) -> JobGeneration:
+    with sessions() as db:
+        return db.get(JobGeneration, job_id)
+
+
+def test_job_refuse_par_le_disjoncteur_remis_en_attente(base, generations, monkeypatch):
+    controleur = ControleurAdmission()
+    controleur.disjoncteur.delai = 0.5
+    for _ in range(controleur.disjoncteur.seuil):
+        controleur.disjoncteur.enregistrer(False)
+    monkeypatch.setattr(jobs, "admission", controleur)
+
+    with base() as db:
+        job_id = jobs.soumettre_job(db, 1, "Il était une fois", None).id
+
+    # Refusé : en attente au nom de ce processus, sans avoir été exécuté ni marqué en échec
+    with jobs._verrou:
+        assert job_id in jobs._evenements
+    job = _job(base, job_id)
+    assert job.statut in ("en_attente", "en_cours")
+    assert job.erreur is None
+
+    # Réessayé après le Retry-After : le disjoncteur semi-ouvert admet la génération d'essai
+    _attendre(job_id)
+    job = _job(base, job_id)
+    assert job.statut == "termine"
+    assert job.contenu_id is not None
+    assert generations == ["Il était une fois"]
+
+
+def test_battement_prend_les_jobs_en_attente_abandonnes(base, generations):
+    expire = datetime.utcnow() - timedelta(seconds=jobs.JOB_BAIL_SECONDES + 1)
+    with base() as db:
+        sans_proprietaire = JobGeneration(chapitre_id=1, prompt="a", statut="en_attente")
+        bail_expire = JobGeneration(chapitre_id=1, prompt="b", statut="en_attente",
+                                    proprietaire="autre:1:x", date_battement=expire)
+        bail_valide = JobGeneration(chapitre_id=1, prompt="c", statut="en_attente",
+                                    proprietaire="autre:2:y", date_battement=datetime.utcnow())
+        db.add_all([sans_proprietaire, bail_expire, bail_valide])
+        db.commit()
+        ids = [sans_proprietaire.id, bail_expire.id, bail_valide.id]
+
+        assert jobs._jobs_a_prendre(db) == ids[:2]
+
+    for job_id in ids[:2]:
+        jobs._planifier(job_id)
+    for job_id in ids[:2]:
+        _attendre(job_id)
+
+    assert [_job(base, job_id).statut for job_id in ids] == ["termine", "termine", "en_attente"]
+    # Le job d'un processus actif n'est pas pris, même planifié ici
+    jobs._planifier(ids[2])
+    _attendre(ids[2])
+    assert _job(base, ids[2]).statut == "en_attente"
+    assert sorted(generations) == ["a", "b"]
@@ -0,0 +1,138 @@
+"""Migrations : mise à niveau d'une base au schéma d'origine (create_all du commit initial)"""
+import pytest
+from sqlalchemy import create_engine, inspect
+
+import migrations
+from migrations import migrer, VERSION_SCHEMA
+
+# Schéma de la base avant jobs, résumés, versions et migrations (ordre encore facultatif)
+SCHEMA_ORIGINE = [
+    """CREATE TABLE styles (
+        id INTEGER NOT NULL, nom VARCHAR(100) NOT NULL, description TEXT NOT NULL,
+        est_predefini BOOLEAN, date_creation DATETIME, PRIMARY KEY (id), UNIQUE (nom)
+    )""",
+    "CREATE INDEX ix_styles_id ON styles (id)",
+    """CREATE TABLE livres (
+        id INTEGER NOT NULL, titre VARCHAR(255) NOT NULL, description TEXT, style_id INTEGER,
+        date_creation DATETIME, PRIMARY KEY (id), FOREIGN KEY(style_id) REFERENCES styles (id)
+    )""",
+    "CREATE INDEX ix_livres_id ON livres (id)",
+    """CREATE TABLE chapitres (
+        id INTEGER NOT NULL, livre_id INTEGER NOT NULL, titre VARCHAR(255) NOT NULL, ordre INTEGER,
+        date_creation DATETIME, PRIMARY KEY (id), FOREIGN KEY(livre_id) REFERENCES livres (id)
+    )""",
+    "CREATE INDEX ix_chapitres_id ON chapitres (id)",
+    """CREATE TABLE contenus (
+        id INTEGER NOT NULL, chapitre_id INTEGER NOT NULL, texte_utilisateur TEXT, texte_genere TEXT,
+        resume TEXT, niveau_strictesse VARCHAR(20), date_creation DATETIME, PRIMARY KEY (id),
+        FOREIGN KEY(chapitre_id) REFERENCES chapitres (id)
+    )""",
+    "CREATE INDEX ix_contenus_id ON contenus (id)",
+]
+
+DONNEES_ORIGINE = [
+    "INSERT INTO styles (id, nom, description, est_predefini) VALUES (1, 'Conte', 'Il était une fois', 1)",
+    "INSERT INTO livres (id, titre, style_id) VALUES (1, 'La forêt', 1)",
+    "INSERT INTO livres (id, titre, style_id) VALUES (2, 'Sans style', 99)",
+    "INSERT INTO chapitres (id, livre_id, titre, ordre) VALUES (1, 1, 'Le départ', 1)",
+    "INSERT INTO chapitres (id, livre_id, titre, ordre) VALUES (2, 1, 'Le retour', 2)",
+    "INSERT INTO chapitres (id, livre_id, titre, ordre) VALUES (3, 1, 'Prologue', NULL)",
+    "INSERT INTO chapitres (id, livre_id, titre, ordre) VALUES (4, 99, 'Orphelin', 1)",
+    "INSERT INTO contenus (id, chapitre_id, texte_genere, resume) VALUES (1, 1, 'Le renard traverse la clairière', 'Départ')",
+    "INSERT INTO contenus (id, chapitre_id, texte_genere) VALUES (2, 4, 'Contenu d''un chapitre orphelin')",
+]
+
+
+def _moteur(chemin):
+    return create_engine(f"sqlite:///{chemin}")
+
+
+def _schema(engine):
+    """Colonnes, index et clés étrangères de chaque table, indépendamment de la mise en forme du DDL"""
+    inspecteur = inspect(engine)
+    return {
+        table: (
+            [(c["name"], str(c["type"]), c["nullable"]) for c in inspecteur.get_columns(table)],
+            sorted((i["name"], tuple(i["column_names"])) for i in inspecteur.get_indexes(table)),
+            sorted(
+                (tuple(fk["constrained_columns"]), fk["referred_table"], fk["options"].get("ondelete"))
+                for fk in inspecteur.get_foreign_keys(table)
+            ),
+        )
+        for table in inspecteur.get_table_names()
+        if not table.startswith("recherche")
+    }
+
+
+@pytest.fixture
+def base_origine(tmp_path):
+    engine = _moteur(tmp_path / "origine.db")
+    with engine.begin() as connection:
+        for sql in SCHEMA_ORIGINE + DONNEES_ORIGINE:
+            connection.exec_driver_sql(sql)
+    yield engine
+    engine.dispose()
+
+
+def test_base_origine_mise_a_niveau(base_origine):
+    migrer(base_origine)
+
+    with base_origine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA user_version").scalar() == VERSION_SCHEMA
+        chapitres = connection.exec_driver_sql("SELECT id, ordre FROM chapitres ORDER BY ordre, id").fetchall()
+        # Le chapitre sans ordre, trié en tête jusqu'ici, reste en tête ; l'orphelin est supprimé
+        assert chapitres == [(3, 0), (1, 1), (2, 2)]
+        assert connection.exec_driver_sql("SELECT id FROM contenus").scalars().all() == [1]
+        assert connection.exec_driver_sql("SELECT style_id FROM livres ORDER BY id").scalars().all() == [1, None]
+        assert connection.exec_driver_sql("PRAGMA foreign_key_check").fetchall() == []
+
+
+def test_base_origine_identique_a_une_base_neuve(base_origine, tmp_path):
+    migrer(base_origine)
+    neuve = _moteur(tmp_path / "neuve.db")
+    migrer(neuve)
+
+    assert _schema(base_origine) == _schema(neuve)
+    neuve.dispose()
+
+
+def test_recherche_suit_les_tables_reconstruites(base_origine):
+    migrer(base_origine)
+
+    with base_origine.begin() as connection:
+        connection.exec_driver_sql("INSERT INTO chapitres (id, livre_id, titre, ordre) VALUES (10, 1, 'Épilogue', 3)")
+        connection.exec_driver_sql("UPDATE contenus SET texte_genere = 'Le hibou veille' WHERE id = 1")
+        trouves = connection.exec_driver_sql(
+            "SELECT rowid FROM recherche WHERE recherche MATCH ? ORDER BY rowid", ("epilogue OR hibou OR renard",)
+        ).scalars().all()
+
+    # Ajout indexé, texte remplacé réindexé (le renard n'est plus trouvé)
+    assert trouves == [1 * 4 + 3, 10 * 4 + 2]
+
+
+def test_migration_sautee_si_deja_appliquee(base_origine):
+    migrer(base_origine)
+    migrer(base_origine)
+
+    with base_origine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA user_version").scalar() == VERSION_SCHEMA
+
+
+def test_ddl_des_migrations_independant_des_modeles():
+    # Les migrations ne lisent pas models.py : une colonne ajoutée au modèle n'y apparaît pas
+    assert "proprietaire" not in migrations._TABLES_V2["jobs_generation"]
+    assert "ordre INTEGER," in migrations._TABLES_V2["chapitres"]
+
+
+def test_bail_des_jobs_sur_colonnes_deja_presentes(tmp_path):
+    # Table jobs_generation créée par create_all avec le modèle actuel, base restée en v3
+    engine = _moteur(tmp_path / "v3.db")
+    migrer(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("PRAGMA user_version=3")
+
+    migrer(engine)
+
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA user_version").scalar() == VERSION_SCHEMA
+    engine.dispose()
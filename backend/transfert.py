@@ -0,0 +1,372 @@
+"""
+Import et export de la bibliothèque (styles, livres, chapitres, contenus) en NDJSON.
+
+Une ligne JSON par enregistrement, dans l'ordre des dépendances : une ligne d'en-tête,
+les styles, les livres, les chapitres puis les contenus, chacun avec son id d'origine,
+par exemple :
+    {"type": "livre", "id": 3, "titre": "...", "description": null, "style_id": 1, "date_creation": "..."}
+
+L'export est lu par curseur côté serveur, table par table. L'import insère par lots
+(executemany, avec RETURNING pour les lignes dont il faut connaître le nouvel id) et
+valide chaque lot dans sa propre transaction : les ids d'origine sont remplacés par ceux
+attribués par la base de destination, les styles sont rapprochés par nom. Un import
+interrompu par une erreur garde les lots déjà validés.
+
+Les mêmes fonctions servent aux routes /bibliotheque/export et /bibliotheque/import et
+à la ligne de commande, pour passer d'une base à l'autre (volume Docker, développement,
+/tmp sur Vercel) :
+
+Usage (depuis backend/) :
+    DATABASE_PATH=source.db python transfert.py export [--livre 3 --livre 5] [--sortie bibliotheque.ndjson]
+    DATABASE_PATH=cible.db python transfert.py import bibliotheque.ndjson [--lot 2000]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from models import Style, Livre, Chapitre, Contenu
+from versions import incrementer_versions
+
+# Enregistrements écrits par transaction lors d'un import
+IMPORT_LOT = int(os.environ.get("IMPORT_LOT", "2000"))
+# Lignes lues à la fois par le curseur d'export
+EXPORT_LIGNES_PAR_LOT = 500
+# Taille des morceaux envoyés par l'export (octets)
+EXPORT_TAILLE_MORCEAU = 64 * 1024
+
+FORMAT = "les-histoires-de-rebecca"
+VERSION_FORMAT = 1
+
+# Type de ligne -> (modèle, colonnes exportées, id compris)
+TABLES = {
+    "style": (Style, ("id", "nom", "description", "est_predefini", "date_creation")),
+    "livre": (Livre, ("id", "titre", "description", "style_id", "date_creation")),
+    "chapitre": (Chapitre, ("id", "livre_id", "titre", "ordre", "date_creation")),
+    "contenu": (Contenu, ("id", "chapitre_id", "texte_utilisateur", "texte_genere", "resume",
+                          "niveau_strictesse", "date_creation")),
+}
+
+
+class ErreurImport(ValueError):
+    pass
+
+
+# ==================== EXPORT ====================
+
+def requetes_export(livre_ids: Optional[List[int]] = None) -> List[Tuple[str, object]]:
+    """Une requête par type, dans l'ordre des dépendances ; tous les styles, les livres demandés (tous par défaut)"""
+    requetes = []
+    for type_, (modele, colonnes) in TABLES.items():
+        requete = select(*(getattr(modele, colonne) for colonne in colonnes)).order_by(modele.id)
+        if livre_ids is not None:
+            if modele is Livre:
+                requete = requete.where(Livre.id.in_(livre_ids))
+            elif modele is Chapitre:
+                requete = requete.where(Chapitre.livre_id.in_(livre_ids))
+            elif modele is Contenu:
+                requete = requete.join(Chapitre, Chapitre.id == Contenu.chapitre_id).where(
+                    Chapitre.livre_id.in_(livre_ids))
+        requetes.append((type_, requete.execution_options(yield_per=EXPORT_LIGNES_PAR_LOT)))
+    return requetes
+
+
+def _en_json(valeur):
+    if isinstance(valeur, datetime):
+        return valeur.isoformat()
+    raise TypeError(f"Type non sérialisable: {type(valeur).__name__}")
+
+
+def ligne_ndjson(objet: Dict) -> str:
+    return json.dumps(objet, ensure_ascii=False, default=_en_json) + "\n"
+
+
+def entete() -> Dict:
+    return {"type": "entete", "format": FORMAT, "version": VERSION_FORMAT,
+            "date": datetime.utcnow().isoformat()}
+
+
+class Regroupeur:
+    """Regroupe les lignes en morceaux d'environ EXPORT_TAILLE_MORCEAU octets, et les compte"""
+
+    def __init__(self):
+        self._morceau: List[bytes] = []
+        self._taille = 0
+        self.lignes = 0
+        self.debut = time.perf_counter()
+
+    def ajouter(self, ligne: str) -> Optional[bytes]:
+        donnees = ligne.encode("utf-8")
+        self._morceau.append(donnees)
+        self._taille += len(donnees)
+        self.lignes += 1
+        if self._taille >= EXPORT_TAILLE_MORCEAU:
+            return self.vider()
+        return None
+
+    def vider(self) -> bytes:
+        morceau = b"".join(self._morceau)
+        self._morceau, self._taille = [], 0
+        return morceau
+
+    def bilan(self) -> Dict:
+        duree = time.perf_counter() - self.debut
+        return {"lignes": self.lignes, "duree_s": round(duree, 3),
+                "lignes_par_seconde": round(self.lignes / duree) if duree else None}
+
+
+def exporter(connexion: Connection, livre_ids: Optional[List[int]] = None,
+             regroupeur: Optional[Regroupeur] = None) -> Iterator[bytes]:
+    regroupeur = regroupeur or Regroupeur()
+    regroupeur.ajouter(ligne_ndjson(entete()))
+    for type_, requete in requetes_export(livre_ids):
+        for ligne in connexion.execute(requete).mappings():
+            morceau = regroupeur.ajouter(ligne_ndjson({"type": type_, **ligne}))
+            if morceau:
+                yield morceau
+    yield regroupeur.vider()
+
+
+async def exporter_async(moteur: AsyncEngine, livre_ids: Optional[List[int]] = None,
+                         regroupeur: Optional[Regroupeur] = None) -> AsyncIterator[bytes]:
+    """exporter() sur le moteur asynchrone, sur une connexion propre au flux"""
+    regroupeur = regroupeur or Regroupeur()
+    regroupeur.ajouter(ligne_ndjson(entete()))
+    async with moteur.connect() as connexion:
+        for type_, requete in requetes_export(livre_ids):
+            resultat = await connexion.stream(requete)
+            async for ligne in resultat.mappings():
+                morceau = regroupeur.ajouter(ligne_ndjson({"type": type_, **ligne}))
+                if morceau:
+                    yield morceau
+    yield regroupeur.vider()
+
+
+# ==================== IMPORT ====================
+
+def _date(valeur: Optional[str]) -> datetime:
+    return datetime.fromisoformat(valeur) if valeur else datetime.utcnow()
+
+
+class Importeur:
+    """
+    Accumule les enregistrements lus (ajouter) et les écrit par lots (vider), en
+    remplaçant les ids d'origine par les nouveaux. Un enregistrement ne peut référencer
+    qu'un parent déjà lu : l'ordre de l'export.
+    """
+
+    def __init__(self, taille_lot: int = IMPORT_LOT):
+        self.taille_lot = taille_lot
+        # Id d'origine -> id dans la base de destination
+        self._ids: Dict[str, Dict[int, int]] = {"style": {}, "livre": {}, "chapitre": {}}
+        self._attente: Dict[str, List[Tuple[int, Dict]]] = {type_: [] for type_ in TABLES}
+        self.comptes = {type_: 0 for type_ in TABLES}
+        self.ecrites = 0
+        self.debut = time.perf_counter()
+
+    def ajouter(self, brut: bytes, numero: int):
+        """Lit une ligne NDJSON ; les lignes vides sont ignorées"""
+        if not brut.strip():
+            return
+        try:
+            objet = json.loads(brut)
+        except ValueError as e:
+            raise ErreurImport(f"Ligne {numero}: JSON invalide ({e})")
+        type_ = objet.get("type") if isinstance(objet, dict) else None
+        if type_ == "entete":
+            if objet.get("format") != FORMAT or objet.get("version", 0) > VERSION_FORMAT:
+                raise ErreurImport(f"Ligne {numero}: format non pris en charge")
+            return
+        if type_ not in TABLES:
+            raise ErreurImport(f"Ligne {numero}: type inconnu {type_!r}")
+        if not isinstance(objet.get("id"), int):
+            raise ErreurImport(f"Ligne {numero}: id manquant")
+        self._attente[type_].append((numero, objet))
+
+    def plein(self) -> bool:
+        return sum(len(lignes) for lignes in self._attente.values()) >= self.taille_lot
+
+    def _parent(self, type_parent: str, ancien_id: Optional[int], numero: int) -> int:
+        try:
+            return self._ids[type_parent][ancien_id]
+        except KeyError:
+            raise ErreurImport(f"Ligne {numero}: {type_parent} {ancien_id} absent des lignes précédentes")
+
+    def _inserer(self, connexion: Connection, type_: str, lignes: List[Dict], ancien_ids: List[int]):
+        """Insère les lignes par lot et retient leurs nouveaux ids, dans l'ordre des paramètres"""
+        modele = TABLES[type_][0]
+        nouveaux = connexion.execute(
+            insert(modele).returning(modele.id, sort_by_parameter_order=True), lignes
+        ).scalars().all()
+        self._ids[type_].update(zip(ancien_ids, nouveaux))
+
+    def vider(self, connexion: Connection):
+        """Écrit les enregistrements en attente dans la transaction de `connexion` (validée par l'appelant)"""
+        attente = self._attente
+        self._attente = {type_: [] for type_ in TABLES}
+        try:
+            self._ecrire(connexion, attente)
+        except ErreurImport:
+            raise
+        except (KeyError, TypeError, ValueError, IntegrityError) as e:
+            raise ErreurImport(f"Enregistrement invalide: {e.orig if isinstance(e, IntegrityError) else e!r}")
+        for type_, lignes in attente.items():
+            self.comptes[type_] += len(lignes)
+            self.ecrites += len(lignes)
+
+    def _ecrire(self, connexion: Connection, attente: Dict[str, List[Tuple[int, Dict]]]):
+        if attente["style"]:
+            # Rapprochés par nom : les styles prédéfinis existent déjà dans toute base
+            styles = {objet["nom"]: objet for _, objet in attente["style"]}
+            connexion.execute(insert(Style).on_conflict_do_nothing(index_elements=[Style.nom]), [
+                {"nom": nom, "description": objet["description"], "est_predefini": bool(objet.get("est_predefini")),
+                 "date_creation": _date(objet.get("date_creation"))}
+                for nom, objet in styles.items()
+            ])
+            ids = dict(connexion.execute(select(Style.nom, Style.id).where(Style.nom.in_(list(styles)))).all())
+            for _, objet in attente["style"]:
+                self._ids["style"][objet["id"]] = ids[objet["nom"]]
+
+        if attente["livre"]:
+            self._inserer(connexion, "livre", [
+                {"titre": objet["titre"], "description": objet.get("description"),
+                 "style_id": self._parent("style", objet["style_id"], numero) if objet.get("style_id") is not None else None,
+                 "date_creation": _date(objet.get("date_creation"))}
+                for numero, objet in attente["livre"]
+            ], [objet["id"] for _, objet in attente["livre"]])
+
+        livres_modifies = set()
+        if attente["chapitre"]:
+            lignes = [
+                {"livre_id": self._parent("livre", objet["livre_id"], numero), "titre": objet["titre"],
+                 "ordre": 1 if objet.get("ordre") is None else objet["ordre"], "date_creation": _date(objet.get("date_creation"))}
+                for numero, objet in attente["chapitre"]
+            ]
+            livres_modifies.update(ligne["livre_id"] for ligne in lignes)
+            self._inserer(connexion, "chapitre", lignes, [objet["id"] for _, objet in attente["chapitre"]])
+
+        if attente["contenu"]:
+            # Aucun enregistrement ne référence un contenu : simple executemany, sans RETURNING
+            lignes = [
+                {"chapitre_id": self._parent("chapitre", objet["chapitre_id"], numero),
+                 "texte_utilisateur": objet.get("texte_utilisateur"), "texte_genere": objet.get("texte_genere"),
+                 "resume": objet.get("resume"), "niveau_strictesse": objet.get("niveau_strictesse"),
+                 "date_creation": _date(objet.get("date_creation"))}
+                for numero, objet in attente["contenu"]
+            ]
+            connexion.execute(insert(Contenu), lignes)
+            livres_modifies.update(connexion.execute(
+                select(Chapitre.livre_id).where(Chapitre.id.in_({ligne["chapitre_id"] for ligne in lignes}))
+            ).scalars())
+
+        # Les insertions en masse ne passent pas par les événements ORM de versions.py
+        incrementer_versions(connexion, livres_modifies)
+
+    def bilan(self) -> Dict:
+        duree = time.perf_counter() - self.debut
+        return {"lignes": dict(self.comptes), "total": self.ecrites, "duree_s": round(duree, 3),
+                "lignes_par_seconde": round(self.ecrites / duree) if duree else None}
+
+    def importer(self, connexion: Connection, lignes: Iterable[bytes]):
+        for numero, brut in enumerate(lignes, 1):
+            self.ajouter(brut, numero)
+            if self.plein():
+                self.vider(connexion)
+                connexion.commit()
+        self.vider(connexion)
+        connexion.commit()
+
+    async def importer_async(self, moteur: AsyncEngine, lignes: AsyncIterator[bytes]):
+        """importer() sur le moteur asynchrone : les lots sont écrits par run_sync"""
+        async with moteur.connect() as connexion:
+            numero = 0
+            async for brut in lignes:
+                numero += 1
+                self.ajouter(brut, numero)
+                if self.plein():
+                    await connexion.run_sync(self.vider)
+                    await connexion.commit()
+            await connexion.run_sync(self.vider)
+            await connexion.commit()
+
+
+async def lignes_flux(morceaux: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Découpe un flux d'octets (corps de requête) en lignes"""
+    reste = b""
+    async for morceau in morceaux:
+        reste += morceau
+        *lignes, reste = reste.split(b"\n")
+        for ligne in lignes:
+            yield ligne
+    if reste:
+        yield reste
+
+
+# ==================== LIGNE DE COMMANDE ====================
+
+def _afficher_bilan(operation: str, bilan: Dict):
+    print(f"{operation} : {json.dumps(bilan, ensure_ascii=False)}", file=sys.stderr)
+
+
+def commande_export(moteur: Engine, livre_ids: Optional[List[int]], sortie: Optional[str]):
+    regroupeur = Regroupeur()
+    fichier = open(sortie, "wb") if sortie else sys.stdout.buffer
+    try:
+        with moteur.connect() as connexion:
+            for morceau in exporter(connexion, livre_ids, regroupeur):
+                fichier.write(morceau)
+    finally:
+        if sortie:
+            fichier.close()
+    _afficher_bilan("Export", regroupeur.bilan())
+
+
+def commande_import(moteur: Engine, entree: str, taille_lot: int):
+    from migrations import migrer
+
+    migrer(moteur)
+    importeur = Importeur(taille_lot)
+    fichier = open(entree, "rb") if entree != "-" else sys.stdin.buffer
+    try:
+        with moteur.connect() as connexion:
+            importeur.importer(connexion, fichier)
+    except ErreurImport as e:
+        print(f"Erreur : {e} ({importeur.ecrites} enregistrements importés avant l'erreur)", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if entree != "-":
+            fichier.close()
+    _afficher_bilan("Import", importeur.bilan())
+
+
+def main():
+    from database import DATABASE_URL, engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commandes = parser.add_subparsers(dest="commande", required=True)
+    export = commandes.add_parser("export", help="écrit la bibliothèque en NDJSON")
+    export.add_argument("--livre", type=int, action="append", help="id d'un livre à exporter (répétable, tous par défaut)")
+    export.add_argument("--sortie", help="fichier de sortie (sortie standard par défaut)")
+    import_ = commandes.add_parser("import", help="ajoute les enregistrements d'un fichier NDJSON à la base")
+    import_.add_argument("fichier", help="fichier NDJSON (- pour l'entrée standard)")
+    import_.add_argument("--lot", type=int, default=IMPORT_LOT, help="enregistrements par transaction")
+    args = parser.parse_args()
+
+    print(f"Base de données : {DATABASE_URL}", file=sys.stderr)
+    if args.commande == "export":
+        commande_export(engine, args.livre, args.sortie)
+    else:
+        commande_import(engine, args.fichier, args.lot)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+from typing import Iterable
+
+from sqlalchemy import event, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from models import Chapitre, Contenu, VersionLivre
+
+
+def incrementer_version(connection: Connection, livre_id: int):
+    """Incrémente le compteur du livre dans la transaction en cours"""
+    connection.execute(
+        insert(VersionLivre)
+        .values(livre_id=livre_id, version=1)
+        .on_conflict_do_update(
+            index_elements=[VersionLivre.livre_id],
+            set_={"version": VersionLivre.version + 1}
+        )
+    )
+
+
+def incrementer_versions(connection: Connection, livre_ids: Iterable[int]):
+    """incrementer_version pour plusieurs livres, en une seule requête exécutée par lot (executemany)"""
+    parametres = [{"livre_id": livre_id, "version": 1} for livre_id in set(livre_ids)]
+    if not parametres:
+        return
+    connection.execute(
+        insert(VersionLivre).on_conflict_do_update(
+            index_elements=[VersionLivre.livre_id],
+            set_={"version": VersionLivre.version + 1}
+        ),
+        parametres
+    )
+
+
+def version_livre(db: Session, livre_id: int) -> int:
+    """Version courante du livre (0 si jamais modifié)"""
+    version = db.query(VersionLivre.version).filter(VersionLivre.livre_id == livre_id).scalar()
+    return version or 0
+
+
+# Les écritures ORM sur les chapitres et contenus incrémentent la version de leur livre
+# dans la même transaction. Les requêtes UPDATE/DELETE en masse doivent appeler
+# incrementer_version elles-mêmes.
+
+@event.listens_for(Chapitre, "after_insert")
+@event.listens_for(Chapitre, "after_update")
+@event.listens_for(Chapitre, "after_delete")
+def _chapitre_modifie(mapper, connection, chapitre):
+    incrementer_version(connection, chapitre.livre_id)
+
+
+@event.listens_for(Contenu, "after_insert")
+@event.listens_for(Contenu, "after_update")
+@event.listens_for(Contenu, "after_delete")
+def _contenu_modifie(mapper, connection, contenu):
+    # Lors d'une suppression en cascade, les contenus sont supprimés avant leur chapitre
+    livre_id = connection.execute(
+        select(Chapitre.livre_id).where(Chapitre.id == contenu.chapitre_id)
+    ).scalar()
+    if livre_id is not None:
+        incrementer_version(connection, livre_id)
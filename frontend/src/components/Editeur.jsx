@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { getContenus, genererHistoire, supprimerContenu } from '../services/api';
+import { getContenus, genererHistoireStream, supprimerContenu } from '../services/api';
 
 const NIVEAUX_STRICTESSE = [
   { id: 'libre', label: 'Libre', description: 'Liberté créative totale' },
@@ -13,6 +13,7 @@ function Editeur({ chapitre, onRetour }) {
   const [niveauStrictesse, setNiveauStrictesse] = useState('modere');
   const [loading, setLoading] = useState(true);
   const [generating, setGenerating] = useState(false);
+  const [texteEnCours, setTexteEnCours] = useState('');
   const [expandedPrompts, setExpandedPrompts] = useState({});
   const [expandedResumes, setExpandedResumes] = useState({});
 
@@ -35,23 +36,37 @@ function Editeur({ chapitre, onRetour }) {
     }
   };
 
-  const handleGenerer = async (e) => {
-    e.preventDefault();
-    if (!prompt.trim() || generating) return;
-
+  const lancerGeneration = async (texte, niveau, nouvelleVariante) => {
     setGenerating(true);
+    setTexteEnCours('');
     try {
-      await genererHistoire(chapitre.id, prompt, niveauStrictesse);
-      setPrompt('');
+      await genererHistoireStream(chapitre.id, texte, niveau, (partie, morceau) => {
+        if (partie === 'texte') setTexteEnCours(prev => prev + morceau);
+      }, nouvelleVariante);
       chargerContenus();
+      return true;
     } catch (error) {
       console.error('Erreur:', error);
       alert('Erreur lors de la génération. Vérifie que Claude est bien lancé.');
+      return false;
     } finally {
       setGenerating(false);
+      setTexteEnCours('');
     }
   };
 
+  const handleGenerer = async (e) => {
+    e.preventDefault();
+    if (!prompt.trim() || generating) return;
+    if (await lancerGeneration(prompt, niveauStrictesse, false)) setPrompt('');
+  };
+
+  // Nouvelle version d'un contenu, avec la même description
+  const handleRegenerer = async (contenu) => {
+    if (generating) return;
+    await lancerGeneration(contenu.texte_utilisateur, contenu.niveau_strictesse || 'modere', true);
+  };
+
   const handleSupprimer = async (id) => {
     if (!confirm('Supprimer ce contenu ?')) return;
     try {
@@ -109,7 +124,12 @@ function Editeur({ chapitre, onRetour }) {
       </form>
 
       <div className="contenus">
-        {contenus.length === 0 ? (
+        {generating && texteEnCours && (
+          <div className="contenu-card">
+            <div className="histoire">{texteEnCours}</div>
+          </div>
+        )}
+        {contenus.length === 0 && !generating ? (
           <p className="empty">
             Aucune histoire dans ce chapitre.
             <br />Décris ton idée ci-dessus et laisse Claude créer la magie !
@@ -139,12 +159,23 @@ function Editeur({ chapitre, onRetour }) {
                     </span>
                   )}
                 </div>
-                <button
-                  className="btn-supprimer-contenu"
-                  onClick={() => handleSupprimer(contenu.id)}
-                >
-                  Supprimer
-                </button>
+                <div className="contenu-actions">
+                  {contenu.texte_utilisateur && (
+                    <button
+                      className="btn-regenerer-contenu"
+                      onClick={() => handleRegenerer(contenu)}
+                      disabled={generating}
+                    >
+                      Régénérer
+                    </button>
+                  )}
+                  <button
+                    className="btn-supprimer-contenu"
+                    onClick={() => handleSupprimer(contenu.id)}
+                  >
+                    Supprimer
+                  </button>
+                </div>
               </div>
 
               {expandedPrompts[contenu.id] && (
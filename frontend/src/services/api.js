@@ -17,6 +17,8 @@ export const supprimerStyle = (id) => api.delete(`/styles/${id}`);
 export const getLivres = () => api.get('/livres');
 export const creerLivre = (data) => api.post('/livres', data);
 export const getLivre = (id) => api.get(`/livres/${id}`);
+export const getLivreComplet = (id, exclure = []) =>
+  api.get(`/livres/${id}/complet`, { params: exclure.length ? { exclure: exclure.join(',') } : {} });
 export const supprimerLivre = (id) => api.delete(`/livres/${id}`);
 
 // Chapitres
@@ -30,9 +32,51 @@ export const creerContenu = (chapitreId, data) => api.post(`/chapitres/${chapitr
 export const supprimerContenu = (id) => api.delete(`/contenus/${id}`);
 
 // Génération
-export const genererHistoire = (chapitreId, prompt, niveauStrictesse = 'modere') =>
-  api.post(`/chapitres/${chapitreId}/generer`, { prompt, niveau_strictesse: niveauStrictesse });
+// nouvelleVariante : ne pas partager une génération identique en cours (régénérer)
+export const genererHistoire = (chapitreId, prompt, niveauStrictesse = 'modere', nouvelleVariante = false) =>
+  api.post(`/chapitres/${chapitreId}/generer`, {
+    prompt, niveau_strictesse: niveauStrictesse, nouvelle_variante: nouvelleVariante,
+  });
 export const genererPreview = (prompt) =>
   api.post('/generer-preview', { prompt });
 
+// Génération en streaming (Server-Sent Events)
+// onMorceau(partie, texte) est appelé à chaque morceau ('texte' ou 'resume'),
+// la promesse est résolue avec le contenu enregistré.
+export const genererHistoireStream = async (
+  chapitreId, prompt, niveauStrictesse = 'modere', onMorceau = () => {}, nouvelleVariante = false
+) => {
+  const response = await fetch(`${API_URL}/chapitres/${chapitreId}/generer-stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ prompt, niveau_strictesse: niveauStrictesse, nouvelle_variante: nouvelleVariante }),
+  });
+  if (!response.ok) throw new Error(`Erreur HTTP ${response.status}`);
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let tampon = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    tampon += decoder.decode(value, { stream: true });
+    const blocs = tampon.split('\n\n');
+    tampon = blocs.pop();
+    for (const bloc of blocs) {
+      const evenement = bloc.match(/^event: (.*)$/m)?.[1];
+      const donnees = JSON.parse(bloc.match(/^data: (.*)$/m)?.[1] || '{}');
+      if (evenement === 'fin') return donnees;
+      if (evenement === 'erreur') throw new Error(donnees.detail);
+      onMorceau(evenement, donnees.texte);
+    }
+  }
+  throw new Error('Flux interrompu avant la fin de la génération');
+};
+
+// Jobs de génération (asynchrones)
+export const soumettreGeneration = (chapitreId, prompt, niveauStrictesse = 'modere') =>
+  api.post(`/chapitres/${chapitreId}/jobs`, { prompt, niveau_strictesse: niveauStrictesse });
+export const getJob = (jobId, attendre = 0) =>
+  api.get(`/jobs/${jobId}`, { params: { attendre } });
+
 export default api;